@@ -3,128 +3,902 @@ import os
 import time
 import sys
 import random
-import string
+import argparse
+import threading
+import hashlib
+import hmac
+import itertools
+from collections import OrderedDict
+
+import fraud
+import history
+import limits
+import pins
+import projections
+import statements
+from cassette import Cassette, DEFAULT_NOTES, format_notes
+from events import EVENT_OPS, EventStore
+from journal import Journal
+from money import format_money, parse_amount
+from records import Account, format_timestamp
+from sqlstore import SQLiteLedger
+from stats import AtmStats
+from store import AccountStore
 
 # Global variables
 accounts = {}
+card_index = {}  # card number -> account number
 current_account = None
+current_session = None
 running = True
 ADMIN_PIN = "1234"
-atm_cash = 5000.0  # ATM starts with $5000 cash
-DAILY_LIMIT = 1000.0  # Default daily withdrawal limit
-
+# All money is in integer cents
+atm_cash = 500000  # ATM starts with $5000 cash
+DAILY_LIMIT = 100000  # Default daily withdrawal limit, $1000
+cassette = Cassette(DEFAULT_NOTES, max_amount=DAILY_LIMIT // 100)  # notes making up atm_cash
+atm_stats = AtmStats()  # running totals for the admin dashboard
+journal = None  # Write-ahead journal, enabled with open_journal()
+store = None  # Memory-mapped account file, enabled with open_store()
+event_store = None  # Full event history, enabled with open_event_store()
+database = None  # SQLite ledger, enabled with open_database()
+atm_id = statements.ATM_ID  # printed on receipts
+clock = time.time  # the ledger's clock in epoch seconds; fleet.py swaps in simulated time
+
+# Account numbers are 10 digits, allocated from a sequence. Each sequence
+# number maps to a distinct account number (multiplying by a stride coprime
+# with the space permutes it), so allocation never collides or retries and
+# consecutive accounts don't get consecutive numbers.
+ACCOUNT_NUMBER_BASE = 1_000_000_000
+ACCOUNT_NUMBER_SPACE = 9_000_000_000
+ACCOUNT_NUMBER_STRIDE = 5_915_587_277
+next_account_seq = 0
+closed_day = None  # last day endofday.py closed, as an ISO date, without a store or database
+
+# Wrong PINs in a row before a card is locked, and for how long
+MAX_PIN_ATTEMPTS = 3
+PIN_LOCKOUT_SECONDS = 30 * 60
+# (account number, session) pairs whose PIN was verified recently, most
+# recent last, mapped to the PIN hash they were checked against and a MAC
+# of the PIN under a per-process key: keyed BLAKE2s, a few times cheaper
+# than HMAC-SHA256 on a path every batch transfer takes
+VERIFIED_CACHE_SIZE = 1024
+verified_sessions = OrderedDict()
+verified_lock = threading.Lock()
+pin_checks = {}  # account number -> PIN checks running, each holding a reserved attempt
+_session_mac = hashlib.blake2s(key=os.urandom(32))  # copied for each PIN
+_session_ids = itertools.count(1)
+
+# Two-phase transfers with another ledger (see shards.py): cents held on
+# each account by prepared outgoing transfers, the prepared transfers, and
+# the transfers settled here, journaled so a coordinator can tell after a
+# crash which sides of a transfer already happened
+pending_holds = {}  # account number -> cents
+pending_transfers = {}  # transfer id -> (account number, amount)
+settled_transfers = {}  # transfer id -> "out" once debited here, "in" once credited
+
+# Withdrawal limits: rolling 24-hour limit, per-withdrawal cap and velocity
+# rule (see limits.py). Set limits_engine.policy to change the rules.
+limits_engine = limits.LimitsEngine()
+
+# Streaming fraud scoring (see fraud.py), off until a FraudScorer is set.
+# It sees every recorded transaction and screens withdrawals and transfers.
+fraud_scorer = None
+
+# Locks are always taken in this order: registry_lock, account locks in
+# account-number order, then cash_lock
+registry_lock = threading.Lock()  # account creation and checkpoints
+account_locks = {}  # account number -> lock
+cash_lock = threading.Lock()  # the ATM cash cassette
+_logged = threading.local()  # .seq: the last journal record this thread logged
+
+def account_number_for(seq):
+    return str(ACCOUNT_NUMBER_BASE + seq * ACCOUNT_NUMBER_STRIDE % ACCOUNT_NUMBER_SPACE)
+
+# Callers hold registry_lock
 def generate_account_number():
-    while True:
-        acc_num = str(random.randint(1000, 9999))
+    global next_account_seq
+    while next_account_seq < ACCOUNT_NUMBER_SPACE:
+        acc_num = account_number_for(next_account_seq)
+        next_account_seq += 1
+        # Only imported accounts with their own numbers can be in the way
         if acc_num not in accounts:
             return acc_num
+    raise RuntimeError("Account number space exhausted")
 
 def generate_card_number():
-    existing_cards = {acc['card_number'] for acc in accounts.values()}
     while True:
-        card_num = ''.join(random.choices(string.digits, k=16))
-        if card_num not in existing_cards:
+        card_num = "%016d" % random.randrange(10 ** 16)
+        if card_num not in card_index:
             return card_num
 
-# Create a new account
-def create_account(name, pin, initial_balance=0):
-    account_number = generate_account_number()
-    card_number = generate_card_number()
-
-    accounts[account_number] = {
-        'name': name,
-        'pin': pin,
-        'balance': initial_balance,
-        'card_number': card_number,
-        'transactions': [],
-        'daily_withdrawals': 0.0,
-        'last_withdraw_date': "",
-        'daily_limit': DAILY_LIMIT
-    }
-
-    if initial_balance > 0:
-        add_transaction(account_number, "Deposit", initial_balance, initial_balance)
-
+# Lock guarding one account's balance, daily withdrawals and history
+def _lock_for(account_number):
+    lock = account_locks.get(account_number)
+    if lock is None:
+        lock = account_locks.setdefault(account_number, threading.Lock())
+    return lock
+
+# Add an account to the registry and indexes. Callers hold registry_lock.
+def _register_account(account_number, card_number, name, pin_hash, daily_limit):
+    if store is not None:
+        account = store.create(account_number, card_number, name, pin_hash, daily_limit, next_account_seq)
+    else:
+        account = Account(name, pin_hash, 0, card_number, daily_limit)
+        accounts[account_number] = account
+        card_index[card_number] = account_number
+    atm_stats.record_account()
+    return account
+
+# Create a new account. A precomputed `pin_hash` skips hashing the PIN,
+# e.g. for many demo accounts sharing one. Account and card numbers can be
+# given when they are allocated elsewhere, e.g. by a shard coordinator.
+def create_account(name, pin, initial_balance=0, pin_hash=None, account_number=None, card_number=None):
+    pin_hash = pin_hash or pins.hash_pin(pin)
+    with registry_lock:
+        account_number = account_number or generate_account_number()
+        card_number = card_number or generate_card_number()
+        if database is not None:
+            _db_create_account(account_number, card_number, name, pin_hash, initial_balance)
+            return account_number, card_number
+
+        account = _register_account(account_number, card_number, name, pin_hash, DAILY_LIMIT)
+        _log("create", acc=account_number, card=card_number, name=name, pin_hash=pin_hash,
+             daily_limit=DAILY_LIMIT, seq=next_account_seq)
+
+        if initial_balance > 0:
+            account.balance = initial_balance
+            timestamp = add_transaction(account_number, "Deposit", initial_balance, initial_balance)
+            _log("deposit", acc=account_number, amount=initial_balance, balance=initial_balance, ts=timestamp)
+
+    _acknowledge()
     return account_number, card_number
 
-# Add a transaction
-def add_transaction(account_number, transaction_type, amount, balance_after):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    accounts[account_number]['transactions'].append({
-        'type': transaction_type,
-        'amount': amount,
-        'timestamp': timestamp,
-        'balance_after': balance_after
-    })
+# Today's date as an ISO string. Cached for the current second since
+# formatting dates dominated the cost of busy ledger calls.
+_clock = (None, "")
+def _today():
+    global _clock
+    second = int(clock())
+    if _clock[0] != second:
+        _clock = (second, datetime.date.fromtimestamp(second).isoformat())
+    return _clock[1]
+
+# Add a transaction, timestamped in epoch seconds, and fold it into the
+# account's and the ATM's running aggregates. `counterparty` is the account
+# paid by a Transfer Out.
+def add_transaction(account_number, transaction_type, amount, balance_after, timestamp=None, counterparty=None):
+    if timestamp is None:
+        timestamp = int(clock())
+    if database is not None:
+        volume = database.add_transaction(account_number, transaction_type, amount, balance_after, timestamp)
+        _observe(account_number, transaction_type, amount, timestamp, volume, counterparty)
+        return timestamp
+    account = accounts[account_number]
+    account.transactions.append(transaction_type, amount, balance_after, timestamp)
+    account.volume += amount
+    account.transaction_count += 1
+    _observe(account_number, transaction_type, amount, timestamp, account.volume, counterparty)
+    return timestamp
+
+# Feed a recorded transaction to the dashboard totals and the fraud scorer
+def _observe(account_number, transaction_type, amount, timestamp, volume, counterparty=None):
+    atm_stats.record(account_number, transaction_type, amount, timestamp, volume)
+    if fraud_scorer is not None:
+        fraud_scorer.observe(account_number, transaction_type, amount, timestamp, counterparty)
+
+# A new id for verify_pin's session cache, one per inserted card
+def new_session():
+    return next(_session_ids)
+
+# Verify PIN. Wrong PINs count against the account rather than the session,
+# so reconnecting doesn't reset them: after MAX_PIN_ATTEMPTS in a row the
+# card is locked for PIN_LOCKOUT_SECONDS.
+#
+# With a session id, a PIN already verified for this account in the same
+# session is accepted from the cache without running the KDF again, so the
+# PIN re-entered before each withdrawal, deposit or transfer is cheap.
+#
+# Each check reserves an attempt, under the account's lock, before the KDF
+# runs, and gives it back if the PIN was right. Guesses made at the same
+# time can't all be checked before any of them counts: once the attempts
+# left are taken, further guesses are refused until they're settled.
+def verify_pin(account_number, pin, session=None):
+    account = accounts.get(account_number)
+    if account is None or account.locked_until > clock():
+        return False
+    pin_hash = account.pin_hash
+    key = fingerprint = None
+    if session is not None:
+        key, fingerprint, cached = _session_lookup(account_number, pin, pin_hash, session)
+        if cached:
+            return True
 
-# Verify PIN
-def verify_pin(account_number, pin):
-    return accounts.get(account_number, {}).get('pin') == pin
+    with _lock_for(account_number):
+        if database is not None:
+            if not database.reserve_pin_attempt(account_number, MAX_PIN_ATTEMPTS, int(clock())):
+                return False
+        elif account.locked_until > clock() or account.failed_attempts >= MAX_PIN_ATTEMPTS:
+            return False
+        else:
+            account.failed_attempts += 1
+        pin_checks[account_number] = pin_checks.get(account_number, 0) + 1
+
+    # The KDF runs with no lock held
+    correct = pins.check_pin(pin, pin_hash)
+    if not correct and fraud_scorer is not None:
+        fraud_scorer.pin_failed(account.card_number, int(clock()))
+    with _lock_for(account_number):
+        others = pin_checks.pop(account_number) - 1
+        if others:
+            pin_checks[account_number] = others
+        if database is not None:
+            failed, locked_until, changed = database.settle_pin_attempt(
+                account_number, correct, others, MAX_PIN_ATTEMPTS, int(clock()) + PIN_LOCKOUT_SECONDS)
+        else:
+            failed_before = account.failed_attempts - others - 1
+            locked_before = account.locked_until
+            if correct:
+                # A right PIN clears the failures before it; only the
+                # attempts still being checked stay reserved
+                account.failed_attempts = others
+            elif account.failed_attempts - others >= MAX_PIN_ATTEMPTS:
+                account.failed_attempts = others
+                account.locked_until = int(clock()) + PIN_LOCKOUT_SECONDS
+            failed, locked_until = account.failed_attempts - others, account.locked_until
+            changed = failed != failed_before or locked_until != locked_before
+        # The card may have been locked by a guess settled meanwhile
+        correct = correct and locked_until <= clock()
+        if changed:
+            _log("pin_attempts", acc=account_number, failed=failed, locked_until=locked_until)
+    _acknowledge()
+    if not correct or key is None:
+        return correct
+    with verified_lock:
+        verified_sessions[key] = (pin_hash, fingerprint)
+        verified_sessions.move_to_end(key)
+        if len(verified_sessions) > VERIFIED_CACHE_SIZE:
+            verified_sessions.popitem(last=False)
+    return True
+
+# The session cache key and PIN fingerprint, and whether the pair is cached
+# as verified against `pin_hash`. A hit becomes the most recently used.
+def _session_lookup(account_number, pin, pin_hash, session):
+    key = (account_number, session)
+    mac = _session_mac.copy()
+    mac.update(pin.encode("utf-8"))
+    fingerprint = mac.digest()
+    with verified_lock:
+        cached = verified_sessions.get(key)
+        # A changed PIN leaves the cached hash behind, so it can't match
+        if cached is not None and cached[0] == pin_hash and hmac.compare_digest(cached[1], fingerprint):
+            verified_sessions.move_to_end(key)
+            return key, fingerprint, True
+    return key, fingerprint, False
+
+# Whether verify_pin would accept `pin` for the session from the cache,
+# without running the KDF
+def pin_cached(account_number, pin, session):
+    account = accounts.get(account_number)
+    if account is None or account.locked_until > clock():
+        return False
+    return _session_lookup(account_number, pin, account.pin_hash, session)[2]
+
+# Seconds until a locked card can be used again, 0 if it isn't locked
+def pin_lockout(account_number):
+    return max(0, accounts[account_number].locked_until - int(clock()))
+
+# Query an account's history: one page of at most `limit` transactions and
+# a cursor for the next page. Filters are passed on to history.query(), or
+# for the database to a query that reads only the page.
+def query_transactions(account_number, limit, cursor=None, **filters):
+    if database is not None:
+        return database.query_transactions(account_number, limit, cursor, **filters)
+    return history.page(accounts[account_number].transactions, limit, cursor, **filters)
 
 # Get account by card number
 def get_account_by_card(card_number):
-    for acc_num, acc_data in accounts.items():
-        if acc_data['card_number'] == card_number:
-            return acc_num
-    return None
+    return card_index.get(card_number)
 
 # Deposit
 def deposit(account_number, amount):
     if amount <= 0:
         return False, "Deposit amount must be positive"
-    accounts[account_number]['balance'] += amount
-    add_transaction(account_number, "Deposit", amount, accounts[account_number]['balance'])
-    return True, f"Deposited ${amount:.2f}. New balance: ${accounts[account_number]['balance']:.2f}"
+    if database is not None:
+        return _db_credit(account_number, "Deposit", "deposit", amount)
+    account = accounts[account_number]
+    with _lock_for(account_number):
+        account.balance += amount
+        balance = account.balance
+        timestamp = add_transaction(account_number, "Deposit", amount, balance)
+        _log("deposit", acc=account_number, amount=amount, balance=balance, ts=timestamp)
+    _acknowledge()
+    return True, f"Deposited {format_money(amount)}. New balance: {format_money(balance)}"
 
 # Withdraw
 def withdraw(account_number, amount):
     global atm_cash
-    today_str = datetime.date.today().isoformat()
-    if accounts[account_number]['last_withdraw_date'] != today_str:
-        accounts[account_number]['daily_withdrawals'] = 0.0
-        accounts[account_number]['last_withdraw_date'] = today_str
     if amount <= 0:
         return False, "Withdrawal amount must be positive"
-    if amount > accounts[account_number]['balance']:
-        return False, "Insufficient funds"
-    if accounts[account_number]['daily_withdrawals'] + amount > accounts[account_number]['daily_limit']:
-        return False, f"Daily withdrawal limit of ${accounts[account_number]['daily_limit']:.2f} exceeded"
-    if amount > atm_cash:
-        return False, "ATM does not have enough cash"
-    accounts[account_number]['balance'] -= amount
-    accounts[account_number]['daily_withdrawals'] += amount
-    atm_cash -= amount
-    add_transaction(account_number, "Withdrawal", amount, accounts[account_number]['balance'])
-    return True, f"Withdrew ${amount:.2f}. New balance: ${accounts[account_number]['balance']:.2f}"
+    if fraud_scorer is not None:
+        refusal = fraud_scorer.screen(account_number, accounts[account_number].card_number, "Withdrawal",
+                                      amount, int(clock()))
+        if refusal:
+            return False, refusal
+    if database is not None:
+        return _db_withdraw(account_number, amount)
+    account = accounts[account_number]
+    now = int(clock())
+    # Account lock before cash lock, always, so the two can't deadlock
+    with _lock_for(account_number):
+        if amount > account.balance - pending_holds.get(account_number, 0):
+            return False, "Insufficient funds"
+        refusal = limits_engine.check(account_number, account, amount, now)
+        if refusal:
+            return False, refusal
+        with cash_lock:
+            if amount > atm_cash:
+                return False, "ATM does not have enough cash"
+            # The cassette counts whole dollars
+            notes = cassette.dispense(amount // 100) if amount % 100 == 0 else None
+            if notes is None:
+                return False, "ATM cannot dispense this amount with the notes available"
+            atm_cash -= amount
+            account.balance -= amount
+            # The rolling total and day are kept on the account for stores
+            # that don't keep history (see limits._load_window)
+            account.daily_withdrawals = limits_engine.record(account_number, account, amount, now)
+            account.last_withdraw_date = today_str = _today()
+            balance = account.balance
+            timestamp = add_transaction(account_number, "Withdrawal", amount, balance, now)
+            _log("withdraw", acc=account_number, amount=amount, balance=balance,
+                 daily=account.daily_withdrawals, date=today_str, cash=atm_cash, notes=notes, ts=timestamp)
+    _acknowledge()
+    return True, f"Withdrew {format_money(amount)}. New balance: {format_money(balance)}"
 
 # Transfer
-def transfer(from_account, to_account, amount, pin):
+def transfer(from_account, to_account, amount, pin, session=None):
     if from_account == to_account:
         return False, "Cannot transfer to the same account"
-    if not verify_pin(from_account, pin):
+    if not verify_pin(from_account, pin, session):
         return False, "Invalid PIN"
     if amount <= 0:
         return False, "Transfer amount must be positive"
-    if amount > accounts[from_account]['balance']:
-        return False, "Insufficient funds"
-    accounts[from_account]['balance'] -= amount
-    add_transaction(from_account, "Transfer Out", amount, accounts[from_account]['balance'])
-    accounts[to_account]['balance'] += amount
-    add_transaction(to_account, "Transfer In", amount, accounts[to_account]['balance'])
-    return True, f"Transferred ${amount:.2f} from {from_account} to {to_account}"
+    if fraud_scorer is not None:
+        refusal = fraud_scorer.screen(from_account, accounts[from_account].card_number, "Transfer Out",
+                                      amount, int(clock()), recipient=to_account)
+        if refusal:
+            return False, refusal
+    if database is not None:
+        return _db_transfer(from_account, to_account, amount)
+    source = accounts[from_account]
+    target = accounts[to_account]
+    # Lock both accounts in account-number order so opposing transfers
+    # between the same pair can't deadlock
+    first, second = sorted((from_account, to_account))
+    with _lock_for(first), _lock_for(second):
+        if amount > source.balance - pending_holds.get(from_account, 0):
+            return False, "Insufficient funds"
+        source.balance -= amount
+        timestamp = add_transaction(from_account, "Transfer Out", amount, source.balance,
+                                    counterparty=to_account)
+        target.balance += amount
+        add_transaction(to_account, "Transfer In", amount, target.balance, timestamp)
+        _log("transfer", src=from_account, dst=to_account, amount=amount,
+             src_balance=source.balance, dst_balance=target.balance, ts=timestamp)
+    _acknowledge()
+    return True, f"Transferred {format_money(amount)} from {from_account} to {to_account}"
+
+# Phase one of a transfer to an account on another ledger: check the PIN
+# and funds and hold the amount so nothing else can spend it. The debit
+# only happens on commit, so a hold that is never committed (or is lost
+# with the process) leaves the balance untouched.
+def prepare_transfer_out(transfer_id, account_number, amount, pin, session=None):
+    if not verify_pin(account_number, pin, session):
+        return False, "Invalid PIN"
+    if amount <= 0:
+        return False, "Transfer amount must be positive"
+    account = accounts[account_number]
+    with _lock_for(account_number):
+        held = pending_holds.get(account_number, 0)
+        if amount > account.balance - held:
+            return False, "Insufficient funds"
+        pending_holds[account_number] = held + amount
+        pending_transfers[transfer_id] = (account_number, amount)
+    return True, "Transfer prepared"
+
+def _release_hold(account_number, amount):
+    held = pending_holds[account_number] - amount
+    if held:
+        pending_holds[account_number] = held
+    else:
+        del pending_holds[account_number]
+
+# Phase two: debit the held amount
+def commit_transfer_out(transfer_id, to_account):
+    prepared = pending_transfers.pop(transfer_id, None)
+    if prepared is None:
+        return False, "Unknown transfer"
+    account_number, amount = prepared
+    if database is not None:
+        return _db_transfer_out(transfer_id, account_number, to_account, amount)
+    account = accounts[account_number]
+    with _lock_for(account_number):
+        _release_hold(account_number, amount)
+        account.balance -= amount
+        balance = account.balance
+        timestamp = add_transaction(account_number, "Transfer Out", amount, balance, counterparty=to_account)
+        settled_transfers[transfer_id] = "out"
+        _log("transfer_out", acc=account_number, amount=amount, balance=balance, ts=timestamp,
+             transfer=transfer_id)
+    _acknowledge()
+    return True, f"Transferred {format_money(amount)} from {account_number} to {to_account}"
+
+def abort_transfer_out(transfer_id):
+    prepared = pending_transfers.pop(transfer_id, None)
+    if prepared is None:
+        return False, "Unknown transfer"
+    with _lock_for(prepared[0]):
+        _release_hold(*prepared)
+    return True, "Transfer cancelled"
+
+# Phase one on the receiving side: the account must exist
+def prepare_transfer_in(account_number):
+    if account_number not in accounts:
+        return False, "Account not found"
+    return True, "Transfer prepared"
+
+# The receiving side of a two-phase transfer, once the debit is committed.
+# A transfer id already credited here isn't credited again, so a
+# coordinator can resend credits it isn't sure landed.
+def credit_transfer_in(account_number, amount, transfer_id=None):
+    if transfer_id is not None and settled_transfers.get(transfer_id) == "in":
+        return True, f"Received {format_money(amount)}"
+    if database is not None:
+        _db_credit(account_number, "Transfer In", "transfer_in", amount, transfer=transfer_id)
+        if transfer_id is not None:
+            settled_transfers[transfer_id] = "in"
+        return True, f"Received {format_money(amount)}"
+    account = accounts[account_number]
+    with _lock_for(account_number):
+        account.balance += amount
+        balance = account.balance
+        timestamp = add_transaction(account_number, "Transfer In", amount, balance)
+        if transfer_id is not None:
+            settled_transfers[transfer_id] = "in"
+        _log("transfer_in", acc=account_number, amount=amount, balance=balance, ts=timestamp,
+             transfer=transfer_id)
+    _acknowledge()
+    return True, f"Received {format_money(amount)}"
+
+# Drop the settled transfers numbered up to `last_id` once their coordinator
+# has finished with them, snapshotting so the journal forgets them too
+def forget_transfers(last_id):
+    global settled_transfers
+    with registry_lock:
+        settled_transfers = {transfer_id: side for transfer_id, side in settled_transfers.items()
+                             if transfer_id > last_id}
+    checkpoint()
+
+# Load more notes into the cassette
+def replenish_cash(notes):
+    global atm_cash
+    with cash_lock:
+        event = cassette.replenish(notes)
+        atm_cash += sum(denomination * count for denomination, count in notes.items()) * 100
+        _log("replenish", notes=notes, ts=event['timestamp'])
+    _acknowledge()
+    return event
+
+# Replace the cassette outright, e.g. to set up a simulation
+def load_cash(notes):
+    global cassette, atm_cash
+    with cash_lock:
+        cassette = Cassette(notes, max_amount=DAILY_LIMIT // 100)
+        atm_cash = cassette.total() * 100
+        _log("load_cash", notes=dict(notes), cash=atm_cash)
+    _acknowledge()
 
 # Change PIN
-def change_pin(account_number, old_pin, new_pin):
-    if not verify_pin(account_number, old_pin):
+def change_pin(account_number, old_pin, new_pin, session=None):
+    if not verify_pin(account_number, old_pin, session):
         return False, "Incorrect PIN"
     if len(new_pin) != 4 or not new_pin.isdigit():
         return False, "PIN must be 4 digits"
-    accounts[account_number]['pin'] = new_pin
+    pin_hash = pins.hash_pin(new_pin)
+    with _lock_for(account_number):
+        accounts[account_number].pin_hash = pin_hash
+        _log("pin", acc=account_number, pin_hash=pin_hash)
+    _acknowledge()
     return True, "PIN changed successfully"
 
+# Record a change: as an event in the event store and as a redo record in
+# the journal, whichever are open. Callers hold the locks of everything the
+# record touches so both orders match the order the changes were applied in.
+def _log(op, **fields):
+    if event_store is not None:
+        event_store.append(op, fields)
+    if journal is None:
+        return
+    fields['op'] = op
+    _logged.seq = journal.append(fields)
+
+# Before an operation reports success: wait until the journal records it
+# logged are on disk, then snapshot once enough records have built up.
+# Called with no locks held, so operations on other accounts go on logging
+# into the same group commit meanwhile.
+def _acknowledge():
+    if journal is None:
+        return
+    journal.wait_durable(getattr(_logged, 'seq', 0))
+    if journal.needs_snapshot():
+        checkpoint()
+
+# Re-apply one journal record to the in-memory state
+def _apply_record(record):
+    global atm_cash, cassette, next_account_seq, closed_day
+    op = record['op']
+    if op == "create":
+        _register_account(record['acc'], record['card'], record['name'], record['pin_hash'], record['daily_limit'])
+        next_account_seq = max(next_account_seq, record.get('seq', 0))
+    elif op == "deposit":
+        accounts[record['acc']].balance = record['balance']
+        add_transaction(record['acc'], "Deposit", record['amount'], record['balance'], record['ts'])
+    elif op == "withdraw":
+        account = accounts[record['acc']]
+        account.balance = record['balance']
+        account.daily_withdrawals = record['daily']
+        account.last_withdraw_date = record['date']
+        atm_cash = record['cash']
+        cassette.remove(_note_counts(record['notes']))
+        add_transaction(record['acc'], "Withdrawal", record['amount'], record['balance'], record['ts'])
+    elif op == "transfer":
+        accounts[record['src']].balance = record['src_balance']
+        add_transaction(record['src'], "Transfer Out", record['amount'], record['src_balance'], record['ts'])
+        accounts[record['dst']].balance = record['dst_balance']
+        add_transaction(record['dst'], "Transfer In", record['amount'], record['dst_balance'], record['ts'])
+    elif op in ("transfer_out", "transfer_in"):
+        accounts[record['acc']].balance = record['balance']
+        add_transaction(record['acc'], "Transfer Out" if op == "transfer_out" else "Transfer In",
+                        record['amount'], record['balance'], record['ts'])
+        if record.get('transfer') is not None:
+            settled_transfers[record['transfer']] = "out" if op == "transfer_out" else "in"
+    elif op in ("interest", "fee"):
+        accounts[record['acc']].balance = record['balance']
+        add_transaction(record['acc'], "Interest" if op == "interest" else "Fee",
+                        record['amount'], record['balance'], record['ts'])
+    elif op == "opening":
+        account = accounts[record['acc']]
+        atm_stats.record_batch(0, record['balance'] - account.balance)
+        account.balance = record['balance']
+    elif op == "pin":
+        accounts[record['acc']].pin_hash = record['pin_hash']
+    elif op == "pin_attempts":
+        account = accounts[record['acc']]
+        account.failed_attempts = record['failed']
+        account.locked_until = record['locked_until']
+    elif op == "load_cash":
+        cassette = Cassette(_note_counts(record['notes']), max_amount=DAILY_LIMIT // 100)
+        atm_cash = record['cash']
+    elif op == "replenish":
+        notes = _note_counts(record['notes'])
+        cassette.replenish(notes, record['ts'])
+        atm_cash += sum(denomination * count for denomination, count in notes.items()) * 100
+    elif op == "day_closed":
+        closed_day = record['day']
+
+# JSON turns the denomination keys of a note count dict into strings
+def _note_counts(notes):
+    return {int(denomination): count for denomination, count in notes.items()}
+
+# Restore state from the snapshot and journal in `directory`, then journal
+# every further change there
+def open_journal(directory, **options):
+    global journal, accounts, card_index, atm_cash, cassette, atm_stats, next_account_seq, closed_day
+    if store is not None or database is not None:
+        raise RuntimeError("The journal can't be used with the account store or the database")
+    new_journal = Journal(directory, **options)
+    state, records = new_journal.recover()
+    if state is not None:
+        accounts = {acc_num: Account.from_dict(data) for acc_num, data in state['accounts'].items()}
+        card_index = {acc.card_number: acc_num for acc_num, acc in accounts.items()}
+        atm_cash = state['atm_cash']
+        cassette = Cassette(_note_counts(state['cassette']), max_amount=DAILY_LIMIT // 100)
+        atm_stats = AtmStats.from_dict(state['stats'])
+        next_account_seq = state['next_account_seq']
+        settled_transfers.update(state.get('transfers', ()))
+        closed_day = state.get('closed_day')
+    for record in records:
+        _apply_record(record)
+    limits_engine.clear()
+    new_journal.open()
+    journal = new_journal
+
+# Snapshot the full state so recovery only replays later records. Every
+# lock is held so the snapshot is consistent with the journal position.
+def checkpoint():
+    if event_store is not None:
+        event_store.flush()
+    if journal is None:
+        return
+    with registry_lock:
+        locks = [_lock_for(acc_num) for acc_num in sorted(accounts)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            with cash_lock:
+                journal.snapshot({'accounts': {acc_num: acc.to_dict() for acc_num, acc in accounts.items()},
+                                  'atm_cash': atm_cash, 'cassette': cassette.notes,
+                                  'stats': atm_stats.to_dict(), 'next_account_seq': next_account_seq,
+                                  'transfers': list(settled_transfers.items()), 'closed_day': closed_day})
+        finally:
+            for lock in locks:
+                lock.release()
+
+def close_journal():
+    global journal
+    if journal is not None:
+        journal.close()
+        journal = None
+
+# Keep the full event history in `path`, appending to what's there. A new
+# history starts from the ledger as it stands: accounts, their balances and
+# the cassette. Open it before serving any sessions.
+#
+# With no journal, account store or database, the history is the only
+# record of the ledger, and an existing one is replayed to rebuild it; open
+# it before creating any accounts. Replaying restores the accounts, their
+# histories and the cassette; balances, the cash level and the rolling
+# withdrawal totals are then taken from the projections (see
+# projections.py) folded over the same events. Events are written in
+# batches (see events.py), so without a journal a crash loses the
+# operations of the last batch even though they were acknowledged.
+def open_event_store(path):
+    global event_store
+    with registry_lock, cash_lock:
+        new_store = EventStore(path)
+        if len(new_store) and journal is None and store is None and database is None:
+            if accounts:
+                new_store.close()
+                raise RuntimeError("Open the event history before creating accounts: it holds the ledger")
+            for _, event in new_store.read():
+                record = event._asdict()
+                record['op'] = EVENT_OPS[type(event)]
+                _apply_record(record)
+            _take_projections(new_store)
+        elif not len(new_store):
+            for acc_num, account in accounts.items():
+                new_store.append("create", {'acc': acc_num, 'card': account.card_number, 'name': account.name,
+                                            'pin_hash': account.pin_hash, 'daily_limit': account.daily_limit,
+                                            'seq': 0})
+                if account.balance:
+                    new_store.append("opening", {'acc': acc_num, 'balance': account.balance})
+            new_store.append("load_cash", {'notes': dict(cassette.notes), 'cash': atm_cash})
+        event_store = new_store
+
+# Set balances, cash and the limits engine's withdrawal windows from
+# projections of `history`, the event store being the ledger's only record
+def _take_projections(history):
+    global atm_cash
+    balances = projections.BalanceProjection()
+    balances.catch_up(history)
+    for acc_num, balance in balances.balances.items():
+        accounts[acc_num].balance = balance
+    cash = projections.CashProjection()
+    cash.catch_up(history)
+    if cash.known:
+        atm_cash = cash.cash
+    withdrawals = projections.WithdrawalProjection()
+    withdrawals.catch_up(history)
+    limits_engine.clear()
+    now = int(clock())
+    for acc_num, window in withdrawals.windows.items():
+        window.expire(now)
+        if window.events:
+            limits_engine.windows[acc_num] = window
+    while len(limits_engine.windows) > limits_engine.cache_size:
+        limits_engine.windows.popitem(last=False)
+
+def close_event_store():
+    global event_store
+    if event_store is not None:
+        event_store.close()
+        event_store = None
+
+# Check every balance against the event history: (account number, balance
+# from the history, balance held) for each difference, including balances
+# recorded on events that the history before them doesn't add up to
+def verify_balances():
+    projection = projections.BalanceProjection()
+    projection.catch_up(event_store)
+    return (projection.mismatches + projection.unexplained()
+            + projections.balance_differences(projection, accounts))
+
+# Keep accounts in the memory-mapped account file at `path` instead of in
+# memory. Accounts are read and written in place, so opening a store of any
+# size is immediate. The dashboard totals are saved alongside on close.
+def open_store(path):
+    global store, accounts, card_index, atm_stats, next_account_seq
+    if journal is not None or database is not None:
+        raise RuntimeError("The account store can't be used with the journal or the database")
+    with registry_lock:
+        store = AccountStore(path)
+        accounts = store
+        card_index = store.cards
+        next_account_seq = store.next_seq
+        metadata = store.load_metadata()
+        atm_stats = AtmStats.from_dict(metadata['stats']) if metadata else AtmStats()
+        atm_stats.account_count = len(store)
+        limits_engine.clear()
+
+def close_store():
+    global store, accounts, card_index
+    if store is not None:
+        with registry_lock:
+            store.close({'stats': atm_stats.to_dict()})
+            store = None
+            accounts = {}
+            card_index = {}
+            limits_engine.clear()
+
+# Keep accounts and their histories in the SQLite database at `path`,
+# which other ATM processes can share. Ledger operations become database
+# transactions; the cassette and the dashboard's totals stay with this
+# process, and the totals are saved in the database on close.
+def open_database(path, pool_size=4):
+    global database, accounts, card_index, atm_stats, next_account_seq
+    if journal is not None or store is not None:
+        raise RuntimeError("The database can't be used with the journal or the account store")
+    with registry_lock:
+        database = SQLiteLedger(path, pool_size)
+        accounts = database
+        card_index = database.cards
+        next_account_seq = database.next_seq
+        metadata = database.load_metadata()
+        atm_stats = AtmStats.from_dict(metadata['stats']) if metadata else AtmStats()
+        atm_stats.account_count = len(database)
+        atm_stats.deposits_held = database.balances_held()
+
+def close_database():
+    global database, accounts, card_index
+    if database is not None:
+        with registry_lock:
+            database.close({'stats': atm_stats.to_dict()})
+            database = None
+            accounts = {}
+            card_index = {}
+
+# The ledger operations over the database. Account locks are still taken
+# in the usual order: the database orders the changes themselves, the locks
+# keep _log's records in the same order.
+
+# Callers hold registry_lock
+def _db_create_account(account_number, card_number, name, pin_hash, initial_balance):
+    timestamp = int(clock())
+    database.create(account_number, card_number, name, pin_hash, DAILY_LIMIT, next_account_seq,
+                    initial_balance, timestamp)
+    atm_stats.record_account()
+    _log("create", acc=account_number, card=card_number, name=name, pin_hash=pin_hash,
+         daily_limit=DAILY_LIMIT, seq=next_account_seq)
+    if initial_balance > 0:
+        _observe(account_number, "Deposit", initial_balance, timestamp, initial_balance)
+        _log("deposit", acc=account_number, amount=initial_balance, balance=initial_balance, ts=timestamp)
+
+def _db_credit(account_number, transaction_type, op, amount, **fields):
+    timestamp = int(clock())
+    with _lock_for(account_number):
+        balance, volume = database.credit(account_number, transaction_type, amount, timestamp)
+        _observe(account_number, transaction_type, amount, timestamp, volume)
+        _log(op, acc=account_number, amount=amount, balance=balance, ts=timestamp, **fields)
+    return True, f"Deposited {format_money(amount)}. New balance: {format_money(balance)}"
+
+# The cassette only plans the notes while the withdrawal's transaction is
+# open; they're taken out once it has committed, with cash_lock held
+# throughout so nothing else can plan on the same notes
+def _plan_cash(amount):
+    if amount > atm_cash:
+        return "ATM does not have enough cash", None
+    notes = cassette.plan(amount // 100) if amount % 100 == 0 else None
+    if notes is None:
+        return "ATM cannot dispense this amount with the notes available", None
+    return None, notes
+
+def _db_withdraw(account_number, amount):
+    global atm_cash
+    now = int(clock())
+    with _lock_for(account_number), cash_lock:
+        refusal, done = database.withdraw(account_number, amount, now, pending_holds.get(account_number, 0),
+                                          limits_engine.policy, _plan_cash)
+        if refusal:
+            return False, refusal
+        cassette.remove(done.notes)
+        atm_cash -= amount
+        _observe(account_number, "Withdrawal", amount, now, done.volume)
+        _log("withdraw", acc=account_number, amount=amount, balance=done.balance,
+             daily=done.withdrawn, date=_today(), cash=atm_cash, notes=done.notes, ts=now)
+    return True, f"Withdrew {format_money(amount)}. New balance: {format_money(done.balance)}"
+
+def _db_transfer(from_account, to_account, amount):
+    timestamp = int(clock())
+    first, second = sorted((from_account, to_account))
+    with _lock_for(first), _lock_for(second):
+        moved = database.transfer(from_account, to_account, amount, timestamp,
+                                  pending_holds.get(from_account, 0))
+        if moved is None:
+            return False, "Insufficient funds"
+        (src_balance, src_volume), (dst_balance, dst_volume) = moved
+        _observe(from_account, "Transfer Out", amount, timestamp, src_volume, to_account)
+        _observe(to_account, "Transfer In", amount, timestamp, dst_volume)
+        _log("transfer", src=from_account, dst=to_account, amount=amount,
+             src_balance=src_balance, dst_balance=dst_balance, ts=timestamp)
+    return True, f"Transferred {format_money(amount)} from {from_account} to {to_account}"
+
+def _db_transfer_out(transfer_id, account_number, to_account, amount):
+    timestamp = int(clock())
+    with _lock_for(account_number):
+        _release_hold(account_number, amount)
+        debited = database.debit(account_number, "Transfer Out", amount, timestamp,
+                                 pending_holds.get(account_number, 0))
+        # The hold kept this process from spending the amount, not another
+        # process sharing the database
+        if debited is None:
+            return False, "Insufficient funds"
+        balance, volume = debited
+        _observe(account_number, "Transfer Out", amount, timestamp, volume, to_account)
+        settled_transfers[transfer_id] = "out"
+        _log("transfer_out", acc=account_number, amount=amount, balance=balance, ts=timestamp,
+             transfer=transfer_id)
+    return True, f"Transferred {format_money(amount)} from {account_number} to {to_account}"
+
+# Terminal effects. Every simulated wait and screen clear in the UI goes
+# through the active terminal so scripted sessions can skip or record them.
+class RealisticTerminal:
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def clear(self):
+        os.system('cls' if os.name == 'nt' else 'clear')
+
+class FastTerminal:
+    def sleep(self, seconds):
+        pass
+
+    def clear(self):
+        pass
+
+# Logs each delay and clear instead of performing it
+class RecordedTerminal:
+    def __init__(self):
+        self.events = []
+
+    def sleep(self, seconds):
+        self.events.append(('sleep', seconds))
+
+    def clear(self):
+        self.events.append(('clear', None))
+
+    # Wall time the recorded session would have spent waiting
+    def simulated_time(self):
+        return sum(seconds for kind, seconds in self.events if kind == 'sleep')
+
+TERMINAL_MODES = {
+    'realistic': RealisticTerminal,
+    'fast': FastTerminal,
+    'recorded': RecordedTerminal,
+}
+terminal = RealisticTerminal()
+
+def set_terminal_mode(mode):
+    global terminal
+    terminal = TERMINAL_MODES[mode]()
+    return terminal
+
+# Simulated delay
+def delay(seconds):
+    terminal.sleep(seconds)
+
 # Clear screen
 def clear_screen():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    terminal.clear()
 
 # Show message
 def show_message(message, error=False):
@@ -143,26 +917,38 @@ def display_welcome_screen():
     print("(Type 'admin' to access admin panel or 'exit' to quit)")
 
 # PIN verification
+# Attempts are counted on the account, so they carry over between sessions
 def pin_verification(account_number):
-    attempts = 3
-    while attempts > 0:
+    account = accounts[account_number]
+    while not pin_lockout(account_number):
         clear_screen()
         print("=" * 60)
         print(" " * 20 + "PIN VERIFICATION" + " " * 20)
         print("=" * 60)
-        print(f"\nCard: **** **** **** {accounts[account_number]['card_number'][-4:]}")
+        print(f"\nCard: **** **** **** {account.card_number[-4:]}")
         print("\nPlease enter your PIN:")
-        print(f"Attempts remaining: {attempts}")
+        print(f"Attempts remaining: {MAX_PIN_ATTEMPTS - account.failed_attempts}")
         pin = input("\n> ").strip()
-        if verify_pin(account_number, pin):
+        if verify_pin(account_number, pin, current_session):
             return True
-        else:
-            attempts -= 1
-            if attempts > 0:
-                show_message("Incorrect PIN. Please try again.", error=True)
-                time.sleep(2)
+        if not pin_lockout(account_number):
+            show_message("Incorrect PIN. Please try again.", error=True)
+            delay(2)
     show_message("Too many incorrect attempts. Card retained for security.", error=True)
-    time.sleep(3)
+    delay(3)
+    return False
+
+# A wrong PIN inside the menus. Returns True if it locked the card, which
+# ends the session.
+def pin_rejected():
+    global current_account
+    if pin_lockout(current_account):
+        show_message("Too many incorrect attempts. Card retained for security.", error=True)
+        delay(3)
+        current_account = None
+        return True
+    show_message("Incorrect PIN.", error=True)
+    delay(2)
     return False
 
 # Main menu
@@ -173,7 +959,7 @@ def main_menu():
         print("=" * 60)
         print(" " * 20 + "MAIN MENU" + " " * 20)
         print("=" * 60)
-        print(f"\nWelcome, {accounts[current_account]['name']}")
+        print(f"\nWelcome, {accounts[current_account].name}")
         print(f"Account: {current_account}")
         print("\nPlease select an option:")
         print("1. Check Balance")
@@ -200,7 +986,7 @@ def main_menu():
             exit_session()
         else:
             show_message("Invalid option. Please try again.", error=True)
-            time.sleep(2)
+            delay(2)
 
 # Check balance
 def check_balance():
@@ -209,7 +995,7 @@ def check_balance():
     print(" " * 20 + "ACCOUNT BALANCE" + " " * 20)
     print("=" * 60)
     print(f"\nAccount: {current_account}")
-    print(f"Available Balance: ${accounts[current_account]['balance']:.2f}")
+    print(f"Available Balance: {format_money(accounts[current_account].balance)}")
     input("\nPress Enter to continue...")
 
 # Withdraw cash (re-prompt)
@@ -220,8 +1006,8 @@ def withdraw_cash():
         print(" " * 20 + "WITHDRAW CASH" + " " * 20)
         print("=" * 60)
         print(f"\nAccount: {current_account}")
-        print(f"Available Balance: ${accounts[current_account]['balance']:.2f}")
-        print(f"ATM Cash Available: ${atm_cash:.2f}")
+        print(f"Available Balance: {format_money(accounts[current_account].balance)}")
+        print(f"ATM Cash Available: {format_money(atm_cash)} ({format_notes(cassette.notes)})")
         print("\nSelect amount:")
         print("1. $20")
         print("2. $50")
@@ -231,31 +1017,31 @@ def withdraw_cash():
         print("6. Cancel")
         choice = input("\n> ").strip()
         amount = 0
-        if choice == "1": amount = 20
-        elif choice == "2": amount = 50
-        elif choice == "3": amount = 100
-        elif choice == "4": amount = 200
+        if choice == "1": amount = 2000
+        elif choice == "2": amount = 5000
+        elif choice == "3": amount = 10000
+        elif choice == "4": amount = 20000
         elif choice == "5":
             try:
-                amount = float(input("\nEnter amount: $"))
+                amount = parse_amount(input("\nEnter amount: $"))
                 if amount <= 0:
                     show_message("Amount must be positive.", error=True)
-                    time.sleep(2)
+                    delay(2)
                     continue
             except ValueError:
                 show_message("Invalid amount.", error=True)
-                time.sleep(2)
+                delay(2)
                 continue
         elif choice == "6":
             return
         else:
             show_message("Invalid option.", error=True)
-            time.sleep(2)
+            delay(2)
             continue
         pin = input("\nEnter PIN for verification: ")
-        if not verify_pin(current_account, pin):
-            show_message("Incorrect PIN.", error=True)
-            time.sleep(2)
+        if not verify_pin(current_account, pin, current_session):
+            if pin_rejected():
+                return
             continue
         success, message = withdraw(current_account, amount)
         if success:
@@ -263,7 +1049,7 @@ def withdraw_cash():
             process_withdrawal(amount)
         else:
             show_message(message, error=True)
-            time.sleep(2)
+            delay(2)
             continue
         break
 
@@ -275,21 +1061,21 @@ def deposit_cash():
         print(" " * 20 + "DEPOSIT CASH" + " " * 20)
         print("=" * 60)
         print(f"\nAccount: {current_account}")
-        print(f"Current Balance: ${accounts[current_account]['balance']:.2f}")
+        print(f"Current Balance: {format_money(accounts[current_account].balance)}")
         try:
-            amount = float(input("\nEnter amount to deposit: $"))
+            amount = parse_amount(input("\nEnter amount to deposit: $"))
             if amount <= 0:
                 show_message("Amount must be positive.", error=True)
-                time.sleep(2)
+                delay(2)
                 continue
         except ValueError:
             show_message("Invalid amount.", error=True)
-            time.sleep(2)
+            delay(2)
             continue
         pin = input("\nEnter PIN for verification: ")
-        if not verify_pin(current_account, pin):
-            show_message("Incorrect PIN.", error=True)
-            time.sleep(2)
+        if not verify_pin(current_account, pin, current_session):
+            if pin_rejected():
+                return
             continue
         success, message = deposit(current_account, amount)
         if success:
@@ -299,7 +1085,7 @@ def deposit_cash():
                 print_receipt("Deposit", amount)
         else:
             show_message(message, error=True)
-            time.sleep(2)
+            delay(2)
             continue
         break
 
@@ -311,28 +1097,28 @@ def transfer_funds():
         print(" " * 20 + "TRANSFER FUNDS" + " " * 20)
         print("=" * 60)
         print(f"\nFrom Account: {current_account}")
-        print(f"Available Balance: ${accounts[current_account]['balance']:.2f}")
+        print(f"Available Balance: {format_money(accounts[current_account].balance)}")
         to_account = input("\nEnter recipient account number: ").strip()
         if to_account not in accounts:
             show_message("Account not found.", error=True)
-            time.sleep(2)
+            delay(2)
             continue
         try:
-            amount = float(input("\nEnter amount to transfer: $"))
+            amount = parse_amount(input("\nEnter amount to transfer: $"))
             if amount <= 0:
                 show_message("Amount must be positive.", error=True)
-                time.sleep(2)
+                delay(2)
                 continue
         except ValueError:
             show_message("Invalid amount.", error=True)
-            time.sleep(2)
+            delay(2)
             continue
         pin = input("\nEnter PIN for verification: ")
-        if not verify_pin(current_account, pin):
-            show_message("Incorrect PIN.", error=True)
-            time.sleep(2)
+        if not verify_pin(current_account, pin, current_session):
+            if pin_rejected():
+                return
             continue
-        success, message = transfer(current_account, to_account, amount, pin)
+        success, message = transfer(current_account, to_account, amount, pin, current_session)
         if success:
             show_message(message)
             receipt = input("\nWould you like a receipt? (y/n): ").lower()
@@ -340,7 +1126,7 @@ def transfer_funds():
                 print_receipt("Transfer", amount, f"To: {to_account}")
         else:
             show_message(message, error=True)
-            time.sleep(2)
+            delay(2)
             continue
         break
 
@@ -353,15 +1139,15 @@ def process_withdrawal(amount):
 
     # Simulate cash dispensing
     print("\nPlease wait while your cash is being dispensed...")
-    time.sleep(1)
+    delay(1)
     print("\nDispensing cash...")
 
     # Simulate counting and dispensing
     for i in range(3):
         print(".", end="")
-        time.sleep(0.5)
+        delay(0.5)
 
-    print(f"\n\n${amount:.2f} has been dispensed.")
+    print(f"\n\n{format_money(amount)} has been dispensed.")
     print("\nPlease take your cash.")
     print("\nReceipt will be printed.")
 
@@ -380,19 +1166,14 @@ def view_transaction_history():
     print("=" * 60)
     print(f"\nAccount: {current_account}")
 
-    transactions = accounts[current_account]['transactions']
+    # Last 10 transactions, newest first from the query API
+    transactions, _ = query_transactions(current_account, 10, newest_first=True)
 
     if not transactions:
         print("\nNo transactions found.")
     else:
         print("\nRecent Transactions:")
-        print("-" * 60)
-        print(f"{'Type':<12} {'Amount':<10} {'Balance':<15} {'Date & Time'}")
-        print("-" * 60)
-
-        # Show last 10 transactions
-        for transaction in transactions[-10:]:
-            print(f"{transaction['type']:<12} ${transaction['amount']:<9.2f} ${transaction['balance_after']:<14.2f} {transaction['timestamp']}")
+        sys.stdout.write("".join(statements.history_lines(reversed(transactions))))
 
     input("\nPress Enter to continue...")
 
@@ -406,33 +1187,32 @@ def change_pin_menu():
 
     # Verify current PIN
     current_pin = input("\nEnter current PIN: ")
-    if not verify_pin(current_account, current_pin):
-        show_message("Incorrect PIN.", error=True)
-        time.sleep(2)
+    if not verify_pin(current_account, current_pin, current_session):
+        pin_rejected()
         return
 
     # Enter new PIN
     new_pin = input("\nEnter new PIN (4 digits): ")
     if len(new_pin) != 4 or not new_pin.isdigit():
         show_message("PIN must be 4 digits.", error=True)
-        time.sleep(2)
+        delay(2)
         return
 
     # Confirm new PIN
     confirm_pin = input("\nConfirm new PIN: ")
     if new_pin != confirm_pin:
         show_message("PINs do not match.", error=True)
-        time.sleep(2)
+        delay(2)
         return
 
     # Update PIN
-    success, message = change_pin(current_account, current_pin, new_pin)
+    success, message = change_pin(current_account, current_pin, new_pin, current_session)
     if success:
         show_message(message)
     else:
         show_message(message, error=True)
 
-    time.sleep(2)
+    delay(2)
 
 def exit_session():
     global current_account
@@ -445,29 +1225,19 @@ def exit_session():
     print("Please take your card.")
 
     # Simulate card return
-    time.sleep(2)
+    delay(2)
     print("\nYour card is being returned...")
-    time.sleep(1)
+    delay(1)
 
     current_account = None
-    time.sleep(1)
+    delay(1)
 
 # Print receipt
 def print_receipt(transaction_type, amount, additional_info=""):
     clear_screen()
-    print("=" * 60)
-    print(" " * 15 + "ATM TRANSACTION RECEIPT" + " " * 15)
-    print("=" * 60)
-    print(f"\nDate: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"ATM ID: ATM001")
-    print(f"Card: **** **** **** {accounts[current_account]['card_number'][-4:]}")
-    print(f"Account: {current_account}")
-    print(f"\nTransaction: {transaction_type}")
-    if additional_info:
-        print(additional_info)
-    print(f"Amount: ${amount:.2f}")
-    print(f"Balance: ${accounts[current_account]['balance']:.2f}")
-    print("\nThank you for using our ATM!")
+    sys.stdout.write("".join(statements.receipt_lines(current_account, accounts[current_account],
+                                                      transaction_type, amount, additional_info,
+                                                      atm_id=atm_id)))
 
     input("\nPress Enter to continue...")
 
@@ -492,10 +1262,10 @@ def admin_panel():
             attempts -= 1
             if attempts > 0:
                 show_message("Incorrect PIN. Please try again.", error=True)
-                time.sleep(2)
+                delay(2)
 
     show_message("Too many incorrect attempts. Returning to welcome screen.", error=True)
-    time.sleep(2)
+    delay(2)
 
 # Admin menu
 def admin_menu():
@@ -507,7 +1277,9 @@ def admin_menu():
         print("\nPlease select an option:")
         print("1. Create New Account")
         print("2. View All Accounts")
-        print("3. Exit Admin Panel")
+        print("3. Replenish Cash")
+        print("4. Dashboard")
+        print("5. Exit Admin Panel")
 
         choice = input("\n> ").strip()
 
@@ -516,10 +1288,14 @@ def admin_menu():
         elif choice == "2":
             view_all_accounts()
         elif choice == "3":
+            replenish_cash_menu()
+        elif choice == "4":
+            view_dashboard()
+        elif choice == "5":
             return
         else:
             show_message("Invalid option. Please try again.", error=True)
-            time.sleep(2)
+            delay(2)
 
 # Create account menu
 def create_account_menu():
@@ -531,26 +1307,26 @@ def create_account_menu():
     name = input("\nEnter full name: ").strip()
     if not name:
         show_message("Name cannot be empty.", error=True)
-        time.sleep(2)
+        delay(2)
         return
 
     pin = input("\nCreate a 4-digit PIN: ").strip()
     if len(pin) != 4 or not pin.isdigit():
         show_message("PIN must be 4 digits.", error=True)
-        time.sleep(2)
+        delay(2)
         return
 
     confirm_pin = input("\nConfirm PIN: ").strip()
     if pin != confirm_pin:
         show_message("PINs do not match.", error=True)
-        time.sleep(2)
+        delay(2)
         return
 
     try:
-        initial_deposit = float(input("\nEnter initial deposit (optional, press Enter to skip): ") or "0")
+        initial_deposit = parse_amount(input("\nEnter initial deposit (optional, press Enter to skip): ") or "0")
         if initial_deposit < 0:
             show_message("Initial deposit cannot be negative.", error=True)
-            time.sleep(2)
+            delay(2)
             return
     except ValueError:
         show_message("Invalid amount. Setting initial deposit to $0.", error=True)
@@ -561,7 +1337,79 @@ def create_account_menu():
     show_message(f"Account created successfully!")
     print(f"\nAccount Number: {account_number}")
     print(f"Card Number: {card_number}")
-    print(f"Initial Balance: ${initial_deposit:.2f}")
+    print(f"Initial Balance: {format_money(initial_deposit)}")
+
+    input("\nPress Enter to continue...")
+
+# Replenish cash menu
+def replenish_cash_menu():
+    clear_screen()
+    print("=" * 60)
+    print(" " * 20 + "REPLENISH CASH" + " " * 20)
+    print("=" * 60)
+    print(f"\nCash in ATM: {format_money(atm_cash)}")
+    print(f"Notes loaded: {format_notes(cassette.notes)}")
+
+    notes = {}
+    for denomination in cassette.denominations:
+        try:
+            count = int(input(f"\nNumber of ${denomination} notes to add (Enter for none): ") or "0")
+        except ValueError:
+            show_message("Invalid note count.", error=True)
+            delay(2)
+            return
+        if count < 0:
+            show_message("Note count cannot be negative.", error=True)
+            delay(2)
+            return
+        if count:
+            notes[denomination] = count
+
+    if not notes:
+        show_message("No notes added.")
+        delay(2)
+        return
+
+    replenish_cash(notes)
+    show_message(f"Cash replenished. ATM now holds {format_money(atm_cash)}.")
+    print(f"Notes loaded: {format_notes(cassette.notes)}")
+    input("\nPress Enter to continue...")
+
+# Dashboard of live totals, read straight from the running aggregates
+def view_dashboard():
+    clear_screen()
+    print("=" * 60)
+    print(" " * 20 + "DASHBOARD" + " " * 20)
+    print("=" * 60)
+    now = int(clock())
+
+    print(f"\nAccounts: {atm_stats.account_count}")
+    print(f"Deposits Held: {format_money(atm_stats.deposits_held)}")
+    print(f"Transactions: {atm_stats.transaction_count}")
+    print(f"ATM Cash: {format_money(atm_cash)} ({format_notes(cassette.notes)})")
+    print(f"Cash Dispensed Today: {format_money(atm_stats.dispensed_on(now))}")
+
+    print("\nWithdrawals per Hour (last 6 hours):")
+    for hour_start, count, amount in atm_stats.withdrawals_per_hour(now)[-6:]:
+        print(f"  {format_timestamp(hour_start)[11:16]}  {count:>6}  {format_money(amount):>14}")
+
+    print("\nTransactions per Minute (last 5 minutes):")
+    for minute_start, count in atm_stats.throughput(now, 5):
+        print(f"  {format_timestamp(minute_start)[11:16]}  {count:>6}")
+
+    print("\nTop Accounts by Volume:")
+    top = atm_stats.top_accounts()
+    if not top:
+        print("  No transactions yet.")
+    for acc_num, volume in top:
+        print(f"  {acc_num:<12} {accounts[acc_num].name:<20} {format_money(volume):>14}")
+
+    if fraud_scorer is not None:
+        print(f"\nFraud Alerts: {fraud_scorer.flagged} flagged, {fraud_scorer.blocked} blocked")
+        for alert in list(fraud_scorer.alerts)[-5:]:
+            print(f"  {format_timestamp(alert.timestamp)[11:16]}  {alert.account:<12} {alert.type:<12} "
+                  f"{format_money(alert.amount):>12}  {alert.score:.2f} {', '.join(alert.reasons)}"
+                  f"{' BLOCKED' if alert.blocked else ''}")
 
     input("\nPress Enter to continue...")
 
@@ -581,7 +1429,7 @@ def view_all_accounts():
         print("-" * 80)
 
         for acc_num, acc_data in accounts.items():
-            print(f"{acc_num:<12} {acc_data['name']:<20} {acc_data['card_number'][-4:]:<20} ${acc_data['balance']:<14.2f}")
+            print(f"{acc_num:<12} {acc_data.name:<20} {acc_data.card_number[-4:]:<20} {format_money(acc_data.balance):<15}")
 
     input("\nPress Enter to continue...")
 
@@ -591,13 +1439,17 @@ def shutdown():
     print(" " * 20 + "SHUTTING DOWN" + " " * 20)
     print("=" * 60)
     print("\nATM is shutting down...")
-    time.sleep(2)
+    delay(2)
     global running
     running = False
+    close_event_store()
+    close_journal()
+    close_store()
+    close_database()
     clear_screen()
 
 def main():
-    global current_account
+    global current_account, current_session
     while running:
         display_welcome_screen()
         card_input = input("\n> ").strip()
@@ -610,16 +1462,67 @@ def main():
             continue
         if len(card_input) != 16 or not card_input.isdigit():
             show_message("Invalid card number. Please try again.", error=True)
-            time.sleep(2)
+            delay(2)
             continue
         account_number = get_account_by_card(card_input)
         if not account_number:
             show_message("Card not recognized. Please try again.", error=True)
-            time.sleep(2)
+            delay(2)
             continue
         current_account = account_number
+        current_session = new_session()
         if pin_verification(current_account):
             main_menu()
 
 if __name__ == "__main__":
-    main()    
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="ATM simulator")
+    parser.add_argument("--journal", metavar="DIR",
+                        help="persist state in a write-ahead journal in DIR")
+    parser.add_argument("--store", metavar="FILE",
+                        help="keep accounts in a memory-mapped account file instead of in memory")
+    parser.add_argument("--database", metavar="FILE",
+                        help="keep accounts in a SQLite database that several ATMs can share")
+    parser.add_argument("--events", metavar="FILE",
+                        help="keep the full event history in FILE (see projections.py to check it)")
+    parser.add_argument("--import", dest="import_file", metavar="FILE",
+                        help="bulk import accounts from a CSV or binary account file first")
+    parser.add_argument("--terminal", choices=sorted(TERMINAL_MODES), default='realistic',
+                        help="'fast' skips simulated delays and screen clears, 'recorded' logs them")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="write Prometheus metrics to PATH every 10 seconds")
+    parser.add_argument("--max-withdrawal", type=parse_amount, metavar="DOLLARS",
+                        help="cap on a single withdrawal")
+    parser.add_argument("--withdrawals-per-hour", type=int, metavar="N",
+                        help="refuse more than N withdrawals per account in an hour")
+    parser.add_argument("--fraud", action="store_true",
+                        help="score withdrawals and transfers and flag suspicious ones on the dashboard")
+    parser.add_argument("--fraud-block", type=float, metavar="SCORE",
+                        help="also refuse operations scoring SCORE or more (implies --fraud)")
+    args = parser.parse_args()
+    limits_engine.policy = limits.LimitPolicy(args.max_withdrawal, args.withdrawals_per_hour)
+    if args.fraud or args.fraud_block is not None:
+        fraud_scorer = fraud.FraudScorer(fraud.FraudPolicy(block_score=args.fraud_block))
+    # Modules that import Atm must see this running module, not a second copy
+    sys.modules.setdefault("Atm", sys.modules[__name__])
+    set_terminal_mode(args.terminal)
+    if args.metrics_port or args.metrics_file:
+        import metrics
+        metrics.enable()
+        if args.metrics_port:
+            metrics.start_http_server(args.metrics_port)
+        if args.metrics_file:
+            metrics.start_file_dump(args.metrics_file)
+    if args.journal:
+        open_journal(args.journal)
+    if args.store:
+        open_store(args.store)
+    if args.database:
+        open_database(args.database)
+    if args.events:
+        open_event_store(args.events)
+    if args.import_file:
+        import provisioning
+        provisioning.import_file(args.import_file)
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import csv
+import json
+import sys
+
+import Atm
+from money import format_money, parse_amount
+
+# Commands are objects (JSONL) or rows (CSV) with the fields op, account,
+# to_account, amount, pin, new_pin and name, as each operation needs them
+RESULT_FIELDS = ['line', 'op', 'ok', 'message']
+# A batch is one trusted session, so each account's PIN is only run through
+# the KDF the first time it is checked
+BATCH_SESSION = Atm.new_session()
+
+
+def _create(command):
+    account_number, card_number = Atm.create_account(
+        command['name'], command['pin'], parse_amount(command.get('amount') or 0))
+    return True, f"Created account {account_number} with card {card_number}"
+
+
+def _deposit(command):
+    return Atm.deposit(command['account'], parse_amount(command['amount']))
+
+
+def _withdraw(command):
+    return Atm.withdraw(command['account'], parse_amount(command['amount']))
+
+
+def _transfer(command):
+    to_account = command['to_account']
+    if to_account not in Atm.accounts:
+        return False, "Account not found"
+    return Atm.transfer(command['account'], to_account, parse_amount(command['amount']), command['pin'],
+                        BATCH_SESSION)
+
+
+def _change_pin(command):
+    return Atm.change_pin(command['account'], command['pin'], command['new_pin'], BATCH_SESSION)
+
+
+def _balance(command):
+    return True, f"Balance: {format_money(Atm.accounts[command['account']].balance)}"
+
+
+HANDLERS = {
+    'create': _create,
+    'deposit': _deposit,
+    'withdraw': _withdraw,
+    'transfer': _transfer,
+    'change_pin': _change_pin,
+    'balance': _balance,
+}
+
+
+# Run one command dict through the ledger, turning bad input into a failed
+# result instead of an exception so one bad line can't stop the batch
+def run_command(command):
+    handler = HANDLERS.get(command.get('op'))
+    if handler is None:
+        return False, f"Unknown operation: {command.get('op')}"
+    try:
+        return handler(command)
+    except KeyError as e:
+        return False, f"Unknown account or missing field: {e.args[0]}"
+    except (TypeError, ValueError):
+        return False, "Invalid amount"
+
+
+def read_commands(stream, fmt):
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+# Run every command from `source` and write one result per command to
+# `sink`. Nothing here prompts, clears the screen or sleeps, so the ledger
+# runs at full speed. Returns the number of commands processed.
+def process(source, sink, input_format='jsonl', output_format='jsonl', chunk_size=4096):
+    writer = None
+    if output_format == 'csv':
+        writer = csv.writer(sink)
+        writer.writerow(RESULT_FIELDS)
+    quote = json.encoder.encode_basestring
+    buffer = []
+    count = 0
+    for count, command in enumerate(read_commands(source, input_format), 1):
+        ok, message = run_command(command)
+        if writer is not None:
+            buffer.append((count, command.get('op'), ok, message))
+        else:
+            buffer.append('{"line":%d,"op":%s,"ok":%s,"message":%s}' % (
+                count, quote(str(command.get('op'))), 'true' if ok else 'false', quote(message)))
+        if len(buffer) >= chunk_size:
+            _flush(sink, buffer, writer)
+            buffer = []
+    _flush(sink, buffer, writer)
+    return count
+
+
+def _flush(sink, buffer, writer):
+    if not buffer:
+        return
+    if writer is not None:
+        writer.writerows(buffer)
+    else:
+        buffer.append('')
+        sink.write('\n'.join(buffer))
+
+
+def _format_for(path, explicit):
+    if explicit:
+        return explicit
+    return 'csv' if path and path.endswith('.csv') else 'jsonl'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run ATM transactions from a command file without the UI")
+    parser.add_argument("input", nargs="?", help="command file (default: stdin)")
+    parser.add_argument("-o", "--output", help="results file (default: stdout)")
+    parser.add_argument("--input-format", choices=['jsonl', 'csv'])
+    parser.add_argument("--output-format", choices=['jsonl', 'csv'])
+    parser.add_argument("--journal", metavar="DIR", help="persist state in a write-ahead journal in DIR")
+    args = parser.parse_args(argv)
+
+    if args.journal:
+        Atm.open_journal(args.journal)
+    source = open(args.input, newline='', encoding='utf-8') if args.input else sys.stdin
+    sink = open(args.output, 'w', newline='', encoding='utf-8', buffering=1 << 20) if args.output else sys.stdout
+    try:
+        process(source, sink, _format_for(args.input, args.input_format),
+                _format_for(args.output, args.output_format))
+    finally:
+        if args.input:
+            source.close()
+        if args.output:
+            sink.close()
+        Atm.close_journal()
+
+
+if __name__ == "__main__":
+    main()
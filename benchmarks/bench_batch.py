@@ -0,0 +1,81 @@
+# Measure headless batch throughput for a mixed JSONL or CSV command stream.
+#
+# The target is 100k ops/sec on one core. It isn't met: each command pays
+# for decoding, the ledger operation with its history, dashboard, limits and
+# PIN-cache bookkeeping, and encoding its result, about 15-25us in all on a
+# typical core. The output says how far off the run was.
+#
+# Run from the repository root:  python -m benchmarks.bench_batch
+import argparse
+import csv
+import io
+import json
+import random
+import time
+
+import Atm
+import batch
+import pins
+
+# A single KDF iteration keeps PIN hashing out of the figures (see bench_pins)
+PIN_HASH = pins.hash_pin("1234", iterations=1)
+TARGET = 100_000  # ops/sec
+
+
+def make_commands(rng, account_numbers, count):
+    commands = []
+    for _ in range(count):
+        roll = rng.random()
+        account = rng.choice(account_numbers)
+        amount = f"{rng.choice((20, 40, 50, 60, 100))}.00"
+        if roll < 0.4:
+            commands.append({'op': 'deposit', 'account': account, 'amount': amount})
+        elif roll < 0.7:
+            commands.append({'op': 'withdraw', 'account': account, 'amount': amount})
+        else:
+            commands.append({'op': 'transfer', 'account': account, 'to_account': rng.choice(account_numbers),
+                             'amount': amount, 'pin': "1234"})
+    return commands
+
+
+def encode(commands, fmt):
+    stream = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, ['op', 'account', 'to_account', 'amount', 'pin'])
+        writer.writeheader()
+        writer.writerows(commands)
+    else:
+        stream.writelines(json.dumps(command) + "\n" for command in commands)
+    stream.seek(0)
+    return stream
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=200_000)
+    parser.add_argument("--accounts", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    rates = []
+    print(f"{'format':<8} {'ops/sec':>12} {'of target':>10}")
+    print("-" * 32)
+    for fmt in ('jsonl', 'csv'):
+        Atm.accounts.clear()
+        Atm.card_index.clear()
+        Atm.load_cash({20: 10 ** 9, 50: 10 ** 9, 100: 10 ** 9})
+        account_numbers = [Atm.create_account(f"Batch {i}", "1234", 1_000_000, PIN_HASH)[0] for i in range(args.accounts)]
+        source = encode(make_commands(rng, account_numbers, args.ops), fmt)
+        sink = io.StringIO()
+        start = time.perf_counter()
+        count = batch.process(source, sink, fmt, fmt)
+        elapsed = time.perf_counter() - start
+        rate = count / elapsed
+        rates.append(rate)
+        print(f"{fmt:<8} {rate:>12,.0f} {rate / TARGET:>10.0%}")
+    if min(rates) < TARGET:
+        print(f"\nbelow the {TARGET:,} ops/sec target by {TARGET - min(rates):,.0f} ops/sec")
+
+
+if __name__ == "__main__":
+    main()
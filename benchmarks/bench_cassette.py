@@ -0,0 +1,80 @@
+# Time the cassette's table-driven note solver against brute-force search
+# across cassette sizes and maximum withdrawal amounts, planning on a fixed
+# cassette and dispensing from one whose counts go down (refilled, untimed,
+# whenever it can't pay).
+#
+# Run from the repository root:  python -m benchmarks.bench_cassette
+import argparse
+import random
+import time
+
+from cassette import Cassette
+
+
+# Try every count of every note, largest first; what the table replaces
+def brute_force_plan(notes, amount):
+    denominations = sorted(notes, reverse=True)
+
+    def search(index, remaining):
+        if remaining == 0:
+            return {}
+        if index == len(denominations):
+            return None
+        denomination = denominations[index]
+        for count in range(min(notes[denomination], remaining // denomination), -1, -1):
+            rest = search(index + 1, remaining - count * denomination)
+            if rest is not None:
+                if count:
+                    rest[denomination] = count
+                return rest
+        return None
+
+    return search(0, amount)
+
+
+def time_per_call(function, amounts):
+    start = time.perf_counter()
+    for amount in amounts:
+        function(amount)
+    return (time.perf_counter() - start) / len(amounts) * 1e6
+
+
+def dispense_per_call(notes, max_amount, amounts):
+    cassette = Cassette(notes, max_amount=max_amount)
+    clock = time.perf_counter
+    elapsed = 0.0
+    for amount in amounts:
+        start = clock()
+        dispensed = cassette.dispense(amount)
+        elapsed += clock() - start
+        if dispensed is None:
+            cassette.replenish(notes, "bench")
+    return elapsed / len(amounts) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lookups", type=int, default=20_000)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    print(f"{'notes/denom':>11} {'max $':>7} {'build ms':>9} {'table us':>9} {'dispense us':>12} {'brute us':>9}")
+    print("-" * 62)
+    for notes_per_denomination in (10, 100, 1_000, 10_000):
+        for max_amount in (1_000, 5_000, 20_000):
+            notes = {20: notes_per_denomination, 50: notes_per_denomination, 100: notes_per_denomination}
+            amounts = [rng.randrange(10, max_amount + 1, 10) for _ in range(args.lookups)]
+
+            cassette = Cassette(notes, max_amount=max_amount)
+            start = time.perf_counter()
+            cassette.plan(20)
+            build_ms = (time.perf_counter() - start) * 1000
+            table_us = time_per_call(cassette.plan, amounts)
+            dispense_us = dispense_per_call(notes, max_amount, amounts)
+            brute_us = time_per_call(lambda amount: brute_force_plan(notes, amount), amounts[:2_000])
+            print(f"{notes_per_denomination:>11} {max_amount:>7} {build_ms:>9.2f} {table_us:>9.2f} "
+                  f"{dispense_us:>12.2f} {brute_us:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
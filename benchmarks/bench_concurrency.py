@@ -0,0 +1,97 @@
+# Stress the ledger from many threads at once and check that no money is
+# created or destroyed, then report throughput as the thread count grows.
+#
+# Run from the repository root:  python -m benchmarks.bench_concurrency
+import argparse
+import random
+import sys
+import time
+
+import Atm
+import pins
+from engine import TransactionEngine
+
+# A single KDF iteration keeps PIN hashing out of the figures (see bench_pins)
+PIN_HASH = pins.hash_pin("1234", iterations=1)
+
+
+def reset(account_count, balance):
+    Atm.accounts.clear()
+    Atm.card_index.clear()
+    Atm.account_locks.clear()
+    Atm.load_cash({20: 20_000, 50: 4_000, 100: 4_000})  # $1,000,000
+    return [Atm.create_account(f"Stress {i}", "1234", balance, PIN_HASH)[0] for i in range(account_count)]
+
+
+def make_session(rng, account_numbers, length):
+    commands = []
+    for _ in range(length):
+        roll = rng.random()
+        src = rng.choice(account_numbers)
+        amount = rng.choice((20, 40, 50, 60, 100)) * 100
+        if roll < 0.6:
+            dst = rng.choice(account_numbers)
+            commands.append(('transfer', src, dst, amount, "1234"))
+        elif roll < 0.8:
+            commands.append(('withdraw', src, amount))
+        else:
+            commands.append(('deposit', src, amount))
+    return commands
+
+
+def total_balances():
+    return sum(acc.balance for acc in Atm.accounts.values())
+
+
+def run(threads, sessions, session_length, account_count, seed):
+    account_numbers = reset(account_count, 50000)
+    rng = random.Random(seed)
+    workload = [make_session(rng, account_numbers, session_length) for _ in range(sessions)]
+    balances_before = total_balances()
+    cash_before = Atm.atm_cash
+
+    start = time.perf_counter()
+    with TransactionEngine(workers=threads) as engine:
+        futures = [engine.submit_session(commands) for commands in workload]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    # Deposits bring money in and withdrawals take it out of both the
+    # accounts and the cassette; transfers must net to zero
+    moved = {'deposit': 0, 'withdraw': 0}
+    for commands, outcomes in zip(workload, results):
+        for command, (success, _) in zip(commands, outcomes):
+            if success and command[0] in moved:
+                moved[command[0]] += command[2]
+    balances_ok = total_balances() == balances_before + moved['deposit'] - moved['withdraw']
+    cash_ok = Atm.atm_cash == cash_before - moved['withdraw']
+    negative = [acc for acc in Atm.accounts.values() if acc.balance < 0]
+    ops = sessions * session_length
+    return ops / elapsed, balances_ok and cash_ok and not negative
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=400)
+    parser.add_argument("--session-length", type=int, default=50)
+    parser.add_argument("--accounts", type=int, default=20,
+                        help="few accounts means heavy contention")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # Switch threads often to shake out races in the read-check-modify paths
+    sys.setswitchinterval(1e-6)
+    print(f"{'threads':>8} {'ops/sec':>12} {'conserved':>10}")
+    print("-" * 32)
+    failed = False
+    for threads in args.threads:
+        rate, conserved = run(threads, args.sessions, args.session_length, args.accounts, args.seed)
+        failed |= not conserved
+        print(f"{threads:>8} {rate:>12,.0f} {'yes' if conserved else 'NO':>10}")
+    if failed:
+        sys.exit("money was not conserved")
+
+
+if __name__ == "__main__":
+    main()
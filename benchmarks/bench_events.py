@@ -0,0 +1,86 @@
+# Measure what keeping the event history costs the ledger, how fast
+# projections catch up incrementally, and how a full rebuild from the event
+# file scales with worker processes. Every rebuild is checked against the
+# live balances.
+#
+# Run from the repository root:  python -m benchmarks.bench_events
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import Atm
+import pins
+import projections
+
+NOTES = {20: 10 ** 7, 50: 10 ** 7, 100: 10 ** 7}
+# A single KDF iteration keeps PIN hashing out of the figures (see bench_pins)
+PIN_HASH = pins.hash_pin("1234", iterations=1)
+
+
+def run_workload(rng, account_numbers, ops):
+    start = time.perf_counter()
+    for _ in range(ops):
+        roll = rng.random()
+        account_number = rng.choice(account_numbers)
+        if roll < 0.4:
+            Atm.deposit(account_number, 2000)
+        elif roll < 0.7:
+            Atm.withdraw(account_number, rng.choice((2000, 4000, 6000)))
+        else:
+            Atm.transfer(account_number, rng.choice(account_numbers), 1500, "1234")
+    return ops / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=10_000)
+    parser.add_argument("--ops", type=int, default=300_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    Atm.load_cash(NOTES)
+    account_numbers = [Atm.create_account(f"Events {i}", "1234", 10_000_000, PIN_HASH)[0]
+                       for i in range(args.accounts)]
+    print(f"{os.cpu_count()} cores, {args.accounts:,} accounts, {args.ops:,} operations")
+    print(f"{'ledger':<24} {'ops/sec':>12}")
+    print("-" * 37)
+    print(f"{'no event history':<24} {run_workload(rng, account_numbers, args.ops):>12,.0f}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "events.log")
+        Atm.open_event_store(path)
+        live = projections.BalanceProjection()
+        live.catch_up(Atm.event_store)
+        print(f"{'with event history':<24} {run_workload(rng, account_numbers, args.ops):>12,.0f}")
+
+        start = time.perf_counter()
+        caught_up = live.catch_up(Atm.event_store)
+        rate = caught_up / (time.perf_counter() - start)
+        print(f"\nincremental catch-up: {caught_up:,} events at {rate:,.0f} events/sec")
+        Atm.close_event_store()
+
+        size = os.path.getsize(path)
+        print(f"\nfull rebuild of {live.position:,} events ({size / 2 ** 20:,.1f} MB)")
+        print(f"{'workers':<10} {'seconds':>9} {'events/sec':>12} {'consistent':>11}")
+        print("-" * 45)
+        failed = False
+        for workers in args.workers:
+            start = time.perf_counter()
+            rebuilt = projections.rebuild_file(path, projections.BalanceProjection, workers)
+            elapsed = time.perf_counter() - start
+            consistent = (rebuilt.position == live.position and not rebuilt.mismatches
+                          and not projections.balance_differences(rebuilt, Atm.accounts))
+            failed |= not consistent
+            print(f"{workers:<10} {elapsed:>9.2f} {rebuilt.position / elapsed:>12,.0f} "
+                  f"{'yes' if consistent else 'NO':>11}")
+    if failed:
+        sys.exit("a rebuild disagreed with the live balances")
+
+
+if __name__ == "__main__":
+    main()
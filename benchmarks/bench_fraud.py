@@ -0,0 +1,109 @@
+# Measure the inline cost of fraud scoring, per screen() and observe() call
+# and on whole withdrawals and transfers, against the 50us budget; then
+# how fast rescore() gets through stored histories with NumPy column
+# arrays and by replaying them, checking both flag the same debits.
+#
+# Run from the repository root:  python -m benchmarks.bench_fraud
+import argparse
+import random
+import sys
+import time
+
+import Atm
+import fraud
+from benchmarks import suite
+from records import TransactionLog
+
+BUDGET_US = 50
+
+
+def latencies(calls):
+    clock = time.perf_counter_ns
+    timings = []
+    for function, args in calls:
+        before = clock()
+        function(*args)
+        timings.append(clock() - before)
+    timings.sort()
+    return suite.percentile(timings, 0.5) / 1000, suite.percentile(timings, 0.99) / 1000
+
+
+def make_logs(rng, accounts, history):
+    logs = {}
+    for index in range(accounts):
+        log = TransactionLog()
+        timestamp = 1_700_000_000
+        for _ in range(rng.randint(1, 2 * history)):
+            timestamp += rng.choice((5, 60, 600, 3600, 86400))
+            transaction_type = rng.choice(("Deposit", "Withdrawal", "Transfer Out", "Transfer In"))
+            amount = rng.choice((2000, 4000, 6000)) if rng.random() > 0.02 else 500_000
+            log.append(transaction_type, amount, 0, timestamp)
+        logs[str(index)] = log
+    return logs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=10_000)
+    parser.add_argument("--ops", type=int, default=50_000)
+    parser.add_argument("--history", type=int, default=100, help="mean transactions per stored history")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    suite.reset()
+    account_numbers = [Atm.create_account(f"Fraud {i}", "1234", 10 ** 9, suite.PIN_HASH)[0]
+                       for i in range(args.accounts)]
+    cards = {number: Atm.accounts[number].card_number for number in account_numbers}
+    scorer = fraud.FraudScorer(fraud.FraudPolicy(block_score=10.0))
+    now = int(time.time())
+    # Give every account some history to score against
+    for number in account_numbers:
+        for step in range(10):
+            scorer.observe(number, "Withdrawal", 2000, now - 600 * step)
+    picks = rng.choices(account_numbers, k=args.ops)
+    print(f"{args.accounts:,} accounts, {args.ops:,} calls, budget {BUDGET_US}us")
+    print(f"{'inline call':<28} {'p50 us':>9} {'p99 us':>9}")
+    print("-" * 48)
+    rows = [
+        ("screen withdrawal", latencies([(scorer.screen, (n, cards[n], "Withdrawal", 2000, now)) for n in picks])),
+        ("screen transfer", latencies([(scorer.screen, (n, cards[n], "Transfer Out", 2000, now, picks[0]))
+                                       for n in picks])),
+        ("observe", latencies([(scorer.observe, (n, "Withdrawal", 2000, now)) for n in picks])),
+    ]
+    withdrawals = [(Atm.withdraw, (n, 2000)) for n in picks]
+    transfers = [(Atm.transfer, (n, picks[0], 1500, "1234")) for n in picks]
+    rows.append(("withdraw, no scoring", latencies(withdrawals)))
+    rows.append(("transfer, no scoring", latencies(transfers)))
+    suite.reset()
+    Atm.fraud_scorer = fraud.FraudScorer()
+    account_numbers = [Atm.create_account(f"Fraud {i}", "1234", 10 ** 9, suite.PIN_HASH)[0]
+                       for i in range(args.accounts)]
+    picks = rng.choices(account_numbers, k=args.ops)
+    rows.append(("withdraw, scored", latencies([(Atm.withdraw, (n, 2000)) for n in picks])))
+    rows.append(("transfer, scored", latencies([(Atm.transfer, (n, picks[0], 1500, "1234")) for n in picks])))
+    Atm.fraud_scorer = None
+    for name, (p50, p99) in rows:
+        print(f"{name:<28} {p50:>9.1f} {p99:>9.1f}")
+
+    logs = make_logs(rng, args.accounts, args.history)
+    total = sum(len(log) for log in logs.values())
+    print(f"\nrescore {total:,} transactions in {len(logs):,} histories")
+    print(f"{'mode':<16} {'seconds':>9} {'rows/sec':>12} {'flagged':>9}")
+    print("-" * 49)
+    results = {}
+    modes = [("replay", fraud._rescore_replay)]
+    if fraud.np is not None:
+        modes.append(("column arrays", fraud._rescore_columns))
+    for name, rescore in modes:
+        start = time.perf_counter()
+        scored, flagged = rescore(logs, fraud.FraudPolicy())
+        elapsed = time.perf_counter() - start
+        results[name] = {(number, position) for number, position, _ in flagged}
+        print(f"{name:<16} {elapsed:>9.2f} {total / elapsed:>12,.0f} {len(flagged):>9,}")
+    if len(results) == 2 and results["replay"] != results["column arrays"]:
+        sys.exit("the two modes flagged different debits")
+
+
+if __name__ == "__main__":
+    main()
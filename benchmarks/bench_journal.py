@@ -0,0 +1,67 @@
+# Compare journal throughput with an fsync per operation against group commit.
+# Every deposit waits for its record to be durable before returning, so a
+# batch only grows past one record when other threads log while an fsync
+# runs: the deposits are spread over --threads threads, each on its own
+# account.
+#
+# Run from the repository root:  python -m benchmarks.bench_journal
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+
+import Atm
+from benchmarks import suite
+
+
+def deposits(account_number, ops):
+    for _ in range(ops):
+        Atm.deposit(account_number, 100)
+
+
+def run(ops, threads, **options):
+    directory = tempfile.mkdtemp(prefix="atm-journal-")
+    try:
+        Atm.accounts.clear()
+        Atm.card_index.clear()
+        Atm.open_journal(directory, **options)
+        numbers = [Atm.create_account("Bench", "1234", 10000, pin_hash=suite.PIN_HASH)[0] for _ in range(threads)]
+        workers = [threading.Thread(target=deposits, args=(account_number, ops // threads))
+                   for account_number in numbers]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        Atm.close_journal()
+        elapsed = time.perf_counter() - start
+
+        # Recovery must reproduce the final balances
+        expected = {account_number: Atm.accounts[account_number].balance for account_number in numbers}
+        Atm.accounts.clear()
+        Atm.card_index.clear()
+        Atm.open_journal(directory, **options)
+        assert {account_number: Atm.accounts[account_number].balance for account_number in numbers} == expected
+        Atm.close_journal()
+        return ops // threads * threads / elapsed
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"{'mode':<28} {'ops/sec':>12}")
+    print("-" * 41)
+    print(f"{'fsync per op':<28} {run(args.ops, args.threads, group_size=1):>12,.0f}")
+    for group_size in (16, 64, 256):
+        rate = run(args.ops, args.threads, group_size=group_size)
+        print(f"{f'group commit ({group_size})':<28} {rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
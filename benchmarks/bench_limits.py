@@ -0,0 +1,65 @@
+# Measure the cost of a withdrawal limit check as account histories grow:
+# with the account's window cached, rebuilt from the history's Withdrawal
+# index, and by summing the last 24 hours of history on every check.
+#
+# Run from the repository root:  python -m benchmarks.bench_limits
+import argparse
+import time
+
+import limits
+from records import Account
+
+TYPES = ("Deposit", "Withdrawal", "Transfer In", "Transfer Out")
+
+
+# An account with `size` transactions, one a minute up to `now`
+def make_account(size, now):
+    account = Account("Limits", "", 10 ** 12, "0" * 16, 100_000)
+    for i in range(size):
+        account.transactions.append(TYPES[i % 4], 2000, 10 ** 12, now - (size - i) * 60)
+    return account
+
+
+def scan_history(account, amount, now):
+    since = now - limits.WINDOW_SECONDS
+    total = 0
+    for transaction in reversed(list(account.transactions)):
+        if transaction.timestamp <= since:
+            break
+        if transaction.type == "Withdrawal":
+            total += transaction.amount
+    return total + amount <= account.daily_limit
+
+
+def checks_per_sec(check, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        check()
+    return rounds / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10_000, 100_000])
+    parser.add_argument("--rounds", type=int, default=20_000)
+    args = parser.parse_args()
+
+    now = int(time.time())
+    policy = limits.LimitPolicy(per_withdrawal=50_000, max_withdrawals=10)
+    print(f"{'history':>9} {'cached/sec':>12} {'rebuilt/sec':>12} {'full scan/sec':>14}")
+    print("-" * 50)
+    for size in args.sizes:
+        account = make_account(size, now)
+        engine = limits.LimitsEngine(policy)
+        cached = checks_per_sec(lambda: engine.check("1", account, 2000, now), args.rounds)
+
+        def rebuilt():
+            engine.clear()
+            engine.check("1", account, 2000, now)
+        rebuilt_rate = checks_per_sec(rebuilt, max(1, args.rounds // 20))
+        scanned = checks_per_sec(lambda: scan_history(account, 2000, now), max(1, args.rounds // 200))
+        print(f"{size:>9,} {cached:>12,.0f} {rebuilt_rate:>12,.0f} {scanned:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Compare memory used by the old dict-per-record layout with slotted
+# accounts and the columnar transaction log.
+#
+# Run from the repository root:  python -m benchmarks.bench_memory
+import argparse
+import datetime
+import gc
+import tracemalloc
+
+from records import Account, TransactionLog
+
+TYPES = ("Deposit", "Withdrawal", "Transfer In", "Transfer Out")
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    data = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del data
+    return size
+
+
+def dict_transactions(count):
+    base = datetime.datetime(2024, 1, 1)
+    log = []
+    for i in range(count):
+        log.append({
+            'type': TYPES[i % 4],
+            'amount': float(i % 500) + 0.25,
+            'timestamp': (base + datetime.timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+            'balance_after': float(i) + 0.5,
+        })
+    return log
+
+
+def columnar_transactions(count):
+    start = int(datetime.datetime(2024, 1, 1).timestamp())
+    log = TransactionLog()
+    for i in range(count):
+        log.append(TYPES[i % 4], (i % 500) * 100 + 25, i * 100 + 50, start + i)
+    return log
+
+
+def dict_accounts(count):
+    return {str(i): {
+        'name': f"Customer {i}",
+        'pin': "1234",
+        'balance': float(i),
+        'card_number': f"{i:016d}",
+        'transactions': [],
+        'daily_withdrawals': 0.0,
+        'last_withdraw_date': "",
+        'daily_limit': 1000.0,
+    } for i in range(count)}
+
+
+def slotted_accounts(count):
+    return {str(i): Account(f"Customer {i}", "1234", i * 100, f"{i:016d}", 100000) for i in range(count)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--accounts", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rows = [
+        (f"{args.transactions:,} transactions", args.transactions,
+         measure(lambda: dict_transactions(args.transactions)),
+         measure(lambda: columnar_transactions(args.transactions))),
+        (f"{args.accounts:,} accounts (no history)", args.accounts,
+         measure(lambda: dict_accounts(args.accounts)),
+         measure(lambda: slotted_accounts(args.accounts))),
+    ]
+    print(f"{'dataset':<32} {'dicts MB':>9} {'new MB':>9} {'B/row old':>10} {'B/row new':>10}")
+    print("-" * 74)
+    for label, count, old, new in rows:
+        print(f"{label:<32} {old / 2**20:>9.1f} {new / 2**20:>9.1f} {old / count:>10.0f} {new / count:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
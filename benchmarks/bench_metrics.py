@@ -0,0 +1,73 @@
+# Measure what the metrics instrumentation costs on the ledger's hot paths:
+# the same calls with metrics never enabled, enabled, and enabled then
+# disabled again (which should match never enabled).
+#
+# Run from the repository root:  python -m benchmarks.bench_metrics
+import argparse
+import random
+import time
+
+import Atm
+import metrics
+import pins
+
+NOTES = {20: 10 ** 8, 50: 10 ** 8, 100: 10 ** 8}
+# A single KDF iteration keeps PIN hashing out of the figures (see bench_pins)
+PIN_HASH = pins.hash_pin("1234", iterations=1)
+
+
+def make_calls(rng, account_numbers, cards, ops):
+    calls = []
+    for _ in range(ops):
+        roll = rng.random()
+        account_number = rng.choice(account_numbers)
+        if roll < 0.25:
+            calls.append(('get_account_by_card', (rng.choice(cards),)))
+        elif roll < 0.5:
+            calls.append(('withdraw', (account_number, rng.choice((2000, 4000, 6000)))))
+        elif roll < 0.75:
+            calls.append(('deposit', (account_number, 2000)))
+        else:
+            calls.append(('transfer', (account_number, rng.choice(account_numbers), 1500, "1234")))
+    return calls
+
+
+# Calls are looked up on Atm each time, as the UI and server do
+def ops_per_sec(calls):
+    start = time.perf_counter()
+    for operation, args in calls:
+        getattr(Atm, operation)(*args)
+    return len(calls) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=10_000)
+    parser.add_argument("--ops", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    Atm.load_cash(NOTES)
+    created = [Atm.create_account(f"Metrics {i}", "1234", 10_000_000, PIN_HASH) for i in range(args.accounts)]
+    account_numbers = [account_number for account_number, _ in created]
+    cards = [card for _, card in created]
+    calls = make_calls(random.Random(args.seed), account_numbers, cards, args.ops)
+
+    print(f"{'metrics':<20} {'ops/sec':>12} {'overhead':>10}")
+    print("-" * 44)
+    baseline = ops_per_sec(calls)
+    print(f"{'never enabled':<20} {baseline:>12,.0f} {'-':>10}")
+    metrics.enable()
+    rate = ops_per_sec(calls)
+    print(f"{'enabled':<20} {rate:>12,.0f} {(baseline / rate - 1) * 100:>9.1f}%")
+    started = time.perf_counter()
+    metrics.render()
+    render_ms = (time.perf_counter() - started) * 1000
+    metrics.disable()
+    rate = ops_per_sec(calls)
+    print(f"{'disabled again':<20} {rate:>12,.0f} {(baseline / rate - 1) * 100:>9.1f}%")
+    print(f"\nrendering the Prometheus text took {render_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
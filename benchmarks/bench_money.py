@@ -0,0 +1,76 @@
+# Compare the integer-cents ledger arithmetic with the float and Decimal
+# alternatives: hot-path cost, input parsing cost and accumulated drift.
+#
+# Run from the repository root:  python -m benchmarks.bench_money
+import argparse
+import time
+from decimal import Decimal
+
+import Atm
+from money import parse_amount
+
+
+# The ledger's per-operation arithmetic: credit, then a debit guarded by
+# balance and daily limit checks
+def ledger_loop(ops, balance, amount, limit):
+    daily = balance - balance
+    start = time.perf_counter()
+    for _ in range(ops):
+        balance += amount
+        if amount <= balance and daily + amount <= limit:
+            balance -= amount
+            daily += amount
+    return (time.perf_counter() - start) / ops * 1e9
+
+
+def parse_loop(ops, parse, text):
+    start = time.perf_counter()
+    for _ in range(ops):
+        parse(text)
+    return (time.perf_counter() - start) / ops * 1e9
+
+
+def atm_loop(ops):
+    Atm.accounts.clear()
+    Atm.card_index.clear()
+    Atm.load_cash({20: 10 ** 9})
+    account_number, _ = Atm.create_account("Bench", "1234", 10 ** 9)
+    Atm.accounts[account_number].daily_limit = 10 ** 15
+    start = time.perf_counter()
+    for _ in range(ops):
+        Atm.deposit(account_number, 2000)
+        Atm.withdraw(account_number, 2000)
+    return (time.perf_counter() - start) / (2 * ops) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=1_000_000)
+    args = parser.parse_args()
+    ops = args.ops
+
+    print(f"{'arithmetic per op':<34} {'ns/op':>8}")
+    print("-" * 43)
+    print(f"{'float dollars':<34} {ledger_loop(ops, 1000.0, 0.1, 1e12):>8.0f}")
+    print(f"{'int cents':<34} {ledger_loop(ops, 100000, 10, 10 ** 14):>8.0f}")
+    print(f"{'Decimal dollars':<34} {ledger_loop(ops, Decimal('1000'), Decimal('0.1'), Decimal(10 ** 12)):>8.0f}")
+
+    print(f"\n{'parsing 123.45':<34} {'ns/op':>8}")
+    print("-" * 43)
+    print(f"{'float()':<34} {parse_loop(ops, float, '123.45'):>8.0f}")
+    print(f"{'parse_amount() to cents':<34} {parse_loop(ops, parse_amount, '123.45'):>8.0f}")
+    print(f"{'Decimal()':<34} {parse_loop(ops, Decimal, '123.45'):>8.0f}")
+
+    print(f"\n{'Atm.deposit/withdraw in cents':<34} {atm_loop(ops // 10):>8.0f}")
+
+    # Drift: deposit 10 cents a million times
+    total_float = 0.0
+    total_cents = 0
+    for _ in range(1_000_000):
+        total_float += 0.1
+        total_cents += 10
+    print(f"\n1M deposits of $0.10: float ${total_float:.10f}, cents ${total_cents // 100}.{total_cents % 100:02d}")
+
+
+if __name__ == "__main__":
+    main()
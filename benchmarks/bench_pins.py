@@ -0,0 +1,62 @@
+# Measure the PIN KDF's cost and PIN verification throughput with and
+# without the verified-session cache.
+#
+# Run from the repository root:  python -m benchmarks.bench_pins
+import argparse
+import time
+
+import Atm
+import pins
+
+
+def kdf_ms(iterations, rounds):
+    pin_hash = pins.hash_pin("1234", iterations)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pins.check_pin("1234", pin_hash)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+# Sessions of one login plus `reentries` PIN re-entries (one per
+# withdrawal, deposit or transfer), verified with or without a session id
+def sessions_per_sec(account_number, sessions, reentries, cached):
+    start = time.perf_counter()
+    for _ in range(sessions):
+        session = Atm.new_session() if cached else None
+        for _ in range(1 + reentries):
+            assert Atm.verify_pin(account_number, "1234", session)
+    return sessions / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--reentries", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'KDF iterations':<16} {'ms/check':>10} {'checks/sec':>12}")
+    print("-" * 40)
+    for iterations in (10_000, pins.ITERATIONS, 600_000):
+        cost = kdf_ms(iterations, args.rounds)
+        print(f"{iterations:<16,} {cost:>10.2f} {1000 / cost:>12,.0f}")
+
+    account_number, _ = Atm.create_account("Bench", "1234")
+    print()
+    print(f"{'verification':<34} {'sessions/sec':>13} {'checks/sec':>12}")
+    print("-" * 61)
+    for label, cached in (("no session cache", False), ("verified-session cache", True)):
+        rate = sessions_per_sec(account_number, args.sessions, args.reentries, cached)
+        print(f"{label:<34} {rate:>13,.1f} {rate * (1 + args.reentries):>12,.0f}")
+
+    # Re-entries alone, once the session is verified
+    session = Atm.new_session()
+    Atm.verify_pin(account_number, "1234", session)
+    start = time.perf_counter()
+    for _ in range(100_000):
+        Atm.verify_pin(account_number, "1234", session)
+    print(f"{'cache hit':<34} {'':>13} {100_000 / (time.perf_counter() - start):>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Measure bulk account import and export rates for the CSV and binary
+# formats.
+#
+# Run from the repository root:  python -m benchmarks.bench_provisioning
+import argparse
+import io
+import time
+
+import Atm
+import pins
+import provisioning
+
+
+def reset():
+    Atm.accounts.clear()
+    Atm.card_index.clear()
+    Atm.account_locks.clear()
+    Atm.next_account_seq = 0
+
+
+# Rows carry a ready-made PIN hash, as in an export; hashing plain PINs
+# would be the KDF's cost, not the import's
+def make_csv(count):
+    pin_hash = pins.hash_pin("1234")
+    stream = io.StringIO()
+    stream.write("name,pin_hash,balance\n")
+    stream.writelines(f"Customer {i},{pin_hash},{i % 5000}.{i % 100:02d}\n" for i in range(count))
+    stream.seek(0)
+    return stream
+
+
+def timed(action):
+    start = time.perf_counter()
+    count = action()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    # The CSV import allocates account and card numbers; the binary import
+    # then reloads the exported accounts with their numbers
+    reset()
+    source = make_csv(args.accounts)
+    csv_import = timed(lambda: provisioning.import_csv(source))
+    csv_export = timed(lambda: provisioning.export_csv(io.StringIO()))
+    exported = io.BytesIO()
+    binary_export = timed(lambda: provisioning.export_binary(exported))
+    reset()
+    exported.seek(0)
+    binary_import = timed(lambda: provisioning.import_binary(exported))
+
+    print(f"{args.accounts:,} accounts")
+    print(f"{'format':<8} {'import/sec':>12} {'export/sec':>12}")
+    print("-" * 34)
+    print(f"{'csv':<8} {csv_import:>12,.0f} {csv_export:>12,.0f}")
+    print(f"{'binary':<8} {binary_import:>12,.0f} {binary_export:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
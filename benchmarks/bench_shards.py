@@ -0,0 +1,103 @@
+# Measure aggregate ledger throughput as the shard count grows, against a
+# single in-process ledger, and check that sharding conserves money.
+#
+# Run from the repository root:  python -m benchmarks.bench_shards
+import argparse
+import os
+import random
+import sys
+import time
+
+import Atm
+import pins
+from shards import ShardedLedger
+
+NOTES = {20: 200_000, 50: 40_000, 100: 40_000}  # $10,000,000
+# A single KDF iteration keeps PIN hashing out of the figures (see bench_pins)
+PIN_HASH = pins.hash_pin("1234", iterations=1)
+
+
+def make_batches(rng, account_numbers, batches, batch_size):
+    workload = []
+    for _ in range(batches):
+        commands = []
+        for _ in range(batch_size):
+            roll = rng.random()
+            src = rng.choice(account_numbers)
+            amount = rng.choice((20, 40, 50, 60, 100)) * 100
+            if roll < 0.5:
+                commands.append(('transfer', src, rng.choice(account_numbers), amount, "1234"))
+            elif roll < 0.75:
+                commands.append(('withdraw', src, amount))
+            else:
+                commands.append(('deposit', src, amount))
+        workload.append(commands)
+    return workload
+
+
+def moved(workload, results):
+    deposits = withdrawals = 0
+    for commands, outcomes in zip(workload, results):
+        for command, (success, _) in zip(commands, outcomes):
+            if success and command[0] == 'deposit':
+                deposits += command[2]
+            elif success and command[0] == 'withdraw':
+                withdrawals += command[2]
+    return deposits, withdrawals
+
+
+def run_in_process(args):
+    Atm.load_cash(NOTES)
+    operations = {'transfer': Atm.transfer, 'withdraw': Atm.withdraw, 'deposit': Atm.deposit}
+    account_numbers = [Atm.create_account(f"Shard {i}", "1234", 1_000_000, PIN_HASH)[0]
+                       for i in range(args.accounts)]
+    workload = make_batches(random.Random(args.seed), account_numbers, args.batches, args.batch_size)
+    start = time.perf_counter()
+    for commands in workload:
+        for command in commands:
+            operations[command[0]](*command[1:])
+    return args.batches * args.batch_size / (time.perf_counter() - start)
+
+
+def run_sharded(shards, args):
+    with ShardedLedger(shards, notes=NOTES) as ledger:
+        account_numbers = [ledger.create_account(f"Shard {i}", "1234", 1_000_000, PIN_HASH)[0]
+                           for i in range(args.accounts)]
+        workload = make_batches(random.Random(args.seed), account_numbers, args.batches, args.batch_size)
+        balances_before, cash_before = ledger.totals()
+        start = time.perf_counter()
+        results = [ledger.run(commands) for commands in workload]
+        elapsed = time.perf_counter() - start
+        balances_after, cash_after = ledger.totals()
+    deposits, withdrawals = moved(workload, results)
+    conserved = (balances_after == balances_before + deposits - withdrawals
+                 and cash_after == cash_before - withdrawals)
+    return args.batches * args.batch_size / elapsed, conserved
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=10_000)
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--shards", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores, {args.batches} batches of {args.batch_size} commands")
+    print(f"{'ledger':<16} {'ops/sec':>12} {'conserved':>10}")
+    print("-" * 40)
+    print(f"{'in-process':<16} {run_in_process(args):>12,.0f} {'-':>10}")
+    failed = False
+    for shards in args.shards:
+        rate, conserved = run_sharded(shards, args)
+        failed |= not conserved
+        label = f"{shards} shard" + ("s" if shards > 1 else "")
+        print(f"{label:<16} {rate:>12,.0f} {'yes' if conserved else 'NO':>10}")
+    if failed:
+        sys.exit("money was not conserved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Compare the SQLite ledger with the in-memory one: per-call latency of
+# each core operation, then the throughput of the mixed workload run by
+# several threads at once, where the database's pooled connections let
+# reads go ahead while another thread is writing.
+#
+# Run from the repository root:  python -m benchmarks.bench_sqlite
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import Atm
+from benchmarks import suite
+
+OPERATIONS = ('get_account_by_card', 'verify_pin', 'deposit', 'withdraw', 'transfer', 'add_transaction', 'mixed')
+
+
+def populate(rng, count):
+    account_numbers = []
+    cards = []
+    for i in range(count):
+        account_number, card_number = Atm.create_account(f"Customer {i}", "1234", rng.randrange(10 ** 7),
+                                                         suite.PIN_HASH)
+        account_numbers.append(account_number)
+        cards.append(card_number)
+    return account_numbers, cards
+
+
+# Mixed-workload calls per second with the calls split across `threads`
+def threaded_throughput(calls, threads):
+    shares = [calls[i::threads] for i in range(threads)]
+
+    def run(share):
+        for function, args in share:
+            function(*args)
+
+    workers = [threading.Thread(target=run, args=(share,)) for share in shares]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(calls) / (time.perf_counter() - start)
+
+
+def measure(args, rng):
+    start = time.perf_counter()
+    account_numbers, cards = populate(rng, args.accounts)
+    created = args.accounts / (time.perf_counter() - start)
+    cum_weights = suite.zipf_weights(len(account_numbers), args.skew)
+    rows = {'create_account': {'ops_per_sec': created}}
+    for operation in OPERATIONS:
+        calls = suite.make_calls(operation, rng, args.ops, account_numbers, cards, cum_weights)
+        rows[operation] = suite.run_calls(calls)
+    throughput = {}
+    for threads in args.threads:
+        calls = suite.make_calls('mixed', rng, args.ops, account_numbers, cards, cum_weights)
+        throughput[threads] = threaded_throughput(calls, threads)
+    return rows, throughput
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=10_000)
+    parser.add_argument("--ops", type=int, default=20_000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    results = {}
+    suite.reset()
+    results['memory'] = measure(args, random.Random(args.seed))
+    directory = tempfile.mkdtemp(prefix="atm-sqlite-")
+    try:
+        suite.reset()
+        Atm.open_database(os.path.join(directory, "ledger.db"), args.pool_size)
+        results['sqlite'] = measure(args, random.Random(args.seed))
+        Atm.close_database()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{os.cpu_count()} cores, {args.accounts:,} accounts, {args.ops:,} calls per operation")
+    print(f"\n{'operation':<20} {'backend':<8} {'ops/sec':>12} {'p50 us':>9} {'p99 us':>9}")
+    print("-" * 62)
+    for operation in ('create_account',) + OPERATIONS:
+        for backend, (rows, _) in results.items():
+            row = rows[operation]
+            if 'p50_us' in row:
+                print(f"{operation:<20} {backend:<8} {row['ops_per_sec']:>12,.0f} "
+                      f"{row['p50_us']:>9.1f} {row['p99_us']:>9.1f}")
+            else:
+                print(f"{operation:<20} {backend:<8} {row['ops_per_sec']:>12,.0f}")
+
+    print(f"\n{'mixed workload':<20} {'backend':<8} {'ops/sec':>12}")
+    print("-" * 42)
+    for threads in args.threads:
+        for backend, (_, throughput) in results.items():
+            print(f"{f'{threads} threads':<20} {backend:<8} {throughput[threads]:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Measure how fast monthly statements render for a large population in
+# each format, against printing the text statements line by line, and
+# check that rendering doesn't grow memory with the number of accounts.
+#
+# Run from the repository root:  python -m benchmarks.bench_statements
+#   python -m benchmarks.bench_statements --accounts 1000000
+import argparse
+import contextlib
+import os
+import random
+import resource
+import sys
+import time
+
+import Atm
+import pins
+import statements
+
+# A single KDF iteration keeps PIN hashing out of the figures (see bench_pins)
+PIN_HASH = pins.hash_pin("1234", iterations=1)
+TYPES = ("Deposit", "Withdrawal", "Transfer In", "Transfer Out")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+# Accounts with `history` transactions each, spread over the month
+def build(rng, count, history, start, end):
+    with Atm.registry_lock:
+        for i in range(count):
+            account_number = Atm.generate_account_number()
+            account = Atm._register_account(account_number, Atm.generate_card_number(), f"Customer {i}",
+                                            PIN_HASH, Atm.DAILY_LIMIT)
+            balance = 100_000
+            for timestamp in sorted(rng.randrange(start, end) for _ in range(history)):
+                transaction_type = rng.choice(TYPES)
+                amount = rng.randrange(1, 100) * 100
+                balance += amount if transaction_type in statements.CREDIT_TYPES else -amount
+                account.transactions.append(transaction_type, amount, balance, timestamp)
+            account.balance = balance
+
+
+def render(fmt, start, end, path):
+    before = time.perf_counter()
+    count = statements.write_statements_file(path, Atm.accounts, start, end, fmt)
+    return count / (time.perf_counter() - before), os.path.getsize(path)
+
+
+# What the old terminal code did: one print per line
+def render_with_print(start, end, path):
+    before = time.perf_counter()
+    with open(path, "w", encoding="utf-8") as f, contextlib.redirect_stdout(f):
+        for account_number, account in Atm.accounts.items():
+            for chunk in statements._text_statement(account_number, account, start, end):
+                print(chunk, end="")
+    return len(Atm.accounts) / (time.perf_counter() - before), os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=100_000)
+    parser.add_argument("--history", type=int, default=5, help="transactions per account in the month")
+    parser.add_argument("--output", default="bench_statements.out", help="scratch file, removed afterwards")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    start, end = statements.month_bounds("2026-09")
+    build(random.Random(args.seed), args.accounts, args.history, start, end)
+    built_rss = peak_rss_mb()
+    print(f"{args.accounts:,} accounts, {args.history} transactions each, peak RSS after building "
+          f"{built_rss:,.0f} MB")
+    print(f"{'renderer':<20} {'accounts/sec':>13} {'MB written':>11} {'MB/sec':>8} {'RSS growth MB':>14}")
+    print("-" * 70)
+    runs = [(f"{fmt} (streamed)", lambda fmt=fmt: render(fmt, start, end, args.output))
+            for fmt in statements.STATEMENT_FORMATS]
+    runs.append(("text (print/line)", lambda: render_with_print(start, end, args.output)))
+    try:
+        for label, run in runs:
+            rate, size = run()
+            megabytes = size / 2 ** 20
+            print(f"{label:<20} {rate:>13,.0f} {megabytes:>11,.1f} {megabytes * rate / args.accounts:>8,.1f} "
+                  f"{peak_rss_mb() - built_rss:>14,.1f}")
+    finally:
+        if os.path.exists(args.output):
+            os.remove(args.output)
+
+
+if __name__ == "__main__":
+    main()
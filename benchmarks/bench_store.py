@@ -0,0 +1,95 @@
+# Compare cold start from a journal snapshot with opening the memory-mapped
+# account store, and the cost of card lookups, PIN checks and deposits
+# against each.
+#
+# Run from the repository root:  python -m benchmarks.bench_store
+import argparse
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import Atm
+import pins
+import provisioning
+
+
+def reset():
+    Atm.accounts = {}
+    Atm.card_index = {}
+    Atm.account_locks.clear()
+    Atm.next_account_seq = 0
+
+
+# A single KDF iteration keeps PIN hashing out of the figures (see bench_pins)
+def accounts_csv(count):
+    pin_hash = pins.hash_pin("1234", iterations=1)
+    stream = io.StringIO()
+    stream.write("name,pin_hash,balance\n")
+    stream.writelines(f"Customer {i},{pin_hash},{i % 5000}.00\n" for i in range(count))
+    stream.seek(0)
+    return stream
+
+
+def cards_sample(rng, size):
+    return [Atm.accounts[acc_num].card_number for acc_num in rng.choices(list(Atm.accounts), k=size)]
+
+
+def session_ops(cards):
+    start = time.perf_counter()
+    for card in cards:
+        account_number = Atm.get_account_by_card(card)
+        if Atm.verify_pin(account_number, "1234"):
+            Atm.deposit(account_number, 100)
+    return len(cards) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=1_000_000)
+    parser.add_argument("--ops", type=int, default=50_000)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    directory = tempfile.mkdtemp(prefix="atm-store-")
+    try:
+        journal_dir = os.path.join(directory, "journal")
+        store_path = os.path.join(directory, "accounts.db")
+
+        reset()
+        Atm.open_journal(journal_dir)
+        provisioning.import_csv(accounts_csv(args.accounts))
+        cards = cards_sample(rng, args.ops)
+        Atm.close_journal()
+        reset()
+        start = time.perf_counter()
+        # No snapshots during the timed sessions, which would rewrite every account
+        Atm.open_journal(journal_dir, snapshot_every=10 ** 9)
+        journal_open = time.perf_counter() - start
+        journal_ops = session_ops(cards)
+        Atm.close_journal()
+
+        reset()
+        Atm.open_store(store_path)
+        provisioning.import_csv(accounts_csv(args.accounts))
+        cards = cards_sample(rng, args.ops)
+        Atm.close_store()
+        start = time.perf_counter()
+        Atm.open_store(store_path)
+        store_open = time.perf_counter() - start
+        store_ops = session_ops(cards)
+        Atm.close_store()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{args.accounts:,} accounts, {args.ops:,} card + PIN + deposit sessions")
+    print(f"{'backend':<20} {'startup s':>10} {'ops/sec':>12}")
+    print("-" * 44)
+    print(f"{'journal snapshot':<20} {journal_open:>10.3f} {journal_ops:>12,.0f}")
+    print(f"{'mapped store':<20} {store_open:>10.4f} {store_ops:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# Benchmark suite for the core ledger operations.
+#
+# For each population size it builds a synthetic set of accounts with
+# skewed activity (a few hot accounts with long histories, a long tail of
+# quiet ones), then times every operation below with per-call latencies.
+# Results are printed and can be saved as JSON and compared against an
+# earlier run to catch regressions:
+#
+#   python -m benchmarks.suite --accounts 10000 100000 --output before.json
+#   python -m benchmarks.suite --accounts 10000 100000 --compare before.json
+#
+# Populations of 10M accounts need several GB of memory; the defaults stop
+# at 1M.
+import argparse
+import gc
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from itertools import accumulate
+
+import Atm
+import pins
+from stats import AtmStats
+
+NOTES = {20: 10 ** 9, 50: 10 ** 9, 100: 10 ** 9}
+# A single KDF iteration keeps PIN hashing out of the figures (see bench_pins)
+PIN_HASH = pins.hash_pin("1234", iterations=1)
+OPERATIONS = ('create_account', 'get_account_by_card', 'verify_pin', 'deposit', 'withdraw',
+              'transfer', 'add_transaction', 'mixed')
+# Share of each operation in the mixed workload, roughly one ATM session
+MIX = (('get_account_by_card', 1), ('verify_pin', 2), ('withdraw', 2), ('deposit', 1), ('transfer', 1))
+
+
+def reset():
+    Atm.accounts = {}
+    Atm.card_index = {}
+    Atm.account_locks.clear()
+    Atm.verified_sessions.clear()
+    Atm.limits_engine.clear()
+    Atm.atm_stats = AtmStats()
+    Atm.next_account_seq = 0
+    Atm.closed_day = None
+    Atm.load_cash(NOTES)
+    gc.collect()
+
+
+# Rank-based (Zipf) weights: the account at rank r is picked in
+# proportion to 1 / r ** skew
+def zipf_weights(count, skew):
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+# Register `count` accounts straight into the registry, then give them
+# `history` transactions each on average, spread by the same skew
+def build_population(rng, count, history, cum_weights):
+    start = time.perf_counter()
+    account_numbers = []
+    cards = []
+    with Atm.registry_lock:
+        for i in range(count):
+            account_number = Atm.generate_account_number()
+            card_number = Atm.generate_card_number()
+            account = Atm._register_account(account_number, card_number, f"Customer {i}", PIN_HASH,
+                                            Atm.DAILY_LIMIT)
+            account.balance = 10_000_000
+            account_numbers.append(account_number)
+            cards.append(card_number)
+    now = int(time.time())
+    for index in rng.choices(range(count), cum_weights=cum_weights, k=count * history):
+        account_number = account_numbers[index]
+        account = Atm.accounts[account_number]
+        Atm.add_transaction(account_number, "Deposit", 100, account.balance, now)
+    return account_numbers, cards, time.perf_counter() - start
+
+
+# Build the (function, args) calls for one operation, picking accounts by
+# the skewed weights
+def make_calls(operation, rng, ops, account_numbers, cards, cum_weights):
+    picks = rng.choices(range(len(account_numbers)), cum_weights=cum_weights, k=ops)
+    if operation == 'create_account':
+        return [(Atm.create_account, (f"New {i}", "1234", 10000, PIN_HASH)) for i in range(ops)]
+    if operation == 'get_account_by_card':
+        return [(Atm.get_account_by_card, (cards[i],)) for i in picks]
+    if operation == 'verify_pin':
+        return [(Atm.verify_pin, (account_numbers[i], "1234")) for i in picks]
+    if operation == 'deposit':
+        return [(Atm.deposit, (account_numbers[i], 2000)) for i in picks]
+    if operation == 'withdraw':
+        return [(Atm.withdraw, (account_numbers[i], rng.choice((2000, 4000, 6000, 10000)))) for i in picks]
+    if operation == 'transfer':
+        targets = rng.choices(range(len(account_numbers)), cum_weights=cum_weights, k=ops)
+        return [(Atm.transfer, (account_numbers[i], account_numbers[j], 1500, "1234"))
+                for i, j in zip(picks, targets)]
+    if operation == 'add_transaction':
+        now = int(time.time())
+        return [(Atm.add_transaction, (account_numbers[i], "Deposit", 100, 0, now)) for i in picks]
+    calls = []
+    names = [name for name, weight in MIX for _ in range(weight)]
+    for name in names:
+        calls.extend(make_calls(name, rng, ops // len(names) + 1, account_numbers, cards, cum_weights))
+    rng.shuffle(calls)
+    return calls[:ops]
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def run_calls(calls):
+    latencies = []
+    failures = 0
+    clock = time.perf_counter_ns
+    start = clock()
+    for function, args in calls:
+        before = clock()
+        result = function(*args)
+        latencies.append(clock() - before)
+        # Ledger calls return (success, message); lookups return a value or None
+        if not result or (type(result) is tuple and result[0] is False):
+            failures += 1
+    elapsed = (clock() - start) / 1e9
+    latencies.sort()
+    return {
+        'ops': len(calls),
+        'ops_per_sec': len(calls) / elapsed,
+        'p50_us': percentile(latencies, 0.5) / 1000,
+        'p90_us': percentile(latencies, 0.9) / 1000,
+        'p99_us': percentile(latencies, 0.99) / 1000,
+        'max_us': latencies[-1] / 1000,
+        'success_rate': 1 - failures / len(calls),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    rng = random.Random(args.seed)
+    results = []
+    populations = []
+    for count in sorted(args.accounts):
+        reset()
+        cum_weights = zipf_weights(count, args.skew)
+        account_numbers, cards, build_seconds = build_population(rng, count, args.history, cum_weights)
+        populations.append({'accounts': count, 'build_seconds': build_seconds, 'peak_rss_mb': peak_rss_mb()})
+        print(f"\n{count:,} accounts (built in {build_seconds:.1f}s, peak RSS {peak_rss_mb():,.0f} MB)")
+        print(f"{'operation':<20} {'ops/sec':>12} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} "
+              f"{'max us':>10} {'ok %':>6}")
+        print("-" * 81)
+        for operation in args.operations:
+            calls = make_calls(operation, rng, args.ops, account_numbers, cards, cum_weights)
+            row = run_calls(calls)
+            row.update(accounts=count, operation=operation)
+            results.append(row)
+            print(f"{operation:<20} {row['ops_per_sec']:>12,.0f} {row['p50_us']:>9.1f} {row['p90_us']:>9.1f} "
+                  f"{row['p99_us']:>9.1f} {row['max_us']:>10.1f} {row['success_rate'] * 100:>6.1f}")
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'ops': args.ops,
+            'history': args.history,
+            'skew': args.skew,
+            'seed': args.seed,
+        },
+        'populations': populations,
+        'results': results,
+    }
+
+
+# Operations whose throughput fell by more than `threshold` against a
+# baseline run, as (accounts, operation, baseline ops/sec, new ops/sec)
+def regressions(report, baseline, threshold):
+    before = {(row['accounts'], row['operation']): row['ops_per_sec'] for row in baseline['results']}
+    found = []
+    for row in report['results']:
+        old = before.get((row['accounts'], row['operation']))
+        if old and row['ops_per_sec'] < old * (1 - threshold):
+            found.append((row['accounts'], row['operation'], old, row['ops_per_sec']))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--ops", type=int, default=20_000, help="calls per operation")
+    parser.add_argument("--history", type=int, default=5, help="average transactions per account")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of account activity")
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="save the results as JSON here")
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against an earlier --output")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="throughput drop counted as a regression (default 10%%)")
+    args = parser.parse_args()
+
+    report = run_suite(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        found = regressions(report, baseline, args.threshold)
+        print()
+        for count, operation, old, new in found:
+            print(f"REGRESSION {operation} at {count:,} accounts: {old:,.0f} -> {new:,.0f} ops/sec")
+        if found:
+            sys.exit(1)
+        print(f"No regressions against {args.compare} (revision {baseline['meta']['revision']})")
+
+
+if __name__ == "__main__":
+    main()
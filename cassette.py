@@ -0,0 +1,146 @@
+import datetime
+import math
+from functools import reduce
+
+DEFAULT_NOTES = {20: 50, 50: 20, 100: 30}  # $5000, the ATM's starting cash
+
+
+# Note cassette with a reachability table for dispensing.
+#
+# For every amount up to `max_amount` (in steps of the denominations' gcd)
+# the table records whether the notes can make it and, per denomination,
+# the fewest of that note needed on top of the larger ones. Checking or
+# planning a withdrawal is then a lookup plus one step per denomination,
+# whatever the amount or the number of notes loaded.
+#
+# There are two tables. The full one allows each note up to max_amount //
+# denomination, as many as any withdrawal could use, so it never depends
+# on the counts loaded and is built once. Its plan is used whenever the
+# cassette holds the notes it names, which is nearly always. Only when a
+# note is running short does planning fall back to the limited table, made
+# from the counts actually loaded; that one is rebuilt lazily, in
+# O(denominations * max_amount / gcd), after the counts it depends on
+# change.
+class Cassette:
+    def __init__(self, notes=None, max_amount=1000):
+        self.notes = dict(DEFAULT_NOTES if notes is None else notes)
+        self.denominations = sorted(self.notes, reverse=True)
+        self.unit = reduce(math.gcd, self.denominations)
+        self.max_amount = max_amount
+        self.events = []  # replenishment history
+        self._full = None  # (reachable, layers) with every note up to its cap
+        self._limited = None  # (reachable, layers) for the counts loaded
+
+    def total(self):
+        return sum(denomination * count for denomination, count in self.notes.items())
+
+    # The table for amounts up to `max_amount`, from the counts loaded or,
+    # with `full`, from as many of each note as the amount could use
+    def _build(self, max_amount, full=False):
+        size = max_amount // self.unit + 1
+        reachable = [False] * size
+        reachable[0] = True
+        layers = []
+        # Largest notes first, so walking the layers back from the smallest
+        # note uses as few small notes as possible
+        for denomination in self.denominations:
+            step = denomination // self.unit
+            available = max_amount // denomination
+            if not full:
+                available = min(self.notes[denomination], available)
+            used = [0] * size
+            now_reachable = [False] * size
+            for index in range(size):
+                if reachable[index]:
+                    now_reachable[index] = True
+                elif index >= step and now_reachable[index - step] and used[index - step] < available:
+                    now_reachable[index] = True
+                    used[index] = used[index - step] + 1
+            layers.append(used)
+            reachable = now_reachable
+        return reachable, layers
+
+    def _walk(self, table, amount):
+        reachable, layers = table
+        index = amount // self.unit
+        if not reachable[index]:
+            return None
+        notes = {}
+        unit = self.unit
+        for position in range(len(layers) - 1, -1, -1):
+            count = layers[position][index]
+            if count:
+                denomination = self.denominations[position]
+                notes[denomination] = count
+                index -= count * (denomination // unit)
+        return notes
+
+    # Notes making up `amount` as {denomination: count}, or None if the
+    # loaded notes can't make it
+    def plan(self, amount):
+        if amount <= 0 or amount != int(amount):
+            return None
+        amount = int(amount)
+        if amount % self.unit:
+            return None
+        if amount > self.total():
+            return None
+        if amount > self.max_amount:
+            # Rare oversized request: solve with a one-off table
+            return self._walk(self._build(amount), amount)
+        if self._full is None:
+            self._full = self._build(self.max_amount, full=True)
+        notes = self._walk(self._full, amount)
+        # What no number of notes can make, the loaded ones can't either
+        if notes is None:
+            return None
+        loaded = self.notes
+        for denomination, count in notes.items():
+            if count > loaded[denomination]:
+                break
+        else:
+            return notes
+        if self._limited is None:
+            self._limited = self._build(self.max_amount)
+        return self._walk(self._limited, amount)
+
+    def can_dispense(self, amount):
+        return self.plan(amount) is not None
+
+    # Remove the notes for `amount`, returning them, or None if impossible
+    def dispense(self, amount):
+        notes = self.plan(amount)
+        if notes is not None:
+            self.remove(notes)
+        return notes
+
+    def remove(self, notes):
+        max_amount = self.max_amount
+        for denomination, count in notes.items():
+            remaining = self.notes[denomination] - count
+            self.notes[denomination] = remaining
+            # Counts at or above the cap don't change the limited table
+            if remaining < max_amount // denomination:
+                self._limited = None
+
+    # Load more notes, recording the replenishment
+    def replenish(self, notes, timestamp=None):
+        for denomination, count in notes.items():
+            if denomination not in self.notes:
+                self.denominations = sorted(set(self.denominations) | {denomination}, reverse=True)
+                self.unit = reduce(math.gcd, self.denominations)
+                self.notes[denomination] = 0
+                self._full = None
+            self.notes[denomination] += count
+        self._limited = None
+        event = {
+            'timestamp': timestamp or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'notes': dict(notes),
+            'total_after': self.total(),
+        }
+        self.events.append(event)
+        return event
+
+
+def format_notes(notes):
+    return ", ".join(f"{count} x ${denomination}" for denomination, count in sorted(notes.items(), reverse=True))
@@ -0,0 +1,314 @@
+import argparse
+import datetime
+import time
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # the batch falls back to a loop over the accounts
+    np = None
+
+import Atm
+from money import format_money, parse_amount
+from store import (ACCOUNT_NUMBER, BALANCE, DAILY_WITHDRAWALS, RECORD_WORDS, TRANSACTION_COUNT, VOLUME,
+                   WITHDRAW_DAY)
+
+# End-of-day batch: interest, maintenance fees and withdrawal counter
+# rollover for every account in one pass.
+#
+# Interest is accrued daily at the policy's yearly rate, in basis points,
+# on positive balances, rounded down to the cent. On the last day of a
+# month the maintenance fee is charged on balances below the waiver,
+# after that day's interest, and never takes a balance below zero. Each
+# becomes an "Interest" or "Fee" transaction stamped with the last second
+# of the day closed.
+#
+# Withdrawal limits are rolling (see limits.py), so nothing has to be
+# reset for the next day's withdrawals to be allowed. What rolls over is
+# the 24-hour total kept on each account for the account store, which
+# keeps no history across restarts: by the end of the day it was recorded
+# on it has lapsed, and it's set back to zero so the stored counters read
+# as they would after a calendar-day reset.
+#
+# How the pass runs depends on where the accounts live:
+#
+#   account store   NumPy views of the memory-mapped records, a column per
+#                   field, worked on in place for every account at once
+#   database        a few set-based statements in one transaction (see
+#                   SQLiteLedger.post_day)
+#   in memory       a loop over the accounts, as without NumPy. Account
+#                   objects hold their fields separately, so gathering them
+#                   into columns would cost the same loop.
+#
+# Postings are added to the histories held in memory (for the store, those
+# this process has loaded), the event history if one is open and the
+# dashboard totals as one batch; they're not fed to the fraud scorer.
+# With a journal open the batch ends with a checkpoint, as an import does,
+# rather than journaling each posting. Run it once per day with no
+# sessions in flight: it holds registry_lock, not each account's lock.
+#
+# The last day closed is recorded with the ledger (the store's header, the
+# database's settings, Atm.closed_day in the journal's snapshots, a
+# DayClosed event in the event history) and a day that isn't after it is
+# refused, so a rerun can't post interest twice.
+DAY_DIVISOR = 10_000 * 365  # basis points a year -> fraction a day
+NO_WAIVER = (1 << 63) - 1
+CHUNK = 4096  # records per chunk of a column-wise close, about 750KB
+
+# What a day's close did, amounts in cents
+DayClose = namedtuple('DayClose', ['day', 'accounts', 'interest_count', 'interest_total',
+                                   'fee_count', 'fee_total', 'rolled_over'])
+
+
+# Interest at `interest_bp` basis points a year and a monthly fee of
+# `monthly_fee` cents, waived at or above `fee_waiver` cents (None charges
+# every account with a positive balance)
+class EndOfDayPolicy:
+    def __init__(self, interest_bp=0, monthly_fee=0, fee_waiver=None):
+        self.interest_bp = interest_bp
+        self.monthly_fee = monthly_fee
+        self.fee_waiver = fee_waiver
+
+
+def _posting_time(day):
+    return int(datetime.datetime.combine(day, datetime.time(23, 59, 59)).timestamp())
+
+
+def _is_month_end(day):
+    return (day + datetime.timedelta(days=1)).day == 1
+
+
+# The interest and fee for one balance
+def _charges(balance, policy, month_end):
+    interest = balance * policy.interest_bp // DAY_DIVISOR if balance > 0 else 0
+    fee = 0
+    if month_end and policy.monthly_fee:
+        after = balance + interest
+        if after > 0 and (policy.fee_waiver is None or after < policy.fee_waiver):
+            fee = min(policy.monthly_fee, after)
+    return interest, fee
+
+
+def _post_event(op, account_number, amount, balance, timestamp):
+    Atm.event_store.append(op, {'acc': account_number, 'amount': amount, 'balance': balance, 'ts': timestamp})
+
+
+# The last day closed, or None. The database checks its own as it posts.
+def last_closed_day():
+    if Atm.database is not None:
+        closed = Atm.database.closed_day
+    elif Atm.store is not None:
+        closed = Atm.store.closed_day
+    else:
+        closed = Atm.closed_day
+    return None if closed is None else datetime.date.fromisoformat(closed)
+
+
+# Close `day` (a date, today by default) for every account under
+# `policy`, returning a DayClose. ValueError if `day` isn't after the last
+# day closed.
+def close_day(day=None, policy=None):
+    if day is None:
+        day = datetime.date.fromtimestamp(Atm.clock())
+    policy = policy or EndOfDayPolicy()
+    with Atm.registry_lock:
+        if Atm.database is not None:
+            result = _close_database(day, policy)
+        else:
+            last = last_closed_day()
+            if last is not None and day <= last:
+                raise ValueError(f"{day} is not after the last day closed, {last}")
+            if Atm.store is not None and np is not None:
+                result = _close_columns(day, policy)
+            else:
+                result = _close_loop(day, policy)
+            if Atm.store is not None:
+                Atm.store.closed_day = day.isoformat()
+            else:
+                Atm.closed_day = day.isoformat()
+        # The checkpoint below writes it out with the postings
+        if Atm.event_store is not None:
+            Atm.event_store.append("day_closed", {'day': day.isoformat()})
+        Atm.atm_stats.record_batch(result.interest_count + result.fee_count,
+                                   result.interest_total - result.fee_total)
+    Atm.checkpoint()
+    return result
+
+
+# One account at a time. For the store, only histories this process has
+# loaded are added to, as a column-wise close would.
+def _close_loop(day, policy):
+    timestamp = _posting_time(day)
+    month_end = _is_month_end(day)
+    closed_date = day.isoformat()
+    event_store = Atm.event_store
+    histories = dict(Atm.store.histories()) if Atm.store is not None else None
+    interest_count = interest_total = fee_count = fee_total = rolled_over = count = 0
+    for count, (account_number, account) in enumerate(Atm.accounts.items(), 1):
+        balance = account.balance
+        interest, fee = _charges(balance, policy, month_end)
+        if interest or fee:
+            log = account.transactions if histories is None else histories.get(count - 1)
+            if interest:
+                balance += interest
+                interest_count += 1
+                interest_total += interest
+                if log is not None:
+                    log.append("Interest", interest, balance, timestamp)
+                if event_store is not None:
+                    _post_event("interest", account_number, interest, balance, timestamp)
+            if fee:
+                balance -= fee
+                fee_count += 1
+                fee_total += fee
+                if log is not None:
+                    log.append("Fee", fee, balance, timestamp)
+                if event_store is not None:
+                    _post_event("fee", account_number, fee, balance, timestamp)
+            account.balance = balance
+            account.volume += interest + fee
+            account.transaction_count += (interest > 0) + (fee > 0)
+        if account.daily_withdrawals and account.last_withdraw_date <= closed_date:
+            account.daily_withdrawals = 0
+            rolled_over += 1
+    return DayClose(day, count, interest_count, interest_total, fee_count, fee_total, rolled_over)
+
+
+# Every account at once, on columns of the account store's records. The
+# records are worked through CHUNK at a time, so each chunk is still in
+# cache for the passes after the first instead of every pass going back
+# to memory.
+def _close_columns(day, policy):
+    timestamp = _posting_time(day)
+    rate = policy.interest_bp
+    charging = _is_month_end(day) and policy.monthly_fee
+    closed_day = day.toordinal()
+    words = Atm.store.record_words()
+    # The arrays are views of the mapping and must be gone before the
+    # store can be closed or grow
+    try:
+        records = np.asarray(words).reshape(-1, RECORD_WORDS)
+        count = len(records)
+        interest = np.zeros(count, dtype=np.int64)
+        fee = np.zeros(count, dtype=np.int64) if charging else None
+        rolled_over = 0
+        for start in range(0, count, CHUNK):
+            block = records[start:start + CHUNK]
+            balances = block[:, BALANCE]
+            paid = interest[start:start + CHUNK]
+            if rate:
+                np.maximum(balances, 0, out=paid)
+                paid *= rate
+                paid //= DAY_DIVISOR
+            # Each field is written once, with the fee folded in at a month end
+            if charging:
+                charged = fee[start:start + CHUNK]
+                after = balances + paid
+                owing = after > 0
+                if policy.fee_waiver is not None:
+                    owing &= after < policy.fee_waiver
+                np.minimum(after, policy.monthly_fee, out=charged, where=owing)
+                after -= charged
+                balances[:] = after
+                block[:, VOLUME] += paid + charged
+                postings = (paid > 0).astype(np.int64)
+                postings += owing
+                block[:, TRANSACTION_COUNT] += postings
+            elif rate:
+                balances += paid
+                block[:, VOLUME] += paid
+                block[:, TRANSACTION_COUNT] += paid > 0
+            daily = block[:, DAILY_WITHDRAWALS]
+            lapsed = daily != 0
+            lapsed &= block[:, WITHDRAW_DAY] <= closed_day
+            daily[lapsed] = 0
+            rolled_over += int(np.count_nonzero(lapsed))
+
+        for index, log in Atm.store.histories():
+            paid = int(interest[index])
+            charged = 0 if fee is None else int(fee[index])
+            balance = int(records[index, BALANCE])
+            if paid:
+                log.append("Interest", paid, balance + charged, timestamp)
+            if charged:
+                log.append("Fee", charged, balance, timestamp)
+        if Atm.event_store is not None:
+            _post_column_events(records, interest, fee, timestamp)
+
+        interest_count = int(np.count_nonzero(interest))
+        fee_count = 0 if fee is None else int(np.count_nonzero(fee))
+        return DayClose(day, count, interest_count, int(interest.sum()), fee_count,
+                        0 if fee is None else int(fee.sum()), rolled_over)
+    finally:
+        records = block = balances = daily = None
+        words.release()
+
+
+def _post_column_events(records, interest, fee, timestamp):
+    posted = np.flatnonzero(interest if fee is None else interest | fee)
+    numbers = records[posted, ACCOUNT_NUMBER].tolist()
+    balances = records[posted, BALANCE].tolist()
+    interest = interest[posted].tolist()
+    fee = [0] * len(posted) if fee is None else fee[posted].tolist()
+    for account_number, balance, paid, charged in zip(numbers, balances, interest, fee):
+        account_number = str(account_number)
+        if paid:
+            _post_event("interest", account_number, paid, balance + charged, timestamp)
+        if charged:
+            _post_event("fee", account_number, charged, balance, timestamp)
+
+
+# Every account at once, in the database. It keeps no withdrawal counters:
+# its limits are summed from the history.
+def _close_database(day, policy):
+    database = Atm.database
+    timestamp = _posting_time(day)
+    fee = policy.monthly_fee if _is_month_end(day) else 0
+    waiver = NO_WAIVER if policy.fee_waiver is None else policy.fee_waiver
+    last_id, totals = database.post_day(policy.interest_bp, DAY_DIVISOR, fee, waiver, timestamp, day.isoformat())
+    if Atm.event_store is not None:
+        for account_number, transaction_type, amount, balance in database.transactions_after(last_id):
+            _post_event("interest" if transaction_type == "Interest" else "fee", account_number, amount, balance,
+                        timestamp)
+    interest_count, interest_total = totals.get("Interest", (0, 0))
+    fee_count, fee_total = totals.get("Fee", (0, 0))
+    return DayClose(day, len(database), interest_count, interest_total, fee_count, fee_total, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post a day's interest and fees and roll over withdrawal counters")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--journal", metavar="DIR", help="journal directory holding the accounts")
+    source.add_argument("--store", metavar="FILE", help="account store holding the accounts")
+    source.add_argument("--database", metavar="FILE", help="SQLite database holding the accounts")
+    parser.add_argument("--date", type=datetime.date.fromisoformat, help="day to close (default today)")
+    parser.add_argument("--interest", type=float, default=0.0, metavar="PERCENT", help="yearly interest rate")
+    parser.add_argument("--fee", type=parse_amount, default=0, metavar="DOLLARS", help="monthly maintenance fee")
+    parser.add_argument("--waive-above", type=parse_amount, metavar="DOLLARS",
+                        help="balance at which the monthly fee is waived")
+    args = parser.parse_args()
+
+    if args.journal:
+        Atm.open_journal(args.journal)
+    elif args.store:
+        Atm.open_store(args.store)
+    else:
+        Atm.open_database(args.database)
+    try:
+        start = time.perf_counter()
+        result = close_day(args.date, EndOfDayPolicy(round(args.interest * 100), args.fee, args.waive_above))
+        elapsed = time.perf_counter() - start
+    except ValueError as error:
+        raise SystemExit(str(error))
+    finally:
+        Atm.close_journal()
+        Atm.close_store()
+        Atm.close_database()
+    print(f"Closed {result.day} for {result.accounts:,} accounts in {elapsed:.2f}s")
+    print(f"  interest  {result.interest_count:>12,} postings  {format_money(result.interest_total):>16}")
+    print(f"  fees      {result.fee_count:>12,} postings  {format_money(result.fee_total):>16}")
+    print(f"  withdrawal counters rolled over: {result.rolled_over:,}")
+
+
+if __name__ == "__main__":
+    main()
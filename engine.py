@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import Atm
+
+# Ledger operations a session can submit. They are looked up on Atm when
+# run, so wrappers such as the metrics instrumentation apply.
+OPERATIONS = {'deposit', 'withdraw', 'transfer', 'change_pin'}
+
+
+def _operation(name):
+    if name not in OPERATIONS:
+        raise KeyError(name)
+    return getattr(Atm, name)
+
+
+# Runs ledger operations for many concurrent ATM sessions on a thread pool.
+# Correctness comes from the per-account and cash locks inside Atm itself,
+# so operations from any number of sessions may be in flight at once.
+class TransactionEngine:
+    def __init__(self, workers=8):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="atm-session")
+
+    # Queue one operation, returning a future for its (success, message)
+    def submit(self, operation, *args):
+        return self._pool.submit(_operation(operation), *args)
+
+    # Run a whole session (a list of (operation, *args) tuples) on one
+    # worker, in order, returning a future for the list of results
+    def submit_session(self, commands):
+        return self._pool.submit(self._run_session, commands)
+
+    def _run_session(self, commands):
+        return [_operation(command[0])(*command[1:]) for command in commands]
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
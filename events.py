@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+from collections import namedtuple
+
+# The ledger's history as typed events.
+#
+# Every change the ledger makes goes through Atm._log, which hands the same
+# record to the journal and, when one is open, to an EventStore here. The
+# record becomes an immutable event named after what happened. Amounts are
+# the facts; the balances and cash level an event also carries are what the
+# ledger computed at the time, kept so projections can be checked against
+# them (see projections.py).
+#
+# Unlike the journal, which is cut back at every snapshot, the event store
+# keeps the whole history: an append-only file of JSON lines in the order
+# the ledger applied them. Each line is one batch of events written
+# together, as an array of events; each event is an array of the record's
+# op followed by the event's fields in order. Encoding a batch in one call,
+# without field names, is several times cheaper than an object per event.
+AccountCreated = namedtuple('AccountCreated', ['acc', 'card', 'name', 'pin_hash', 'daily_limit', 'seq'])
+BalanceOpened = namedtuple('BalanceOpened', ['acc', 'balance'])
+Deposited = namedtuple('Deposited', ['acc', 'amount', 'balance', 'ts'])
+Withdrawn = namedtuple('Withdrawn', ['acc', 'amount', 'balance', 'daily', 'date', 'cash', 'notes', 'ts'])
+Transferred = namedtuple('Transferred', ['src', 'dst', 'amount', 'src_balance', 'dst_balance', 'ts'])
+# `transfer` is the shard coordinator's transfer id (see shards.py)
+TransferSent = namedtuple('TransferSent', ['acc', 'amount', 'balance', 'ts', 'transfer'], defaults=(None,))
+TransferReceived = namedtuple('TransferReceived', ['acc', 'amount', 'balance', 'ts', 'transfer'], defaults=(None,))
+InterestPaid = namedtuple('InterestPaid', ['acc', 'amount', 'balance', 'ts'])
+FeeCharged = namedtuple('FeeCharged', ['acc', 'amount', 'balance', 'ts'])
+PinChanged = namedtuple('PinChanged', ['acc', 'pin_hash'])
+PinAttemptsChanged = namedtuple('PinAttemptsChanged', ['acc', 'failed', 'locked_until'])
+CashLoaded = namedtuple('CashLoaded', ['notes', 'cash'])
+CashReplenished = namedtuple('CashReplenished', ['notes', 'ts'])
+DayClosed = namedtuple('DayClosed', ['day'])  # an ISO date closed by endofday.py
+
+# Journal record op -> event type
+EVENT_TYPES = {
+    'create': AccountCreated,
+    'opening': BalanceOpened,
+    'deposit': Deposited,
+    'withdraw': Withdrawn,
+    'transfer': Transferred,
+    'transfer_out': TransferSent,
+    'transfer_in': TransferReceived,
+    'interest': InterestPaid,
+    'fee': FeeCharged,
+    'pin': PinChanged,
+    'pin_attempts': PinAttemptsChanged,
+    'load_cash': CashLoaded,
+    'replenish': CashReplenished,
+    'day_closed': DayClosed,
+}
+EVENT_OPS = {event_type: op for op, event_type in EVENT_TYPES.items()}
+FLUSH_EVERY = 1024  # events buffered before they're written out
+
+
+_encode = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def from_line(line):
+    return [EVENT_TYPES[record[0]](*record[1:]) for record in json.loads(line)]
+
+
+def to_line(batch):
+    return _encode([(EVENT_OPS[type(event)],) + event for event in batch])
+
+
+# Events of one event file between two byte offsets. A line belongs to the
+# range it starts in, so ranges split at arbitrary offsets still cover every
+# event once.
+def read_file(path, start=0, end=None):
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            if f.read(1) != b"\n":
+                f.readline()
+        position = f.tell()
+        for line in f:
+            if end is not None and position >= end:
+                return
+            position += len(line)
+            # A torn final line from a crash mid-write is ignored
+            if not line.endswith(b"\n"):
+                return
+            yield from from_line(line)
+
+
+# Cut a partly written last line off an event file, so new events start on
+# a clean line
+def _drop_torn_tail(path):
+    with open(path, "r+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position:
+            size = min(1 << 16, position)
+            position -= size
+            f.seek(position)
+            newline = f.read(size).rfind(b"\n")
+            if newline >= 0:
+                position += newline + 1
+                break
+        if position != end:
+            f.truncate(position)
+
+
+# Append-only, in-memory event history with an optional backing file.
+# Events are numbered from 1 in the order they were appended. Appends only
+# build the event; serialising and writing happen in batches, every
+# FLUSH_EVERY events and on flush() or close().
+#
+# The journal stays the crash-safe record of current state: a crash can
+# lose the events appended since the last flush (Atm flushes at every
+# checkpoint), never what the journal has committed. Without a journal the
+# history is lossy: those events, and the operations they record, are gone
+# although the operations were acknowledged.
+class EventStore:
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+        self._unwritten = 0
+        self._lock = threading.Lock()
+        self._file = None
+        if path is not None:
+            if os.path.exists(path):
+                _drop_torn_tail(path)
+                self.events.extend(read_file(path))
+            self._file = open(path, "a", encoding="utf-8", buffering=1 << 20)
+
+    def __len__(self):
+        return len(self.events)
+
+    def append(self, op, fields):
+        event = EVENT_TYPES[op](**fields)
+        with self._lock:
+            self.events.append(event)
+            position = len(self.events)
+            if self._file is not None:
+                self._unwritten += 1
+                if self._unwritten >= FLUSH_EVERY:
+                    self._write_locked()
+        return position
+
+    # (position, event) for every event after `position`
+    def read(self, position=0):
+        events = self.events
+        while position < len(events):
+            event = events[position]
+            position += 1
+            yield position, event
+
+    def _write_locked(self):
+        if not self._unwritten:
+            return
+        self._file.write(to_line(self.events[-self._unwritten:]) + "\n")
+        self._unwritten = 0
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._write_locked()
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
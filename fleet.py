@@ -0,0 +1,359 @@
+import argparse
+import csv
+import datetime
+import heapq
+import itertools
+import random
+import time
+
+import Atm
+import pins
+from cassette import Cassette
+from money import format_money, parse_amount
+from records import format_timestamp
+
+# Discrete-event simulation of a fleet of ATMs sharing one ledger, for
+# planning cash replenishment.
+#
+# Each Machine has its own cassette and cash level. Withdrawals are events
+# on a single simulated clock: the scheduler pops the next one, swaps that
+# machine's cassette and ATM id into Atm and runs Atm.withdraw, so limits,
+# balances and histories behave exactly as they do for one ATM. Atm.clock
+# is pointed at the simulated time for the run, so weeks of traffic replay
+# in seconds.
+#
+# Traffic is either synthetic or recorded. Synthetic withdrawals arrive at
+# each machine as a Poisson process whose rate follows the hour of day and
+# day of week (generated by thinning), with one pending arrival per
+# machine on the event queue. A recorded trace is a CSV of timestamp, atm,
+# amount (dollars) and optionally account, in time order, streamed one row
+# ahead.
+#
+# Machines can be refilled to their starting notes on a fixed schedule,
+# and/or once their cash falls below a threshold, arriving after a lead
+# time. A cash-out is the first withdrawal a machine refuses for lack of
+# cash or notes since it was last refilled.
+#
+# The fleet shares Atm's one ledger but not its cash level, so don't run it
+# with a journal or event history open: their cash records assume one ATM.
+FLEET_NOTES = {20: 3000, 50: 400, 100: 1000}  # $180,000 per machine
+# Relative withdrawal rate by hour of day, averaging 1
+HOURLY_DEMAND = (0.2, 0.1, 0.1, 0.1, 0.1, 0.3, 0.6, 1.0, 1.3, 1.3, 1.4, 1.5,
+                 1.9, 1.8, 1.4, 1.3, 1.4, 1.7, 1.9, 1.6, 1.2, 0.9, 0.6, 0.3)
+DAY_DEMAND = (0.9, 0.9, 0.9, 1.0, 1.3, 1.2, 0.8)  # Monday first
+PEAK_DEMAND = max(HOURLY_DEMAND) * max(DAY_DEMAND)
+# Withdrawal amounts in dollars and how often each is asked for
+AMOUNTS = (20, 40, 60, 80, 100, 200, 300, 500)
+AMOUNT_WEIGHTS = (20, 25, 15, 10, 15, 10, 3, 2)
+CASH_REFUSALS = ("ATM does not have enough cash", "ATM cannot dispense this amount with the notes available")
+ACCOUNT_BALANCE = 10 ** 9  # cents, so balances never run out in a long run
+
+
+class Scheduler:
+    def __init__(self, start):
+        self.now = start
+        self.until = start
+        self.processed = 0
+        self._queue = []  # (time, sequence, action, args)
+        self._sequence = itertools.count()
+
+    def at(self, when, action, *args):
+        heapq.heappush(self._queue, (when, next(self._sequence), action, args))
+
+    # Run every event up to `until`, in time order; events at the same time
+    # run in the order they were scheduled. An event can end the run early
+    # by moving `until`.
+    def run(self):
+        queue = self._queue
+        pop = heapq.heappop
+        while queue and queue[0][0] <= self.until:
+            self.now, _, action, args = pop(queue)
+            action(*args)
+            self.processed += 1
+        self.now = self.until
+
+
+class Machine:
+    def __init__(self, atm_id, notes, rate=0.0):
+        self.atm_id = atm_id
+        self.full_notes = dict(notes)
+        self.cassette = Cassette(notes, max_amount=Atm.DAILY_LIMIT // 100)
+        self.cash = self.cassette.total() * 100
+        self.rate = rate  # mean withdrawals per hour
+        self.served = 0
+        self.dispensed = 0
+        self.refused_limits = 0  # by the account's balance or limits
+        self.refused_cash = 0
+        self.cash_outs = []  # times of each cash-out
+        self.out = False  # refused for cash since the last refill
+        self.refill_due = False  # a threshold refill is on its way
+        self.refills = 0
+        # Dispensing since the last refill, for predicting the next cash-out
+        self.cycle_start = 0
+        self.cycle_dispensed = 0
+
+    # When the machine runs out at its current rate: the cash-out time if
+    # it already has, None if it hasn't dispensed anything to go by
+    def runs_out(self, now):
+        if self.out:
+            return self.cash_outs[-1]
+        elapsed = now - self.cycle_start
+        if not self.cycle_dispensed or elapsed <= 0:
+            return None
+        return now + int(self.cash * elapsed / self.cycle_dispensed)
+
+
+class Fleet:
+    def __init__(self, machines, account_numbers, start, rng, refill_every=None, refill_below=None,
+                 lead_time=4 * 3600):
+        self.machines = {machine.atm_id: machine for machine in machines}
+        self.account_numbers = account_numbers
+        self.start = start
+        self.rng = rng
+        self.refill_every = refill_every  # seconds
+        self.refill_below = refill_below  # cents
+        self.lead_time = lead_time
+        self.scheduler = Scheduler(start)
+        self.cash_outs = []  # (time, atm id, cash left)
+        for machine in machines:
+            machine.cycle_start = start
+
+    def machine(self, atm_id):
+        machine = self.machines.get(atm_id)
+        if machine is None:
+            machine = self.machines[atm_id] = Machine(atm_id, FLEET_NOTES)
+            machine.cycle_start = self.scheduler.now
+            if self.refill_every:
+                self.scheduler.at(self.scheduler.now + self.refill_every, self.refill, machine, True)
+        return machine
+
+    # Relative demand at `timestamp`; the run starts at local midnight
+    def demand(self, timestamp):
+        hours = (timestamp - self.start) // 3600
+        day = (self._start_weekday + hours // 24) % 7
+        return HOURLY_DEMAND[hours % 24] * DAY_DEMAND[day]
+
+    def withdraw(self, machine, account_number, amount):
+        now = self.scheduler.now
+        Atm.cassette, Atm.atm_cash, Atm.atm_id = machine.cassette, machine.cash, machine.atm_id
+        ok, message = Atm.withdraw(account_number, amount)
+        machine.cash = Atm.atm_cash
+        if ok:
+            machine.served += 1
+            machine.dispensed += amount
+            machine.cycle_dispensed += amount
+            if (self.refill_below is not None and machine.cash < self.refill_below
+                    and not machine.refill_due):
+                machine.refill_due = True
+                self.scheduler.at(now + self.lead_time, self.refill, machine, False)
+        elif message in CASH_REFUSALS:
+            machine.refused_cash += 1
+            if not machine.out:
+                machine.out = True
+                machine.cash_outs.append(now)
+                self.cash_outs.append((now, machine.atm_id, machine.cash))
+        else:
+            machine.refused_limits += 1
+
+    # Top the cassette back up to the machine's starting notes
+    def refill(self, machine, scheduled):
+        now = self.scheduler.now
+        notes = {denomination: count - machine.cassette.notes.get(denomination, 0)
+                 for denomination, count in machine.full_notes.items()}
+        notes = {denomination: count for denomination, count in notes.items() if count > 0}
+        if notes:
+            machine.cassette.replenish(notes, format_timestamp(now))
+            machine.cash = machine.cassette.total() * 100
+        machine.refills += 1
+        machine.out = False
+        machine.cycle_start = now
+        machine.cycle_dispensed = 0
+        if scheduled:
+            if now + self.refill_every <= self.scheduler.until:
+                self.scheduler.at(now + self.refill_every, self.refill, machine, True)
+        else:
+            machine.refill_due = False
+
+    def _arrival(self, machine):
+        rng = self.rng
+        self.withdraw(machine, rng.choice(self.account_numbers),
+                      rng.choices(AMOUNTS, AMOUNT_WEIGHTS)[0] * 100)
+        self._schedule_arrival(machine)
+
+    # The next withdrawal at `machine`, thinned from arrivals at its peak rate
+    def _schedule_arrival(self, machine):
+        rng = self.rng
+        peak = machine.rate * PEAK_DEMAND / 3600
+        when = self.scheduler.now
+        while True:
+            when += rng.expovariate(peak)
+            if when > self.scheduler.until:
+                return
+            if rng.random() * PEAK_DEMAND <= self.demand(int(when)):
+                self.scheduler.at(when, self._arrival, machine)
+                return
+
+    # Schedule the trace's next row; the run ends with the trace
+    def _replay(self, rows):
+        scheduler = self.scheduler
+        for timestamp, atm_id, amount, account_number in rows:
+            if timestamp > scheduler.until:
+                break
+            if timestamp >= scheduler.now:
+                scheduler.at(timestamp, self._recorded, atm_id, amount, account_number, rows)
+                return
+        scheduler.until = min(scheduler.until, max(scheduler.now, self.start))
+
+    def _recorded(self, atm_id, amount, account_number, rows):
+        if account_number is None or account_number not in Atm.accounts:
+            account_number = self.rng.choice(self.account_numbers)
+        self.withdraw(self.machine(atm_id), account_number, amount)
+        self._replay(rows)
+
+    # Simulate until `until`, with synthetic traffic or the rows of a
+    # recorded trace, which can end the run sooner. Returns the wall-clock
+    # seconds taken.
+    def run(self, until, trace=None):
+        self.scheduler.until = until
+        self._start_weekday = datetime.datetime.fromtimestamp(self.start).weekday()
+        scheduler = self.scheduler
+        if trace is None:
+            for machine in self.machines.values():
+                self._schedule_arrival(machine)
+        else:
+            self._replay(iter(trace))
+        if self.refill_every:
+            # Stagger the rounds so the fleet isn't all refilled at once
+            machines = list(self.machines.values())
+            for index, machine in enumerate(machines):
+                scheduler.at(self.start + self.refill_every * (index + 1) // len(machines), self.refill,
+                             machine, True)
+
+        saved = Atm.clock, Atm.cassette, Atm.atm_cash, Atm.atm_id
+        Atm.clock = lambda: scheduler.now
+        started = time.perf_counter()
+        try:
+            scheduler.run()
+        finally:
+            Atm.clock, Atm.cassette, Atm.atm_cash, Atm.atm_id = saved
+        return time.perf_counter() - started
+
+
+# Withdrawal rows of a recorded trace as (timestamp, atm id, cents, account
+# number or None). Timestamps are epoch seconds or ISO date-times.
+def read_trace(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            timestamp = row['timestamp']
+            timestamp = int(timestamp) if timestamp.isdigit() else \
+                int(datetime.datetime.fromisoformat(timestamp).timestamp())
+            yield timestamp, row['atm'], parse_amount(row['amount']), row.get('account') or None
+
+
+def create_accounts(count):
+    pin_hash = pins.hash_pin("1234")
+    return [Atm.create_account(f"Fleet {i}", "1234", ACCOUNT_BALANCE, pin_hash)[0] for i in range(count)]
+
+
+def _time(timestamp):
+    return format_timestamp(timestamp)[:16] if timestamp is not None else "-"
+
+
+def report(fleet, elapsed, show):
+    machines = list(fleet.machines.values())
+    now = fleet.scheduler.now
+    simulated = now - fleet.start
+    events = fleet.scheduler.processed
+    print(f"{len(machines)} ATMs, {simulated / 86400:.1f} days simulated: {events:,} events in {elapsed:.2f}s "
+          f"({events / elapsed:,.0f} events/sec, {simulated / elapsed:,.0f}x real time)")
+    print(f"Withdrawals: {sum(m.served for m in machines):,} served "
+          f"({format_money(sum(m.dispensed for m in machines))}), "
+          f"{sum(m.refused_limits for m in machines):,} refused by balance or limits, "
+          f"{sum(m.refused_cash for m in machines):,} refused for cash")
+    print(f"Refills: {sum(m.refills for m in machines):,}, cash-outs: {len(fleet.cash_outs):,} "
+          f"on {sum(1 for m in machines if m.cash_outs):,} ATMs")
+
+    if fleet.cash_outs:
+        print("\nFirst cash-outs:")
+        for timestamp, atm_id, cash in fleet.cash_outs[:show]:
+            print(f"  {_time(timestamp)}  {atm_id:<10} {format_money(cash):>12} left")
+
+    # Soonest to run out first; machines with no dispensing to go by last
+    def soonest(machine):
+        runs_out = machine.runs_out(now)
+        return (runs_out is None, runs_out or 0)
+
+    print(f"\n{'ATM':<10} {'served':>8} {'dispensed':>14} {'cash left':>12} {'cash-outs':>9} {'runs out':>17}")
+    print("-" * 75)
+    for machine in sorted(machines, key=soonest)[:show]:
+        runs_out = machine.runs_out(now)
+        mark = "" if machine.out or runs_out is None else " *"
+        print(f"{machine.atm_id:<10} {machine.served:>8,} {format_money(machine.dispensed):>14} "
+              f"{format_money(machine.cash):>12} {len(machine.cash_outs):>9} {_time(runs_out):>17}{mark}")
+    print("* predicted from the machine's dispensing since its last refill")
+
+
+def write_report_csv(path, fleet):
+    now = fleet.scheduler.now
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(['atm', 'served', 'dispensed', 'cash_left', 'refused_cash', 'cash_outs', 'refills',
+                         'first_cash_out', 'runs_out'])
+        for machine in fleet.machines.values():
+            runs_out = machine.runs_out(now)
+            writer.writerow([machine.atm_id, machine.served, format_money(machine.dispensed),
+                             format_money(machine.cash), machine.refused_cash, len(machine.cash_outs),
+                             machine.refills, _time(machine.cash_outs[0]) if machine.cash_outs else "",
+                             _time(runs_out) if runs_out is not None else ""])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate withdrawals across a fleet of ATMs")
+    parser.add_argument("--atms", type=int, default=100)
+    parser.add_argument("--days", type=float, help="days to simulate: 14, or until the trace ends")
+    parser.add_argument("--rate", type=float, default=8, help="mean withdrawals per ATM per hour")
+    parser.add_argument("--accounts", type=int, default=20_000)
+    parser.add_argument("--start", type=datetime.date.fromisoformat,
+                        help="first day simulated (YYYY-MM-DD); today, or the trace's first day")
+    parser.add_argument("--trace", metavar="CSV",
+                        help="replay recorded withdrawals (timestamp,atm,amount[,account]) instead")
+    parser.add_argument("--refill-every", type=float, metavar="HOURS", help="refill each ATM on a schedule")
+    parser.add_argument("--refill-below", type=parse_amount, metavar="DOLLARS",
+                        help="send a refill when an ATM's cash falls below this")
+    parser.add_argument("--lead-time", type=float, default=4, metavar="HOURS",
+                        help="time for a --refill-below refill to arrive")
+    parser.add_argument("--show", type=int, default=20, help="ATMs and cash-outs to list")
+    parser.add_argument("--csv", metavar="PATH", help="write every ATM's figures to PATH")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    day = args.start or datetime.date.today()
+    trace = None
+    if args.trace:
+        trace = read_trace(args.trace)
+        first = next(trace, None)
+        if first is None:
+            raise SystemExit(f"{args.trace} has no withdrawals")
+        trace = itertools.chain([first], trace)
+        day = args.start or datetime.date.fromtimestamp(first[0])
+        machines = []
+    else:
+        machines = [Machine(f"ATM{index:04d}", FLEET_NOTES, args.rate * rng.lognormvariate(0, 0.4))
+                    for index in range(1, args.atms + 1)]
+    start = int(datetime.datetime.combine(day, datetime.time()).timestamp())
+    fleet = Fleet(machines, create_accounts(args.accounts), start, rng,
+                  refill_every=args.refill_every and int(args.refill_every * 3600),
+                  refill_below=args.refill_below, lead_time=int(args.lead_time * 3600))
+    if args.days is not None:
+        until = start + int(args.days * 86400)
+    else:
+        until = float("inf") if trace is not None else start + 14 * 86400
+    elapsed = fleet.run(until, trace)
+    report(fleet, elapsed, args.show)
+    if args.csv:
+        write_report_csv(args.csv, fleet)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+import argparse
+import math
+import threading
+import time
+from collections import deque, namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # batch re-scoring falls back to replaying each history
+    np = None
+
+from money import format_money
+from records import TRANSACTION_TYPES, format_timestamp
+
+# Streaming fraud scoring of the transaction flow.
+#
+# Every transaction Atm records is fed to observe(), which folds it into
+# its account's features; failed PINs are fed to pin_failed() per card.
+# Withdrawals and transfers are scored by screen() before they're applied,
+# from the features as they stand, and flagged or refused when the score
+# reaches the policy's thresholds.
+#
+# The features are exponentially decayed rather than kept as windows of
+# events, so each account and card costs a fixed handful of numbers and an
+# update is O(1) however busy it is:
+#
+#   velocity        transactions in roughly the last VELOCITY_SECONDS
+#   amount          z-score of a debit against the account's running mean
+#                   and variance of debits (weighted towards recent ones)
+#   new recipient   a transfer to an account not among the last few it paid,
+#                   scoring higher when several came recently
+#   failed PINs     wrong PINs on the card in roughly the last PIN_SECONDS
+#
+# Each feature adds points once past its normal range; a score is their
+# sum, and the reasons are the features that added to it.
+#
+# rescore() scores stored histories the same way in bulk. Histories don't
+# record recipients or PIN failures, so only velocity and amount count
+# there. With NumPy it steps every account's history forward together, one
+# position at a time, as column arrays; without it, it replays each
+# history through a fresh scorer. Both give the scores screen() would have.
+VELOCITY_SECONDS = 600
+VELOCITY_NORMAL = 4  # transactions per VELOCITY_SECONDS before velocity counts
+VELOCITY_WEIGHT = 0.25  # points per transaction over
+AMOUNT_ALPHA = 0.1  # weight of each new debit in the running mean and variance
+AMOUNT_MIN_HISTORY = 5  # debits seen before amounts are judged
+AMOUNT_MIN_STD = 1000  # cents, so a steady account's first odd amount isn't extreme
+AMOUNT_NORMAL = 3.0  # z-score before the amount counts
+AMOUNT_WEIGHT = 0.25  # points per standard deviation over
+RECENT_RECIPIENTS = 8
+NEW_RECIPIENT_WEIGHT = 0.25  # points for a new recipient, and per recent one before it
+PIN_SECONDS = 300
+PIN_WEIGHT = 0.4  # points per recent failed PIN
+DEBITS = ("Withdrawal", "Transfer Out")
+ALERTS_KEPT = 1000
+
+# A scored operation that reached the flag threshold
+Alert = namedtuple('Alert', ['timestamp', 'account', 'type', 'amount', 'score', 'reasons', 'blocked'])
+
+
+# Scores at which an operation is flagged and refused. block_score None
+# only flags.
+class FraudPolicy:
+    def __init__(self, flag_score=1.0, block_score=None):
+        self.flag_score = flag_score
+        self.block_score = block_score
+
+
+class AccountFeatures:
+    __slots__ = ('last', 'rate', 'mean', 'variance', 'debits', 'recipients', 'new_recipients')
+
+    def __init__(self):
+        self.last = 0  # time of the last transaction
+        self.rate = 0.0  # decayed count of transactions as of `last`
+        self.mean = 0.0  # running mean and variance of debit amounts
+        self.variance = 0.0
+        self.debits = 0
+        self.recipients = ()  # most recent first
+        self.new_recipients = 0.0  # decayed count of new recipients as of `last`
+
+
+class CardFeatures:
+    __slots__ = ('last', 'failed')
+
+    def __init__(self):
+        self.last = 0
+        self.failed = 0.0  # decayed count of failed PINs as of `last`
+
+
+def _velocity_points(rate):
+    return max(0.0, rate - VELOCITY_NORMAL) * VELOCITY_WEIGHT
+
+
+def _amount_points(features, amount):
+    if features.debits < AMOUNT_MIN_HISTORY:
+        return 0.0
+    z = (amount - features.mean) / max(math.sqrt(features.variance), AMOUNT_MIN_STD)
+    return max(0.0, z - AMOUNT_NORMAL) * AMOUNT_WEIGHT
+
+
+class FraudScorer:
+    def __init__(self, policy=None):
+        self.policy = policy or FraudPolicy()
+        self.accounts = {}  # account number -> AccountFeatures
+        self.cards = {}  # card number -> CardFeatures
+        self.alerts = deque(maxlen=ALERTS_KEPT)
+        self.flagged = 0
+        self.blocked = 0
+        self.lock = threading.Lock()  # alerts and counts
+
+    # Score an operation from the features as they stand, without changing
+    # them: (points, reasons)
+    def score(self, account_number, card_number, transaction_type, amount, now, recipient=None):
+        points = 0.0
+        reasons = []
+        features = self.accounts.get(account_number)
+        if features is not None:
+            decay = math.exp((features.last - now) / VELOCITY_SECONDS)
+            velocity = _velocity_points(features.rate * decay + 1)
+            if velocity:
+                points += velocity
+                reasons.append("velocity")
+            if transaction_type in DEBITS:
+                amount_points = _amount_points(features, amount)
+                if amount_points:
+                    points += amount_points
+                    reasons.append("amount")
+            if recipient is not None and recipient not in features.recipients:
+                points += NEW_RECIPIENT_WEIGHT * (1 + features.new_recipients * decay)
+                reasons.append("new recipient")
+        elif recipient is not None:
+            points += NEW_RECIPIENT_WEIGHT
+            reasons.append("new recipient")
+        card = self.cards.get(card_number)
+        if card is not None and card.failed:
+            failed = card.failed * math.exp((card.last - now) / PIN_SECONDS)
+            if failed >= 0.5:
+                points += failed * PIN_WEIGHT
+                reasons.append("failed PINs")
+        return points, reasons
+
+    # Score an operation about to be applied, recording an alert when it
+    # reaches the flag score. Returns a refusal message when it reaches the
+    # block score, otherwise None.
+    def screen(self, account_number, card_number, transaction_type, amount, now, recipient=None):
+        points, reasons = self.score(account_number, card_number, transaction_type, amount, now, recipient)
+        policy = self.policy
+        if points < policy.flag_score:
+            return None
+        blocked = policy.block_score is not None and points >= policy.block_score
+        with self.lock:
+            self.alerts.append(Alert(now, account_number, transaction_type, amount, round(points, 2),
+                                     tuple(reasons), blocked))
+            self.flagged += 1
+            if blocked:
+                self.blocked += 1
+        if blocked:
+            return f"Blocked as suspicious: {', '.join(reasons)}"
+        return None
+
+    # Fold a recorded transaction into its account's features. Callers
+    # hold the account's lock.
+    def observe(self, account_number, transaction_type, amount, timestamp, counterparty=None):
+        features = self.accounts.get(account_number)
+        if features is None:
+            features = self.accounts.setdefault(account_number, AccountFeatures())
+        decay = math.exp((features.last - timestamp) / VELOCITY_SECONDS) if features.last else 0.0
+        features.rate = features.rate * decay + 1
+        features.new_recipients *= decay
+        features.last = timestamp
+        if transaction_type in DEBITS:
+            if features.debits:
+                difference = amount - features.mean
+                increment = AMOUNT_ALPHA * difference
+                features.mean += increment
+                features.variance = (1 - AMOUNT_ALPHA) * (features.variance + difference * increment)
+            else:
+                features.mean = float(amount)
+            features.debits += 1
+        if counterparty is not None:
+            recipients = features.recipients
+            if counterparty in recipients:
+                recipients = tuple(r for r in recipients if r != counterparty)
+            else:
+                features.new_recipients += 1
+            features.recipients = (counterparty,) + recipients[:RECENT_RECIPIENTS - 1]
+
+    def pin_failed(self, card_number, timestamp):
+        card = self.cards.get(card_number)
+        if card is None:
+            card = self.cards.setdefault(card_number, CardFeatures())
+        card.failed = card.failed * math.exp((card.last - timestamp) / PIN_SECONDS) + 1
+        card.last = timestamp
+
+
+# Score every debit in `logs` (account number -> TransactionLog) as
+# screen() would have just before it was applied. Returns how many debits
+# were scored and (account number, position in its log, score) for each
+# that reached the policy's flag score.
+def rescore(logs, policy=None):
+    policy = policy or FraudPolicy()
+    if np is None:
+        return _rescore_replay(logs, policy)
+    return _rescore_columns(logs, policy)
+
+
+def _rescore_replay(logs, policy):
+    scored = 0
+    flagged = []
+    for account_number, log in logs.items():
+        scorer = FraudScorer(policy)
+        for position, transaction in enumerate(log):
+            if transaction.type in DEBITS:
+                points, _ = scorer.score(account_number, None, transaction.type, transaction.amount,
+                                         transaction.timestamp)
+                scored += 1
+                if points >= policy.flag_score:
+                    flagged.append((account_number, position, points))
+            scorer.observe(account_number, transaction.type, transaction.amount, transaction.timestamp)
+    return scored, flagged
+
+
+# The same recurrences as FraudScorer.score and observe, over every
+# account at once: step k updates the k-th transaction of every account
+# whose history is that long. Accounts are ordered longest history first,
+# so the accounts still going at each step are a prefix of the arrays.
+def _rescore_columns(logs, policy):
+    numbers = [account_number for account_number, log in logs.items() if len(log)]
+    if not numbers:
+        return 0, []
+    numbers.sort(key=lambda account_number: len(logs[account_number]), reverse=True)
+    lengths = np.array([len(logs[account_number]) for account_number in numbers])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    timestamps = np.concatenate([np.frombuffer(logs[n].timestamps, dtype=np.int64) for n in numbers])
+    amounts = np.concatenate([np.frombuffer(logs[n].amounts, dtype=np.int64) for n in numbers]).astype(float)
+    types = np.concatenate([np.frombuffer(logs[n].types, dtype=np.uint8) for n in numbers])
+    debit_codes = [TRANSACTION_TYPES.index(name) for name in DEBITS]
+    debit = np.isin(types, debit_codes)
+    # How many accounts are still going at each step
+    active = len(numbers) - np.searchsorted(lengths[::-1], np.arange(lengths[0]), side='right')
+
+    count = len(numbers)
+    last = np.zeros(count)
+    rate = np.zeros(count)
+    mean = np.zeros(count)
+    variance = np.zeros(count)
+    debits = np.zeros(count, dtype=np.int64)
+    scores = np.zeros(len(timestamps))
+    for step in range(lengths[0]):
+        going = active[step]
+        rows = starts[:going] + step
+        now = timestamps[rows]
+        amount = amounts[rows]
+        is_debit = debit[rows]
+        seen = debits[:going]
+        # A never-seen account has last == 0 and a rate of 0, so its decay
+        # doesn't matter
+        decayed = rate[:going] * np.exp((last[:going] - now) / VELOCITY_SECONDS) + 1
+        points = np.maximum(0.0, decayed - VELOCITY_NORMAL) * VELOCITY_WEIGHT
+        z = (amount - mean[:going]) / np.maximum(np.sqrt(variance[:going]), AMOUNT_MIN_STD)
+        judged = seen >= AMOUNT_MIN_HISTORY
+        points += np.where(judged, np.maximum(0.0, z - AMOUNT_NORMAL) * AMOUNT_WEIGHT, 0.0)
+        scores[rows] = np.where(is_debit, points, 0.0)
+
+        rate[:going] = decayed
+        last[:going] = now
+        difference = amount - mean[:going]
+        increment = AMOUNT_ALPHA * difference
+        first = seen == 0
+        new_mean = np.where(first, amount, mean[:going] + increment)
+        new_variance = np.where(first, 0.0, (1 - AMOUNT_ALPHA) * (variance[:going] + difference * increment))
+        mean[:going] = np.where(is_debit, new_mean, mean[:going])
+        variance[:going] = np.where(is_debit, new_variance, variance[:going])
+        debits[:going] += is_debit
+
+    flagged = []
+    account_of_row = np.repeat(np.arange(count), lengths)
+    for row in np.flatnonzero(scores >= policy.flag_score):
+        account = account_of_row[row]
+        flagged.append((numbers[account], int(row - starts[account]), float(scores[row])))
+    return int(debit.sum()), flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score stored account histories for suspicious debits")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--journal", metavar="DIR", help="journal directory holding the accounts")
+    source.add_argument("--database", metavar="FILE", help="SQLite database holding the accounts")
+    parser.add_argument("--flag-score", type=float, default=FraudPolicy().flag_score)
+    parser.add_argument("--show", type=int, default=20, help="flagged debits to list")
+    args = parser.parse_args()
+
+    import Atm
+    if args.journal:
+        Atm.open_journal(args.journal)
+    else:
+        Atm.open_database(args.database)
+    try:
+        logs = {account_number: account.transactions for account_number, account in Atm.accounts.items()}
+        start = time.perf_counter()
+        scored, flagged = rescore(logs, FraudPolicy(args.flag_score))
+        elapsed = time.perf_counter() - start
+    finally:
+        Atm.close_journal()
+        Atm.close_database()
+    mode = "column arrays" if np is not None else "replay"
+    print(f"{scored:,} debits in {len(logs):,} accounts scored in {elapsed:.2f}s ({mode}), {len(flagged):,} flagged")
+    flagged.sort(key=lambda row: row[2], reverse=True)
+    for account_number, position, points in flagged[:args.show]:
+        transaction = logs[account_number][position]
+        print(f"  {account_number}  {format_timestamp(transaction.timestamp)}  {transaction.type:<12} "
+              f"{format_money(transaction.amount):>12}  score {points:.2f}")
+
+
+if __name__ == "__main__":
+    main()
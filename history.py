@@ -0,0 +1,74 @@
+import heapq
+from bisect import bisect_left, bisect_right
+
+from records import TYPE_CODES
+
+# Queries over one account's TransactionLog.
+#
+# A time range is narrowed to a slice of rows by binary search on the
+# timestamp column. A type filter walks only that type's position index
+# (merging several types in order) instead of every row. Amount bounds are
+# checked on the rows that remain. Results are generated lazily, so a
+# caller can stream a long history without building it in memory.
+
+
+# Yield (position, Transaction) for matching rows, oldest first or newest
+# first. `start` and `end` are inclusive epoch seconds, amounts are cents.
+# `after` is a position to resume from (exclusive), as returned in a cursor.
+def query(log, start=None, end=None, types=None, min_amount=None, max_amount=None,
+          after=None, newest_first=False):
+    if not len(log):
+        return
+    low = 0 if start is None else bisect_left(log.timestamps, start)
+    high = len(log) if end is None else bisect_right(log.timestamps, end)
+    if after is not None:
+        if newest_first:
+            high = min(high, after)
+        else:
+            low = max(low, after + 1)
+    if low >= high:
+        return
+
+    if types is None:
+        positions = range(high - 1, low - 1, -1) if newest_first else range(low, high)
+    else:
+        positions = _type_positions(log, types, low, high, newest_first)
+
+    amounts = log.amounts
+    for position in positions:
+        amount = amounts[position]
+        if min_amount is not None and amount < min_amount:
+            continue
+        if max_amount is not None and amount > max_amount:
+            continue
+        yield position, log[position]
+
+
+# Positions of the given types' rows within [low, high), in order
+def _type_positions(log, types, low, high, newest_first):
+    ranges = []
+    for transaction_type in types:
+        index = log.by_type[TYPE_CODES[transaction_type]]
+        first = bisect_left(index, low)
+        last = bisect_left(index, high)
+        if first < last:
+            if newest_first:
+                ranges.append(map(index.__getitem__, range(last - 1, first - 1, -1)))
+            else:
+                ranges.append(map(index.__getitem__, range(first, last)))
+    if len(ranges) == 1:
+        return ranges[0]
+    return heapq.merge(*ranges, reverse=newest_first)
+
+
+# One page of results plus a cursor for the next page (None when there
+# are no more). Pass the cursor back with the same filters to continue.
+def page(log, limit, cursor=None, **filters):
+    rows = []
+    results = query(log, after=cursor, **filters)
+    for position, transaction in results:
+        if len(rows) == limit:
+            return rows, cursor
+        rows.append(transaction)
+        cursor = position
+    return rows, None
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+
+JOURNAL_FILE = "journal.log"
+SNAPSHOT_FILE = "snapshot.json"
+
+
+# Append-only write-ahead journal with group commit and snapshots.
+#
+# Records are JSON lines tagged with an increasing sequence number. Appends
+# are buffered and written + fsynced together once `group_size` records are
+# pending or the oldest pending record is `group_interval` seconds old, so one
+# fsync covers a whole batch. A group_size of 1 fsyncs every record.
+#
+# An appended record isn't durable until its batch is. Callers that must
+# not report a change before then wait for its sequence number with
+# wait_durable(), which commits the pending batch itself unless another
+# commit is already writing; records appended while that fsync runs make
+# up the next batch, so concurrent waiters still share fsyncs.
+class Journal:
+    def __init__(self, directory, group_size=64, group_interval=0.05, snapshot_every=10000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.snapshot_every = snapshot_every
+        self.seq = 0
+        self.durable_seq = 0  # every record up to here is on disk
+        self.records_since_snapshot = 0
+        self._pending = []
+        self._oldest_pending = 0.0
+        self._lock = threading.Lock()
+        self._durable = threading.Condition(self._lock)
+        self._committing = False
+        self._file = None
+        self._flusher = None
+        self._closed = False
+
+    # Load the latest snapshot and yield every journal record after it.
+    # Must be called before the journal is opened for appending.
+    def recover(self):
+        state = None
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            snapshot_seq = snapshot["seq"]
+            state = snapshot["state"]
+        self.seq = snapshot_seq
+        return state, self._replay(snapshot_seq)
+
+    def _replay(self, after_seq):
+        if not os.path.exists(self.journal_path):
+            return
+        good_bytes = 0
+        with open(self.journal_path, "rb") as f:
+            for line in f:
+                # A torn final record from a crash mid-write ends the replay
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                good_bytes += len(line)
+                if record["seq"] <= after_seq:
+                    continue
+                self.seq = record["seq"]
+                self.records_since_snapshot += 1
+                yield record
+        # Drop the torn tail so new appends start on a clean line
+        if good_bytes != os.path.getsize(self.journal_path):
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(good_bytes)
+
+    def open(self):
+        self.durable_seq = self.seq
+        self._file = open(self.journal_path, "ab")
+        if self.group_size > 1 and self.group_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def append(self, record):
+        with self._lock:
+            self.seq += 1
+            record["seq"] = self.seq
+            if not self._pending:
+                self._oldest_pending = time.monotonic()
+            self._pending.append(json.dumps(record, separators=(",", ":")))
+            self.records_since_snapshot += 1
+            if len(self._pending) >= self.group_size:
+                self._commit_locked()
+            return self.seq
+
+    def commit(self):
+        with self._lock:
+            self._commit_locked()
+
+    # Block until the record numbered `seq` is on disk
+    def wait_durable(self, seq):
+        with self._lock:
+            while self.durable_seq < seq and self._file is not None:
+                if self._committing:
+                    self._durable.wait()
+                else:
+                    self._commit_locked()
+
+    # Write and fsync the pending batch. The lock is let go for the write so
+    # appends can go on building the next batch; a commit already writing is
+    # waited out first so batches land in order.
+    def _commit_locked(self):
+        while self._committing:
+            self._durable.wait()
+        if not self._pending or self._file is None:
+            return
+        batch, last_seq = self._pending, self.seq
+        self._pending = []
+        batch.append("")
+        self._committing = True
+        self._lock.release()
+        try:
+            self._file.write("\n".join(batch).encode("utf-8"))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        finally:
+            self._lock.acquire()
+            self._committing = False
+            self._durable.notify_all()
+        self.durable_seq = last_seq
+
+    # Commit batches that have waited longer than group_interval while idle
+    def _flush_loop(self):
+        while not self._closed:
+            time.sleep(self.group_interval)
+            with self._lock:
+                if self._pending and time.monotonic() - self._oldest_pending >= self.group_interval:
+                    self._commit_locked()
+
+    def needs_snapshot(self):
+        return self.snapshot_every and self.records_since_snapshot >= self.snapshot_every
+
+    # Write a compact snapshot of `state` covering every record appended so
+    # far, then truncate the journal so startup only replays newer records.
+    def snapshot(self, state):
+        with self._lock:
+            self._commit_locked()
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"seq": self.durable_seq, "state": state}, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            # Records up to durable_seq are skipped on replay even if the
+            # truncate below never happens, so a crash here is harmless
+            if self._file is not None:
+                self._file.truncate(0)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self.records_since_snapshot = 0
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            self._commit_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
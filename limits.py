@@ -0,0 +1,142 @@
+import datetime
+import threading
+from collections import OrderedDict, deque
+
+import history
+from money import format_money
+
+# Withdrawal limits: a rolling 24-hour amount limit (each account's
+# daily_limit), an optional cap per withdrawal and an optional velocity
+# rule of at most N withdrawals per period.
+#
+# Each account's recent withdrawals are kept in a WithdrawalWindow, a queue
+# of (timestamp, amount) with a running total. Withdrawals that have left
+# the window are dropped when the account is next checked, so there is no
+# nightly reset, and each drop is paid for once. The limits themselves
+# bound how many withdrawals a window can hold, so a check costs the same
+# however long the account's history is.
+#
+# Windows are only a cache of what the transaction log already records: a
+# window missing from the cache (never loaded, evicted, or lost with a
+# restart) is rebuilt from the log's Withdrawal index for the last 24
+# hours. Nothing about limits needs persisting beyond the log itself.
+WINDOW_SECONDS = 24 * 3600
+WINDOW_CACHE_SIZE = 100_000
+
+
+# The rules applied on top of each account's rolling daily limit. Either
+# can be None to switch it off.
+class LimitPolicy:
+    def __init__(self, per_withdrawal=None, max_withdrawals=None, velocity_seconds=3600):
+        self.per_withdrawal = per_withdrawal  # cents
+        self.max_withdrawals = max_withdrawals  # per velocity_seconds
+        self.velocity_seconds = velocity_seconds
+
+
+class WithdrawalWindow:
+    __slots__ = ('events', 'total')
+
+    def __init__(self, events=()):
+        self.events = deque(events)
+        self.total = sum(amount for _, amount in self.events)
+
+    def expire(self, now):
+        cutoff = now - WINDOW_SECONDS
+        events = self.events
+        while events and events[0][0] <= cutoff:
+            self.total -= events.popleft()[1]
+
+    def add(self, timestamp, amount):
+        self.events.append((timestamp, amount))
+        self.total += amount
+
+    # Withdrawals after `since`, counting back from the newest and giving
+    # up once `limit` is reached
+    def count_since(self, since, limit):
+        count = 0
+        for timestamp, _ in reversed(self.events):
+            if timestamp <= since or count == limit:
+                break
+            count += 1
+        return count
+
+
+# Recent withdrawals of an account as recorded in its history. When the
+# history has none but the account's last withdrawal was recent enough that
+# it should (the account store keeps no history across restarts), its
+# recorded 24-hour total is counted from the start of that day instead.
+# That day start is never later than the withdrawal itself, so a complete
+# history never takes this path.
+def _load_window(account, now):
+    since = now - WINDOW_SECONDS + 1
+    log = account.transactions
+    window = WithdrawalWindow((transaction.timestamp, transaction.amount)
+                              for _, transaction in history.query(log, start=since, types=("Withdrawal",)))
+    if not window.events and account.daily_withdrawals and account.last_withdraw_date:
+        day = datetime.date.fromisoformat(account.last_withdraw_date)
+        day_start = int(datetime.datetime.combine(day, datetime.time()).timestamp())
+        if day_start >= since:
+            window.add(day_start, account.daily_withdrawals)
+    return window
+
+
+# The reason a withdrawal of `amount` breaks a limit, or None, given what
+# the account withdrew in the last 24 hours and how many withdrawals it
+# made in the policy's velocity period
+def limit_refusal(policy, amount, daily_limit, withdrawn, recent):
+    if policy.per_withdrawal is not None and amount > policy.per_withdrawal:
+        return f"Withdrawal limit of {format_money(policy.per_withdrawal)} per transaction exceeded"
+    if withdrawn + amount > daily_limit:
+        return f"Daily withdrawal limit of {format_money(daily_limit)} exceeded"
+    if policy.max_withdrawals is not None and recent >= policy.max_withdrawals:
+        return f"Too many withdrawals: at most {policy.max_withdrawals} per {policy.velocity_seconds // 60} minutes"
+    return None
+
+
+class LimitsEngine:
+    def __init__(self, policy=None, cache_size=WINDOW_CACHE_SIZE):
+        self.policy = policy or LimitPolicy()
+        self.cache_size = cache_size
+        self.windows = OrderedDict()  # account number -> WithdrawalWindow, least recently used first
+        self.lock = threading.Lock()
+
+    # Callers hold the account's lock, so only the cache itself needs this
+    # engine's lock
+    def _window(self, account_number, account, now):
+        with self.lock:
+            window = self.windows.get(account_number)
+            if window is not None:
+                self.windows.move_to_end(account_number)
+        if window is None:
+            window = _load_window(account, now)
+            with self.lock:
+                self.windows[account_number] = window
+                if len(self.windows) > self.cache_size:
+                    self.windows.popitem(last=False)
+        window.expire(now)
+        return window
+
+    # The reason a withdrawal of `amount` at `now` breaks a limit, or None
+    def check(self, account_number, account, amount, now):
+        policy = self.policy
+        window = self._window(account_number, account, now)
+        recent = 0
+        if policy.max_withdrawals is not None:
+            recent = window.count_since(now - policy.velocity_seconds, policy.max_withdrawals)
+        return limit_refusal(policy, amount, account.daily_limit, window.total, recent)
+
+    # Count a withdrawal that is going through, returning the account's
+    # total for the last 24 hours. Call it before the withdrawal is added to
+    # the history, so a window rebuilt here doesn't count it twice.
+    def record(self, account_number, account, amount, timestamp):
+        window = self._window(account_number, account, timestamp)
+        window.add(timestamp, amount)
+        return window.total
+
+    # Amount the account can still withdraw under its rolling limit
+    def remaining(self, account_number, account, now):
+        return max(0, account.daily_limit - self._window(account_number, account, now).total)
+
+    def clear(self):
+        with self.lock:
+            self.windows.clear()
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import random
+import time
+
+import Atm
+import server
+
+# Share of each menu operation in a generated session
+OPERATION_MIX = [
+    ("BALANCE", 0.3),
+    ("WITHDRAW", 0.25),
+    ("DEPOSIT", 0.25),
+    ("HISTORY", 0.1),
+    ("TRANSFER", 0.1),
+]
+
+
+def _menu_command(rng, operation, pin, accounts):
+    amount = rng.choice((20, 50, 100))
+    if operation == "WITHDRAW":
+        return f"WITHDRAW {amount} {pin}"
+    if operation == "DEPOSIT":
+        return f"DEPOSIT {amount} {pin}"
+    if operation == "TRANSFER":
+        return f"TRANSFER {rng.choice(accounts)} {amount} {pin}"
+    return operation
+
+
+# One simulated terminal: insert card, enter PIN, run `ops` menu operations
+# and exit, recording the round-trip latency of every request by operation
+async def run_terminal(host, port, card, pin, ops, rng, accounts, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    operations = [name for name, _ in OPERATION_MIX]
+    weights = [weight for _, weight in OPERATION_MIX]
+
+    async def request(operation, line):
+        start = time.perf_counter()
+        writer.write(line.encode("utf-8") + b"\n")
+        reply = await reader.readline()
+        latencies.setdefault(operation, []).append(time.perf_counter() - start)
+        return reply
+
+    try:
+        await reader.readline()
+        await request("CARD", f"CARD {card}")
+        await request("PIN", f"PIN {pin}")
+        for operation in rng.choices(operations, weights, k=ops):
+            await request(operation, _menu_command(rng, operation, pin, accounts))
+        await request("EXIT", "EXIT")
+    finally:
+        writer.close()
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def report(latencies, elapsed):
+    total = sum(len(values) for values in latencies.values())
+    print(f"{'operation':<10} {'count':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    print("-" * 39)
+    for operation, values in sorted(latencies.items()):
+        values.sort()
+        print(f"{operation:<10} {len(values):>8} {percentile(values, 0.5) * 1000:>9.3f} "
+              f"{percentile(values, 0.99) * 1000:>9.3f}")
+    print(f"\n{total} requests in {elapsed:.2f}s ({total / elapsed:,.0f} req/s)")
+
+
+async def run(args):
+    host, port = args.host, args.port
+    local_server = None
+    if args.port is None:
+        # No server given: start one in this process with demo accounts
+        cards = server.create_demo_accounts(args.terminals, args.pin)
+        local_server = await server.start_server(host, 0)
+        port = local_server.sockets[0].getsockname()[1]
+        accounts = [Atm.get_account_by_card(card) for card in cards]
+    else:
+        with open(args.cards_file, encoding="utf-8") as f:
+            cards = [line.strip() for line in f if line.strip()]
+        # Account numbers of a remote server aren't known here, so its
+        # transfers measure the rejection path
+        accounts = ["0000"]
+
+    rng = random.Random(args.seed)
+    latencies = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_terminal(host, port, cards[i % len(cards)], args.pin, args.ops,
+                     random.Random(rng.random()), accounts, latencies)
+        for i in range(args.terminals)))
+    elapsed = time.perf_counter() - start
+    if local_server is not None:
+        local_server.close()
+        await local_server.wait_closed()
+    report(latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive many concurrent terminals against the ATM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int,
+                        help="server port; without it a server is started in-process")
+    parser.add_argument("--cards-file", help="card numbers to use against an external server")
+    parser.add_argument("--pin", default="1234")
+    parser.add_argument("--terminals", type=int, default=1000, help="concurrent connections")
+    parser.add_argument("--ops", type=int, default=20, help="menu operations per session")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if args.port is not None and not args.cards_file:
+        parser.error("--cards-file is required with --port")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import Atm
+
+# Metrics for the ledger's hot paths: calls per operation and outcome,
+# latency histograms per operation, and gauges for the ATM's cash.
+#
+# Nothing is measured until enable() is called. It swaps each instrumented
+# Atm function for a timing wrapper, and disable() puts the originals
+# back, so with metrics off the ledger runs exactly the code it would
+# without this module. Callers must look the functions up on Atm at call
+# time (as the UI, server and batch runner do) for the wrappers to apply.
+#
+# Metrics are exposed in the Prometheus text format, over HTTP
+# (start_http_server) or written to a file every few seconds
+# (start_file_dump).
+LATENCY_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+# Outcome codes for the ledger's failure messages, matched by prefix
+FAILURE_CODES = (
+    ("Insufficient funds", "insufficient_funds"),
+    ("Daily withdrawal limit", "daily_limit"),
+    ("Withdrawal limit of", "withdrawal_cap"),
+    ("Too many withdrawals", "velocity"),
+    ("Blocked as suspicious", "fraud_blocked"),
+    ("ATM does not have enough cash", "atm_out_of_cash"),
+    ("ATM cannot dispense", "notes_unavailable"),
+    ("Invalid PIN", "invalid_pin"),
+    ("Incorrect PIN", "invalid_pin"),
+    ("PIN must be", "invalid_new_pin"),
+    ("Cannot transfer to the same account", "same_account"),
+    ("Account not found", "account_not_found"),
+    ("Unknown transfer", "unknown_transfer"),
+)
+
+
+def _result_outcome(result):
+    if result[0]:
+        return "ok"
+    message = result[1]
+    for prefix, code in FAILURE_CODES:
+        if message.startswith(prefix):
+            return code
+    return "invalid_amount" if "must be positive" in message else "other"
+
+
+def _found_outcome(result):
+    return "found" if result else "not_found"
+
+
+def _bool_outcome(result):
+    return "ok" if result else "rejected"
+
+
+def _always_ok(result):
+    return "ok"
+
+
+# Atm functions that get wrapped, with how each result maps to an outcome
+INSTRUMENTED = {
+    'create_account': _always_ok,
+    'get_account_by_card': _found_outcome,
+    'verify_pin': _bool_outcome,
+    'deposit': _result_outcome,
+    'withdraw': _result_outcome,
+    'transfer': _result_outcome,
+    'change_pin': _result_outcome,
+}
+
+
+# Calls to one operation: a count per outcome and a latency histogram,
+# with Prometheus-style cumulative buckets computed when rendered. One
+# lock covers both so each call takes it once.
+class OperationMetrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.total = 0.0
+        self.outcomes = {}  # outcome -> calls
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, outcome):
+        slot = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[slot] += 1
+            self.total += seconds
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * len(self.counts)
+            self.total = 0.0
+            self.outcomes = {}
+
+
+operations = {}  # operation -> OperationMetrics
+_originals = {}  # operation -> the unwrapped Atm function
+
+
+def _wrap(operation, original, classify):
+    observe = operations.setdefault(operation, OperationMetrics()).observe
+    clock = time.perf_counter
+
+    def instrumented(*args, **kwargs):
+        start = clock()
+        try:
+            result = original(*args, **kwargs)
+        except Exception:
+            outcome = "error"
+            raise
+        else:
+            outcome = classify(result)
+            return result
+        finally:
+            observe(clock() - start, outcome)
+
+    instrumented.__wrapped__ = original
+    instrumented.__name__ = original.__name__
+    return instrumented
+
+
+def enabled():
+    return bool(_originals)
+
+
+def enable():
+    for operation, classify in INSTRUMENTED.items():
+        if operation not in _originals:
+            original = getattr(Atm, operation)
+            _originals[operation] = original
+            setattr(Atm, operation, _wrap(operation, original, classify))
+
+
+def disable():
+    for operation, original in _originals.items():
+        setattr(Atm, operation, original)
+    _originals.clear()
+
+
+def reset():
+    for metrics in operations.values():
+        metrics.reset()
+
+
+# Every metric in the Prometheus text exposition format
+def render():
+    snapshot = []
+    for operation, metrics in sorted(operations.items()):
+        with metrics.lock:
+            snapshot.append((operation, metrics.buckets, list(metrics.counts), metrics.total,
+                             sorted(metrics.outcomes.items())))
+
+    lines = [
+        "# HELP atm_operations_total Ledger calls by operation and outcome.",
+        "# TYPE atm_operations_total counter",
+    ]
+    for operation, _, _, _, outcomes in snapshot:
+        for outcome, count in outcomes:
+            lines.append(f'atm_operations_total{{operation="{operation}",outcome="{outcome}"}} {count}')
+
+    lines += [
+        "# HELP atm_operation_seconds Ledger call latency.",
+        "# TYPE atm_operation_seconds histogram",
+    ]
+    for operation, buckets, counts, total, _ in snapshot:
+        cumulative = 0
+        for bound, count in zip(buckets, counts):
+            cumulative += count
+            lines.append(f'atm_operation_seconds_bucket{{operation="{operation}",le="{bound:g}"}} '
+                         f'{cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'atm_operation_seconds_bucket{{operation="{operation}",le="+Inf"}} {cumulative}')
+        lines.append(f'atm_operation_seconds_sum{{operation="{operation}"}} {total:.9f}')
+        lines.append(f'atm_operation_seconds_count{{operation="{operation}"}} {cumulative}')
+
+    # Gauges are read when rendered, so they cost nothing in between
+    lines += [
+        "# HELP atm_cash_cents Cash left in the ATM.",
+        "# TYPE atm_cash_cents gauge",
+        f"atm_cash_cents {Atm.atm_cash}",
+        "# HELP atm_cassette_notes Notes left in the cassette by denomination.",
+        "# TYPE atm_cassette_notes gauge",
+    ]
+    for denomination, count in sorted(Atm.cassette.notes.items()):
+        lines.append(f'atm_cassette_notes{{denomination="{denomination}"}} {count}')
+    lines += [
+        "# HELP atm_dispensed_today_cents Cash dispensed so far today.",
+        "# TYPE atm_dispensed_today_cents gauge",
+        f"atm_dispensed_today_cents {Atm.atm_stats.dispensed_on(int(time.time()))}",
+        "# HELP atm_accounts Accounts in the ledger.",
+        "# TYPE atm_accounts gauge",
+        f"atm_accounts {len(Atm.accounts)}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /metrics on a background thread, returning the server
+def start_http_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="atm-metrics", daemon=True).start()
+    return server
+
+
+# Rewrite `path` with the current metrics every `interval` seconds on a
+# background thread, replacing it atomically so readers never see a partial
+# file. Set the returned event to stop.
+def start_file_dump(path, interval=10.0):
+    stop = threading.Event()
+
+    def dump():
+        while not stop.wait(interval):
+            write_file(path)
+        write_file(path)
+
+    threading.Thread(target=dump, name="atm-metrics-dump", daemon=True).start()
+    return stop
+
+
+def write_file(path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
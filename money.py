@@ -0,0 +1,30 @@
+from decimal import Decimal, InvalidOperation
+
+# Money is held as integer cents everywhere in the ledger. Text is only
+# converted on the way in (parse_amount) and on the way out (format_money).
+
+
+# Parse a dollar amount like "12", "12.5" or "12.34" into cents. Raises
+# ValueError for anything that isn't a finite amount with at most 2 decimals.
+def parse_amount(value):
+    text = str(value).strip()
+    whole, _, fraction = text.partition('.')
+    # Fast path for plain digits, which is nearly every input
+    if whole.isdigit() and len(fraction) <= 2 and (fraction.isdigit() or not fraction):
+        return int(whole + fraction.ljust(2, '0'))
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {value!r}") from None
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount: {value!r}")
+    cents = amount * 100
+    if cents != cents.to_integral_value():
+        raise ValueError(f"Amount has more than 2 decimal places: {value!r}")
+    return int(cents)
+
+
+def format_money(cents):
+    if cents < 0:
+        return "-" + format_money(-cents)
+    return "$%d.%02d" % divmod(cents, 100)
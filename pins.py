@@ -0,0 +1,31 @@
+import hashlib
+import hmac
+import os
+
+# PINs are stored as salted PBKDF2-SHA256 hashes, written as
+# "<iterations>$<salt hex>$<hash hex>" so the work factor can be raised
+# later without invalidating existing hashes. With only 10,000 possible
+# PINs the KDF can't stop an offline search on its own; it slows one down,
+# and the lockout in Atm.verify_pin is what limits online guessing.
+ITERATIONS = 100_000
+SALT_SIZE = 16
+
+
+def hash_pin(pin, iterations=None):
+    iterations = iterations or ITERATIONS
+    salt = os.urandom(SALT_SIZE)
+    return join_hash(iterations, salt, hashlib.pbkdf2_hmac("sha256", pin.encode("utf-8"), salt, iterations))
+
+
+def check_pin(pin, pin_hash):
+    iterations, salt, digest = split_hash(pin_hash)
+    return hmac.compare_digest(hashlib.pbkdf2_hmac("sha256", pin.encode("utf-8"), salt, iterations), digest)
+
+
+def split_hash(pin_hash):
+    iterations, salt, digest = pin_hash.split("$")
+    return int(iterations), bytes.fromhex(salt), bytes.fromhex(digest)
+
+
+def join_hash(iterations, salt, digest):
+    return f"{iterations}${salt.hex()}${digest.hex()}"
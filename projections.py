@@ -0,0 +1,269 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import events
+from limits import WithdrawalWindow
+from money import format_money
+
+# Read models folded from the event history (see events.py).
+#
+# A projection applies events in order and remembers how many it has seen,
+# so catch_up() only applies the events appended since its last call. A new
+# read model is added by starting it at position 0 and catching up while the
+# ledger keeps running.
+#
+# A full rebuild from an event file can run in parallel: rebuild_file()
+# splits the file into byte ranges and folds each range in its own process.
+# A projection of part of the history doesn't know the state its range
+# starts from, so it infers it from the balances recorded on the first
+# events it sees; combine() then joins the parts in order, checking each
+# part's inferred start against where the part before it ended.
+#
+# Recorded balances that don't match the fold are mismatches: the event
+# history doesn't explain the ledger's numbers. A projection reports each
+# one and carries on from the recorded value, so one bad event is reported
+# once rather than on every later event.
+
+
+class Projection:
+    handlers = {}  # event type -> function(projection, event)
+
+    def __init__(self):
+        self.position = 0
+        self.mismatches = []
+
+    def apply(self, event):
+        handler = self.handlers.get(type(event))
+        if handler is not None:
+            handler(self, event)
+
+    # Apply every event appended to `store` since the last catch-up,
+    # returning how many there were
+    def catch_up(self, store):
+        start = self.position
+        for self.position, event in store.read(start):
+            self.apply(event)
+        return self.position - start
+
+
+# Balance of every account
+class BalanceProjection(Projection):
+    def __init__(self):
+        super().__init__()
+        self.balances = {}
+        # Balances inferred for accounts first seen after they were created
+        self.openings = {}
+
+    def _move(self, account_number, delta, recorded):
+        balance = self.balances.get(account_number)
+        if balance is None:
+            balance = self.openings[account_number] = recorded - delta
+        balance += delta
+        if balance != recorded:
+            self.mismatches.append((account_number, balance, recorded))
+            balance = recorded
+        self.balances[account_number] = balance
+
+    # An account created again means the ledger lost track of it
+    def _created(self, event):
+        balance = self.balances.get(event.acc)
+        if balance is not None:
+            self.mismatches.append((event.acc, balance, 0))
+        self.balances[event.acc] = 0
+
+    def _opened(self, event):
+        self.balances[event.acc] = event.balance
+
+    def _deposited(self, event):
+        self._move(event.acc, event.amount, event.balance)
+
+    def _withdrawn(self, event):
+        self._move(event.acc, -event.amount, event.balance)
+
+    def _transferred(self, event):
+        self._move(event.src, -event.amount, event.src_balance)
+        self._move(event.dst, event.amount, event.dst_balance)
+
+    def _sent(self, event):
+        self._move(event.acc, -event.amount, event.balance)
+
+    def _received(self, event):
+        self._move(event.acc, event.amount, event.balance)
+
+    handlers = {
+        events.AccountCreated: _created,
+        events.BalanceOpened: _opened,
+        events.Deposited: _deposited,
+        events.Withdrawn: _withdrawn,
+        events.Transferred: _transferred,
+        events.TransferSent: _sent,
+        events.TransferReceived: _received,
+        events.InterestPaid: _received,
+        events.FeeCharged: _sent,
+    }
+
+    # Join the projection of the history that follows this one
+    def combine(self, later):
+        for account_number, opening in later.openings.items():
+            before = self.balances.get(account_number)
+            if before is None:
+                self.openings[account_number] = opening
+            elif before != opening:
+                self.mismatches.append((account_number, before, opening))
+        self.balances.update(later.balances)
+        self.mismatches.extend(later.mismatches)
+        self.position += later.position
+
+    # Accounts whose balance the history doesn't start from zero or an
+    # opening balance, as (account number, projected, recorded)
+    def unexplained(self):
+        return [(account_number, 0, opening) for account_number, opening in self.openings.items() if opening]
+
+
+# Cash in the ATM
+class CashProjection(Projection):
+    def __init__(self):
+        super().__init__()
+        # Until the cash level is known, `cash` is the change since the start
+        self.known = False
+        self.cash = 0
+        self.opening = None  # inferred level at the start, if it had to be inferred
+
+    def _loaded(self, event):
+        self.known = True
+        self.cash = event.cash
+
+    def _replenished(self, event):
+        self.cash += sum(int(denomination) * count for denomination, count in event.notes.items()) * 100
+
+    def _withdrawn(self, event):
+        if not self.known:
+            self.opening = event.cash + event.amount - self.cash
+            self.cash += self.opening
+            self.known = True
+        self.cash -= event.amount
+        if self.cash != event.cash:
+            self.mismatches.append(("cash", self.cash, event.cash))
+            self.cash = event.cash
+
+    handlers = {
+        events.CashLoaded: _loaded,
+        events.CashReplenished: _replenished,
+        events.Withdrawn: _withdrawn,
+    }
+
+    def combine(self, later):
+        if not later.known:
+            self.cash += later.cash
+        else:
+            if later.opening is not None:
+                if not self.known:
+                    self.opening = later.opening - self.cash
+                    self.known = True
+                elif self.cash != later.opening:
+                    self.mismatches.append(("cash", self.cash, later.opening))
+            self.cash = later.cash
+        self.mismatches.extend(later.mismatches)
+        self.position += later.position
+
+
+# Each account's withdrawals over the last 24 hours, as limits.py counts them
+class WithdrawalProjection(Projection):
+    def __init__(self):
+        super().__init__()
+        self.windows = {}  # account number -> WithdrawalWindow
+
+    def _withdrawn(self, event):
+        window = self.windows.get(event.acc)
+        if window is None:
+            window = self.windows[event.acc] = WithdrawalWindow()
+        window.expire(event.ts)
+        window.add(event.ts, event.amount)
+
+    handlers = {events.Withdrawn: _withdrawn}
+
+    def combine(self, later):
+        for account_number, window in later.windows.items():
+            mine = self.windows.get(account_number)
+            if mine is None:
+                self.windows[account_number] = window
+            else:
+                for timestamp, amount in window.events:
+                    mine.expire(timestamp)
+                    mine.add(timestamp, amount)
+        self.position += later.position
+
+    def withdrawn_since(self, account_number, now):
+        window = self.windows.get(account_number)
+        if window is None:
+            return 0
+        window.expire(now)
+        return window.total
+
+
+def _fold(path, start, end, projection_type):
+    projection = projection_type()
+    for event in events.read_file(path, start, end):
+        projection.apply(event)
+        projection.position += 1
+    return projection
+
+
+# Build a projection from a whole event file, folding byte ranges of it in
+# `workers` processes and combining the parts in order
+def rebuild_file(path, projection_type, workers=None):
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(path)
+    if workers == 1 or size < 1 << 20:
+        return _fold(path, 0, None, projection_type)
+    bounds = [size * part // workers for part in range(workers + 1)]
+    bounds[-1] = None
+    # Spawned rather than forked so workers don't inherit the ledger's state
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        parts = list(pool.map(_fold, [path] * workers, bounds[:-1], bounds[1:], [projection_type] * workers))
+    result = parts[0]
+    for part in parts[1:]:
+        result.combine(part)
+    return result
+
+
+# Accounts whose live balance differs from the projected one, as
+# (account number, projected, actual)
+def balance_differences(projection, accounts):
+    differences = []
+    for account_number, account in accounts.items():
+        projected = projection.balances.get(account_number)
+        if projected != account.balance:
+            differences.append((account_number, projected, account.balance))
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild projections from an event file and check them")
+    parser.add_argument("events", help="event file written by the ledger (Atm.py --events)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    balances = rebuild_file(args.events, BalanceProjection, args.workers)
+    cash = rebuild_file(args.events, CashProjection, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"{balances.position:,} events, {len(balances.balances):,} accounts, rebuilt in {elapsed:.2f}s "
+          f"with {args.workers} workers")
+    print(f"Balances held: {format_money(sum(balances.balances.values()))}")
+    print(f"ATM cash: {format_money(cash.cash) if cash.known else 'unknown'}")
+    problems = balances.mismatches + balances.unexplained() + cash.mismatches
+    for account_number, projected, recorded in problems[:20]:
+        print(f"MISMATCH {account_number}: history gives {format_money(projected)}, "
+              f"recorded {format_money(recorded)}")
+    if problems:
+        raise SystemExit(f"{len(problems)} mismatches")
+    print("History explains every recorded balance")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import csv
+import struct
+import time
+
+import Atm
+import pins
+from money import parse_amount
+
+# Bulk account import and export in CSV or a compact binary format.
+#
+# CSV has a header row with the columns name, balance (dollars) and either
+# pin or pin_hash (see pins.py), plus optional account_number, card_number
+# and daily_limit (dollars). Missing numbers are allocated as
+# create_account would. Plain PINs are hashed on the way in, which is by
+# far the slowest part of an import; exports only ever write hashes.
+#
+# The binary format is the magic bytes below followed by one record per
+# account: a fixed header (account number, balance and daily limit in
+# cents, card number, KDF iterations, salt and PIN hash, name length) and
+# then the UTF-8 name. The account number is an unsigned 64-bit integer,
+# so only numbers without a leading zero can be exported in it.
+#
+# Both directions make a single streaming pass. Imports don't journal each
+# account; if a journal is open they end with a checkpoint instead, so an
+# import becomes durable as a whole once it finishes.
+BINARY_MAGIC = b"ATMACCT2"
+BINARY_RECORD = struct.Struct("<Qqq16sI16s32sH")
+CSV_FIELDS = ['account_number', 'card_number', 'name', 'pin_hash', 'balance', 'daily_limit']
+
+
+# Register every row, stopping with ValueError at the first bad one (the
+# rows before it stay imported)
+def _import_rows(rows):
+    count = 0
+    try:
+        with Atm.registry_lock:
+            count = _register_rows(rows)
+    finally:
+        Atm.checkpoint()
+    return count
+
+
+def _register_rows(rows):
+    count = 0
+    for count, (name, pin_hash, balance, daily_limit, account_number, card_number) in enumerate(rows, 1):
+        if account_number:
+            if account_number in Atm.accounts:
+                raise ValueError(f"Account {count}: account number {account_number} already exists")
+        else:
+            account_number = Atm.generate_account_number()
+        if card_number:
+            if len(card_number) != 16 or not card_number.isdigit():
+                raise ValueError(f"Account {count}: card number must be 16 digits")
+            if card_number in Atm.card_index:
+                raise ValueError(f"Account {count}: card number {card_number} already exists")
+        else:
+            card_number = Atm.generate_card_number()
+        database = Atm.database
+        timestamp = int(time.time())
+        if database is not None:
+            # The account and its opening deposit in one transaction
+            database.create(account_number, card_number, name, pin_hash, daily_limit, Atm.next_account_seq,
+                            balance, timestamp)
+            Atm.atm_stats.record_account()
+        else:
+            account = Atm._register_account(account_number, card_number, name, pin_hash, daily_limit)
+        # Imported accounts skip the journal but not the event history
+        event_store = Atm.event_store
+        if event_store is not None:
+            event_store.append("create", {'acc': account_number, 'card': card_number, 'name': name,
+                                          'pin_hash': pin_hash, 'daily_limit': daily_limit, 'seq': 0})
+        if balance > 0:
+            if database is not None:
+                Atm._observe(account_number, "Deposit", balance, timestamp, balance)
+            else:
+                account.balance = balance
+                timestamp = Atm.add_transaction(account_number, "Deposit", balance, balance)
+            if event_store is not None:
+                event_store.append("deposit", {'acc': account_number, 'amount': balance,
+                                               'balance': balance, 'ts': timestamp})
+    return count
+
+
+def _csv_rows(stream):
+    for line, row in enumerate(csv.DictReader(stream), 1):
+        pin_hash = row.get('pin_hash')
+        if not pin_hash:
+            pin = row.get('pin') or ""
+            if len(pin) != 4 or not pin.isdigit():
+                raise ValueError(f"Account {line}: PIN must be 4 digits")
+            pin_hash = pins.hash_pin(pin)
+        daily_limit = row.get('daily_limit')
+        yield (row['name'], pin_hash, parse_amount(row.get('balance') or 0),
+               parse_amount(daily_limit) if daily_limit else Atm.DAILY_LIMIT,
+               row.get('account_number') or None, row.get('card_number') or None)
+
+
+def _binary_rows(stream):
+    if stream.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError("Not an account export file")
+    record_size = BINARY_RECORD.size
+    unpack = BINARY_RECORD.unpack
+    while True:
+        header = stream.read(record_size)
+        if not header:
+            return
+        if len(header) != record_size:
+            raise ValueError("Truncated account export file")
+        account_number, balance, daily_limit, card_number, iterations, salt, digest, name_length = unpack(header)
+        name = stream.read(name_length).decode("utf-8")
+        yield (name, pins.join_hash(iterations, salt, digest), balance, daily_limit, str(account_number),
+               card_number.decode("ascii"))
+
+
+def import_csv(stream):
+    return _import_rows(_csv_rows(stream))
+
+
+def import_binary(stream):
+    return _import_rows(_binary_rows(stream))
+
+
+# Every account, one at a time rather than a copy of the registry.
+# registry_lock is held until the export has been through them all, so
+# accounts can't be created part way through.
+def _accounts_to_export():
+    with Atm.registry_lock:
+        yield from Atm.accounts.items()
+
+
+def _dollars(cents):
+    return "%d.%02d" % divmod(cents, 100)
+
+
+def export_csv(stream):
+    writer = csv.writer(stream)
+    writer.writerow(CSV_FIELDS)
+    count = 0
+    rows = []
+    for count, (account_number, account) in enumerate(_accounts_to_export(), 1):
+        rows.append((account_number, account.card_number, account.name, account.pin_hash,
+                     _dollars(account.balance), _dollars(account.daily_limit)))
+        if len(rows) == 4096:
+            writer.writerows(rows)
+            rows = []
+    writer.writerows(rows)
+    return count
+
+
+def export_binary(stream):
+    stream.write(BINARY_MAGIC)
+    pack = BINARY_RECORD.pack
+    count = 0
+    chunk = []
+    for count, (account_number, account) in enumerate(_accounts_to_export(), 1):
+        # Numbers are written as integers, which would lose leading zeros
+        if not account_number.isdigit() or account_number[0] == "0" or int(account_number) >> 64:
+            raise ValueError(f"Account {count}: account number {account_number} can't be exported in binary; "
+                             "use CSV")
+        name = account.name.encode("utf-8")
+        iterations, salt, digest = pins.split_hash(account.pin_hash)
+        chunk.append(pack(int(account_number), account.balance, account.daily_limit,
+                          account.card_number.encode("ascii"), iterations, salt, digest, len(name)))
+        chunk.append(name)
+        if len(chunk) >= 8192:
+            stream.write(b"".join(chunk))
+            chunk = []
+    stream.write(b"".join(chunk))
+    return count
+
+
+def _is_binary(path, explicit):
+    return explicit == 'binary' if explicit else not path.endswith(".csv")
+
+
+def import_file(path, fmt=None):
+    if _is_binary(path, fmt):
+        with open(path, "rb") as f:
+            return import_binary(f)
+    with open(path, newline="", encoding="utf-8") as f:
+        return import_csv(f)
+
+
+def export_file(path, fmt=None):
+    if _is_binary(path, fmt):
+        with open(path, "wb", buffering=1 << 20) as f:
+            return export_binary(f)
+    with open(path, "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+        return export_csv(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import or export ATM accounts")
+    parser.add_argument("action", choices=['import', 'export'])
+    parser.add_argument("file", help="a .csv file, or anything else for the binary format")
+    parser.add_argument("--format", choices=['csv', 'binary'])
+    parser.add_argument("--journal", metavar="DIR", required=True,
+                        help="journal directory holding the accounts")
+    args = parser.parse_args()
+
+    Atm.open_journal(args.journal)
+    try:
+        if args.action == 'import':
+            print(f"Imported {import_file(args.file, args.format)} accounts")
+        else:
+            print(f"Exported {export_file(args.file, args.format)} accounts")
+    finally:
+        Atm.close_journal()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import datetime
+from array import array
+from collections import namedtuple
+
+# Transaction types are stored as small int codes, in this order
+TRANSACTION_TYPES = ("Deposit", "Withdrawal", "Transfer In", "Transfer Out", "Interest", "Fee")
+TYPE_CODES = {name: code for code, name in enumerate(TRANSACTION_TYPES)}
+
+# One row of a TransactionLog, with amounts in cents and the timestamp as
+# epoch seconds
+Transaction = namedtuple('Transaction', ['type', 'amount', 'balance_after', 'timestamp'])
+
+
+def format_timestamp(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Append-only, array-backed transaction history for one account. Each
+# column is a typed array: the type code as a byte, amount and balance in
+# integer cents and the timestamp as epoch seconds, about 25 bytes a row
+# against several hundred for a dict with a timestamp string. The arrays
+# are only allocated on the first append, since many accounts have no
+# history at all.
+#
+# Rows are kept in timestamp order so time ranges can be found by binary
+# search, and `by_type` holds the positions of each type's rows as a
+# secondary index (see history.py).
+class TransactionLog:
+    __slots__ = ('types', 'amounts', 'balances', 'timestamps', 'by_type')
+
+    def __init__(self):
+        self.types = None
+        self.amounts = None
+        self.balances = None
+        self.timestamps = None
+        self.by_type = None
+
+    def _allocate(self):
+        self.types = array('B')
+        self.amounts = array('q')
+        self.balances = array('q')
+        self.timestamps = array('q')
+        self.by_type = [array('I') for _ in TRANSACTION_TYPES]
+
+    def append(self, transaction_type, amount, balance_after, timestamp):
+        if self.types is None:
+            self._allocate()
+        # Never let a clock step backwards break the time ordering
+        elif timestamp < self.timestamps[-1]:
+            timestamp = self.timestamps[-1]
+        code = TYPE_CODES[transaction_type]
+        self.by_type[code].append(len(self.types))
+        self.types.append(code)
+        self.amounts.append(amount)
+        self.balances.append(balance_after)
+        self.timestamps.append(timestamp)
+
+    def __len__(self):
+        return 0 if self.types is None else len(self.types)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Transaction(TRANSACTION_TYPES[self.types[index]], self.amounts[index],
+                           self.balances[index], self.timestamps[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def to_dict(self):
+        if self.types is None:
+            return {'types': [], 'amounts': [], 'balances': [], 'timestamps': []}
+        return {
+            'types': self.types.tolist(),
+            'amounts': self.amounts.tolist(),
+            'balances': self.balances.tolist(),
+            'timestamps': self.timestamps.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        log = cls()
+        if not data['types']:
+            return log
+        log._allocate()
+        log.types.fromlist(data['types'])
+        log.amounts.fromlist(data['amounts'])
+        log.balances.fromlist(data['balances'])
+        log.timestamps.fromlist(data['timestamps'])
+        for position, code in enumerate(log.types):
+            log.by_type[code].append(position)
+        return log
+
+
+# `volume` (cents moved in any direction) and `transaction_count` are
+# running aggregates kept up to date by Atm.add_transaction.
+# `failed_attempts` and `locked_until` (epoch seconds) track wrong PINs
+# across sessions; see Atm.verify_pin.
+class Account:
+    __slots__ = ('name', 'pin_hash', 'balance', 'card_number', 'transactions',
+                 'daily_withdrawals', 'last_withdraw_date', 'daily_limit',
+                 'volume', 'transaction_count', 'failed_attempts', 'locked_until')
+
+    def __init__(self, name, pin_hash, balance, card_number, daily_limit,
+                 daily_withdrawals=0, last_withdraw_date="", transactions=None,
+                 volume=0, transaction_count=0, failed_attempts=0, locked_until=0):
+        self.name = name
+        self.pin_hash = pin_hash
+        self.balance = balance
+        self.card_number = card_number
+        self.transactions = TransactionLog() if transactions is None else transactions
+        self.daily_withdrawals = daily_withdrawals
+        self.last_withdraw_date = last_withdraw_date
+        self.daily_limit = daily_limit
+        self.volume = volume
+        self.transaction_count = transaction_count
+        self.failed_attempts = failed_attempts
+        self.locked_until = locked_until
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in self.__slots__}
+        data['transactions'] = self.transactions.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data['transactions'] = TransactionLog.from_dict(data['transactions'])
+        return cls(**data)
@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+
+import Atm
+import fraud
+import limits
+import metrics
+import pins
+from money import format_money, parse_amount
+from records import format_timestamp
+
+# Line protocol. Every request is one line, every reply is one line starting
+# with OK or ERR. A session follows the same flow as the terminal UI:
+#
+#   CARD <card number>              insert card
+#   PIN <pin>                       verify PIN; wrong PINs count against the account (see Atm.verify_pin)
+#   BALANCE
+#   WITHDRAW <amount> <pin>
+#   DEPOSIT <amount> <pin>
+#   TRANSFER <to account> <amount> <pin>
+#   HISTORY                         last 10 transactions, ';'-separated
+#   CHANGEPIN <old pin> <new pin>
+#   EXIT                            end the session and close the connection
+
+# Commands that can block are handled on a worker thread so they don't
+# stall other sessions:
+#
+#   - those that run the PIN KDF (it releases the GIL). PIN and CHANGEPIN
+#     always do; the others re-enter the PIN, at this position among their
+#     arguments, and stay on the event loop only when the session has it
+#     cached as verified. The check moves it to the front of the cache, so
+#     it's still there when the command runs.
+#   - with a journal, those that change the ledger, which wait for their
+#     records to be fsynced. Waiting on worker threads is what lets the
+#     records of several sessions share one group commit.
+#   - with a database, every command: any statement can wait on another
+#     process's write lock.
+KDF_COMMANDS = {"PIN", "CHANGEPIN"}
+PIN_ARGUMENTS = {"WITHDRAW": 1, "DEPOSIT": 1, "TRANSFER": 2}
+JOURNALED_COMMANDS = {"PIN", "WITHDRAW", "DEPOSIT", "TRANSFER", "CHANGEPIN"}
+
+
+# State for one connected terminal, replacing the UI's module globals
+class Session:
+    def __init__(self):
+        self.id = Atm.new_session()
+        self.account_number = None
+        self.authenticated = False
+        self.closed = False
+
+    def handle(self, line):
+        parts = line.split()
+        if not parts:
+            return "ERR Empty command"
+        command, args = parts[0].upper(), parts[1:]
+        if command == "EXIT":
+            self.closed = True
+            return "OK Thank you for using our ATM. Please take your card."
+        if self.account_number is None:
+            if command != "CARD":
+                return "ERR Please insert your card"
+            return self._insert_card(args)
+        if not self.authenticated:
+            if command != "PIN":
+                return "ERR Please enter your PIN"
+            return self._verify(args)
+        handler = MENU.get(command)
+        if handler is None:
+            return "ERR Invalid option"
+        try:
+            return handler(self, *args)
+        except TypeError:
+            return f"ERR Wrong number of arguments for {command}"
+
+    # Whether handling `line` could block the event loop
+    def blocks(self, line):
+        if Atm.database is not None:
+            return True
+        parts = line.split()
+        if Atm.journal is not None and parts and parts[0].upper() in JOURNALED_COMMANDS:
+            return True
+        return self.needs_kdf(line)
+
+    # Whether handling `line` could run the PIN KDF
+    def needs_kdf(self, line):
+        parts = line.split()
+        if not parts:
+            return False
+        command = parts[0].upper()
+        if command in KDF_COMMANDS:
+            return True
+        position = PIN_ARGUMENTS.get(command)
+        if position is None or not self.authenticated or len(parts) != position + 2:
+            return False
+        return not Atm.pin_cached(self.account_number, parts[position + 1], self.id)
+
+    def _insert_card(self, args):
+        if len(args) != 1 or len(args[0]) != 16 or not args[0].isdigit():
+            return "ERR Invalid card number"
+        account_number = Atm.get_account_by_card(args[0])
+        if not account_number:
+            return "ERR Card not recognized"
+        if Atm.pin_lockout(account_number):
+            self.closed = True
+            return "ERR Card locked after too many incorrect PINs. Please try again later."
+        self.account_number = account_number
+        return "OK Please enter your PIN"
+
+    def _verify(self, args):
+        if len(args) == 1 and Atm.verify_pin(self.account_number, args[0], self.id):
+            self.authenticated = True
+            return f"OK Welcome, {Atm.accounts[self.account_number].name}"
+        if Atm.pin_lockout(self.account_number):
+            self.closed = True
+            return "ERR Too many incorrect attempts. Card retained for security."
+        remaining = Atm.MAX_PIN_ATTEMPTS - Atm.accounts[self.account_number].failed_attempts
+        return f"ERR Incorrect PIN. Attempts remaining: {remaining}"
+
+    # A wrong PIN after login; ends the session if it locked the card
+    def _pin_rejected(self):
+        if Atm.pin_lockout(self.account_number):
+            self.closed = True
+            return "ERR Too many incorrect attempts. Card retained for security."
+        return "ERR Incorrect PIN"
+
+    def balance(self):
+        return f"OK Available Balance: {format_money(Atm.accounts[self.account_number].balance)}"
+
+    def withdraw(self, amount, pin):
+        amount = _parse_amount(amount)
+        if amount is None:
+            return "ERR Invalid amount"
+        if not Atm.verify_pin(self.account_number, pin, self.id):
+            return self._pin_rejected()
+        return _reply(Atm.withdraw(self.account_number, amount))
+
+    def deposit(self, amount, pin):
+        amount = _parse_amount(amount)
+        if amount is None:
+            return "ERR Invalid amount"
+        if not Atm.verify_pin(self.account_number, pin, self.id):
+            return self._pin_rejected()
+        return _reply(Atm.deposit(self.account_number, amount))
+
+    def transfer(self, to_account, amount, pin):
+        if to_account not in Atm.accounts:
+            return "ERR Account not found"
+        amount = _parse_amount(amount)
+        if amount is None:
+            return "ERR Invalid amount"
+        if not Atm.verify_pin(self.account_number, pin, self.id):
+            return self._pin_rejected()
+        return _reply(Atm.transfer(self.account_number, to_account, amount, pin, self.id))
+
+    def history(self):
+        transactions, _ = Atm.query_transactions(self.account_number, 10, newest_first=True)
+        if not transactions:
+            return "OK No transactions found."
+        return "OK " + "; ".join(
+            f"{format_timestamp(t.timestamp)} {t.type} {format_money(t.amount)} balance {format_money(t.balance_after)}"
+            for t in reversed(transactions))
+
+    def change_pin(self, old_pin, new_pin):
+        if not Atm.verify_pin(self.account_number, old_pin, self.id):
+            return self._pin_rejected()
+        return _reply(Atm.change_pin(self.account_number, old_pin, new_pin, self.id))
+
+
+MENU = {
+    "BALANCE": Session.balance,
+    "WITHDRAW": Session.withdraw,
+    "DEPOSIT": Session.deposit,
+    "TRANSFER": Session.transfer,
+    "HISTORY": Session.history,
+    "CHANGEPIN": Session.change_pin,
+}
+
+
+def _parse_amount(text):
+    try:
+        amount = parse_amount(text)
+    except ValueError:
+        return None
+    return amount if amount > 0 else None
+
+
+def _reply(result):
+    success, message = result
+    return ("OK " if success else "ERR ") + message
+
+
+async def handle_connection(reader, writer):
+    loop = asyncio.get_running_loop()
+    session = Session()
+    writer.write(b"OK ATM SIMULATOR - please insert your card\n")
+    try:
+        while not session.closed:
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.decode("utf-8", "replace")
+            if session.blocks(line):
+                reply = await loop.run_in_executor(None, session.handle, line)
+            else:
+                reply = session.handle(line)
+            writer.write(reply.encode("utf-8") + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host="127.0.0.1", port=0, backlog=4096):
+    return await asyncio.start_server(handle_connection, host, port, backlog=backlog)
+
+
+# Create `count` accounts sharing one PIN so load tests have cards to use.
+# The PIN is hashed once for all of them.
+def create_demo_accounts(count, pin="1234", balance=100000):
+    pin_hash = pins.hash_pin(pin)
+    return [Atm.create_account(f"Demo {i}", pin, balance, pin_hash)[1] for i in range(count)]
+
+
+async def serve(host, port):
+    server = await start_server(host, port)
+    addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"ATM server listening on {addresses}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve ATM sessions over TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8023)
+    parser.add_argument("--journal", metavar="DIR", help="persist state in a write-ahead journal in DIR")
+    parser.add_argument("--database", metavar="FILE",
+                        help="keep accounts in a SQLite database shared with other servers")
+    parser.add_argument("--demo-accounts", type=int, default=0, metavar="N",
+                        help="create N accounts with PIN 1234 at startup")
+    parser.add_argument("--cards-file", help="write the demo accounts' card numbers here")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="write Prometheus metrics to PATH every 10 seconds")
+    parser.add_argument("--max-withdrawal", type=parse_amount, metavar="DOLLARS",
+                        help="cap on a single withdrawal")
+    parser.add_argument("--withdrawals-per-hour", type=int, metavar="N",
+                        help="refuse more than N withdrawals per account in an hour")
+    parser.add_argument("--fraud-block", type=float, metavar="SCORE",
+                        help="score withdrawals and transfers and refuse those scoring SCORE or more")
+    args = parser.parse_args()
+
+    Atm.limits_engine.policy = limits.LimitPolicy(args.max_withdrawal, args.withdrawals_per_hour)
+    if args.fraud_block is not None:
+        Atm.fraud_scorer = fraud.FraudScorer(fraud.FraudPolicy(block_score=args.fraud_block))
+
+    if args.metrics_port or args.metrics_file:
+        metrics.enable()
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+    if args.metrics_file:
+        metrics.start_file_dump(args.metrics_file)
+
+    if args.journal:
+        Atm.open_journal(args.journal)
+    if args.database:
+        Atm.open_database(args.database)
+    cards = create_demo_accounts(args.demo_accounts)
+    if args.cards_file:
+        with open(args.cards_file, "w", encoding="utf-8") as f:
+            f.writelines(card + "\n" for card in cards)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        Atm.close_journal()
+        Atm.close_database()
+
+
+if __name__ == "__main__":
+    main()
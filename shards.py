@@ -0,0 +1,379 @@
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import threading
+
+import Atm
+from cassette import DEFAULT_NOTES
+
+# Ledger sharded over worker processes, so ledger work isn't limited to the
+# one core the GIL gives a single process.
+#
+# Each shard is a separate process running its own copy of Atm holding the
+# accounts whose number hashes to it. This coordinator allocates account
+# and card numbers for every shard, routes each call to the owning shard
+# and runs transfers between shards as two-phase commits:
+#
+#   1. prepare: the source shard checks the PIN and funds and holds the
+#      amount (Atm.prepare_transfer_out); the target shard checks the
+#      account exists
+#   2. commit: if both prepared, the source shard debits the held amount;
+#      otherwise it aborts and releases the hold
+#   3. credit: the target shard is credited only once the debit is
+#      committed, so no failure can create money
+#
+# With a journal directory the coordinator also keeps a log of its
+# decisions there: the transfers it's about to commit, fsynced before any
+# shard debits one, and then the ones it has finished. Shards journal the
+# transfer ids they've debited or credited. On start-up every transfer
+# committed but not finished is looked up on its source shard and, if the
+# debit happened, credited; a credit already made isn't made twice. The
+# shards are then told to forget those ids and the log starts afresh.
+#
+# Each shard dispenses cash from its own share of the cassette's notes.
+# Holds only live in memory: a shard restarted between phases has dropped
+# them, its commit then fails and the transfer is never credited.
+#
+# run() sends each shard a whole batch of commands per phase, which is
+# what lets shards work in parallel; the single-command methods are one
+# round trip each (two or three for a cross-shard transfer).
+
+
+def _create(name, pin, balance, pin_hash, account_number, card_number):
+    return True, Atm.create_account(name, pin, balance, pin_hash, account_number, card_number)[0]
+
+
+def _balance(account_number):
+    return True, Atm.accounts[account_number].balance
+
+
+def _totals():
+    return True, (sum(account.balance for account in Atm.accounts.values()), Atm.atm_cash)
+
+
+def _cards():
+    return True, list(Atm.card_index.items())
+
+
+def _settled(transfer_id):
+    return True, Atm.settled_transfers.get(transfer_id)
+
+
+def _forget(last_id):
+    Atm.forget_transfers(last_id)
+    return True, None
+
+
+SHARD_OPERATIONS = {
+    'create': _create,
+    'deposit': Atm.deposit,
+    'withdraw': Atm.withdraw,
+    'transfer': Atm.transfer,
+    'change_pin': Atm.change_pin,
+    'verify_pin': Atm.verify_pin,
+    'balance': _balance,
+    'prepare_out': Atm.prepare_transfer_out,
+    'commit_out': Atm.commit_transfer_out,
+    'abort_out': Atm.abort_transfer_out,
+    'prepare_in': Atm.prepare_transfer_in,
+    'credit': Atm.credit_transfer_in,
+    'totals': _totals,
+    'cards': _cards,
+    'settled': _settled,
+    'forget': _forget,
+}
+COORDINATOR_LOG = "coordinator.log"
+
+
+# One command on the shard. A command that raises fails on its own rather
+# than taking the shard, and the accounts it holds, down with it.
+def _run_command(operation, args):
+    try:
+        return SHARD_OPERATIONS[operation](*args)
+    except Exception as error:
+        return False, f"{type(error).__name__}: {error}"
+
+
+# Worker process main loop: receive a list of (operation, args), reply
+# with the list of results. None shuts the shard down.
+def _serve_shard(connection, notes, journal_dir):
+    Atm.load_cash(notes)
+    if journal_dir:
+        Atm.open_journal(journal_dir)
+    try:
+        while True:
+            batch = connection.recv()
+            if batch is None:
+                break
+            connection.send([_run_command(operation, args) for operation, args in batch])
+    finally:
+        Atm.close_journal()
+
+
+# Sequence number that Atm.account_number_for turned into `account_number`
+def _account_seq(account_number):
+    offset = int(account_number) - Atm.ACCOUNT_NUMBER_BASE
+    return offset * pow(Atm.ACCOUNT_NUMBER_STRIDE, -1, Atm.ACCOUNT_NUMBER_SPACE) % Atm.ACCOUNT_NUMBER_SPACE
+
+
+class ShardedLedger:
+    def __init__(self, shards=None, notes=None, journal_dir=None):
+        shards = shards or os.cpu_count() or 1
+        notes = DEFAULT_NOTES if notes is None else notes
+        # Shards are started fresh rather than forked so none inherits
+        # this process's Atm state
+        context = multiprocessing.get_context("spawn")
+        self._connections = []
+        self._locks = []
+        self._processes = []
+        for shard in range(shards):
+            parent, child = context.Pipe()
+            # Notes that don't split evenly go to the first shards
+            share = {denomination: count // shards + (shard < count % shards)
+                     for denomination, count in notes.items()}
+            shard_dir = os.path.join(journal_dir, f"shard-{shard}") if journal_dir else None
+            process = context.Process(target=_serve_shard, args=(child, share, shard_dir), daemon=True)
+            process.start()
+            self._connections.append(parent)
+            self._locks.append(threading.Lock())
+            self._processes.append(process)
+        self.shards = shards
+        self._registry_lock = threading.Lock()
+        self._decisions = None
+        self._decisions_lock = threading.Lock()
+
+        # Rebuild the card routing table and account sequence from the shards
+        self.card_index = {}
+        for cards in self._broadcast('cards'):
+            self.card_index.update(cards)
+        self._next_seq = max((_account_seq(acc) + 1 for acc in self.card_index.values()), default=0)
+        self._accounts = set(self.card_index.values())
+        next_id = self._recover(os.path.join(journal_dir, COORDINATOR_LOG)) if journal_dir else 1
+        self._transfer_ids = itertools.count(next_id)
+
+    # Finish the transfers the decision log at `path` has committed but not
+    # finished, then start a new log there. Returns the next transfer id.
+    def _recover(self, path):
+        committed = {}  # transfer id -> (source account, target account, amount)
+        last_id = 0
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    # A torn final record was never acted on
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    last_id = max(last_id, record.get('next', 1) - 1)
+                    for transfer_id, from_account, to_account, amount in record.get('commit', ()):
+                        committed[transfer_id] = (from_account, to_account, amount)
+                        last_id = max(last_id, transfer_id)
+                    for transfer_id in record.get('done', ()):
+                        committed.pop(transfer_id, None)
+        # A transfer whose debit never happened was never reported as done,
+        # and its hold went with the shard
+        credits = {}
+        for transfer_id, (from_account, to_account, amount) in committed.items():
+            if self._call(self.shard_of(from_account), 'settled', transfer_id)[1] == "out":
+                credits.setdefault(self.shard_of(to_account), []).append(
+                    ('credit', (to_account, amount, transfer_id)))
+        if credits:
+            self._call_many(credits)
+        if last_id:
+            self._call_many({shard: [('forget', (last_id,))] for shard in range(self.shards)})
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({'next': last_id + 1}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._decisions = open(path, "a", encoding="utf-8")
+        return last_id + 1
+
+    # Add a record to the decision log, if there is one. Commits are
+    # fsynced before any shard acts on them; a lost "done" record only
+    # means recovery looks the transfers up again.
+    def _decide(self, record, durable):
+        if self._decisions is None:
+            return
+        with self._decisions_lock:
+            self._decisions.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._decisions.flush()
+            if durable:
+                os.fsync(self._decisions.fileno())
+
+    # Account numbers are a permutation of a sequence, so their value mod
+    # the shard count spreads accounts evenly
+    def shard_of(self, account_number):
+        return int(account_number) % self.shards
+
+    # Run batches on several shards at once: {shard: [(operation, args)]}
+    # -> {shard: [results]}. Shard locks are taken in shard order.
+    def _call_many(self, batches):
+        order = sorted(batches)
+        for shard in order:
+            self._locks[shard].acquire()
+        try:
+            for shard in order:
+                self._connections[shard].send(batches[shard])
+            return {shard: self._connections[shard].recv() for shard in order}
+        finally:
+            for shard in order:
+                self._locks[shard].release()
+
+    def _call(self, shard, operation, *args):
+        return self._call_many({shard: [(operation, args)]})[shard][0]
+
+    def _broadcast(self, operation):
+        results = self._call_many({shard: [(operation, ())] for shard in range(self.shards)})
+        return [results[shard][0][1] for shard in range(self.shards)]
+
+    def create_account(self, name, pin, initial_balance=0, pin_hash=None):
+        with self._registry_lock:
+            account_number = Atm.account_number_for(self._next_seq)
+            self._next_seq += 1
+            card_number = "%016d" % random.randrange(10 ** 16)
+            while card_number in self.card_index:
+                card_number = "%016d" % random.randrange(10 ** 16)
+            self.card_index[card_number] = account_number
+            self._accounts.add(account_number)
+        # The PIN is hashed on the shard
+        self._call(self.shard_of(account_number), 'create',
+                   name, pin, initial_balance, pin_hash, account_number, card_number)
+        return account_number, card_number
+
+    def __contains__(self, account_number):
+        return account_number in self._accounts
+
+    def get_account_by_card(self, card_number):
+        return self.card_index.get(card_number)
+
+    # In cents, None if there's no such account
+    def balance(self, account_number):
+        if account_number not in self._accounts:
+            return None
+        return self._call(self.shard_of(account_number), 'balance', account_number)[1]
+
+    def verify_pin(self, account_number, pin, session=None):
+        if account_number not in self._accounts:
+            return False
+        return self._call(self.shard_of(account_number), 'verify_pin', account_number, pin, session)
+
+    def deposit(self, account_number, amount):
+        if account_number not in self._accounts:
+            return False, "Account not found"
+        return self._call(self.shard_of(account_number), 'deposit', account_number, amount)
+
+    def withdraw(self, account_number, amount):
+        if account_number not in self._accounts:
+            return False, "Account not found"
+        return self._call(self.shard_of(account_number), 'withdraw', account_number, amount)
+
+    def change_pin(self, account_number, old_pin, new_pin, session=None):
+        if account_number not in self._accounts:
+            return False, "Account not found"
+        return self._call(self.shard_of(account_number), 'change_pin', account_number, old_pin, new_pin, session)
+
+    def transfer(self, from_account, to_account, amount, pin, session=None):
+        return self.run([('transfer', from_account, to_account, amount, pin, session)])[0]
+
+    # Run a list of (operation, *args) commands, as for TransactionEngine,
+    # returning their results in order. Commands on each shard run in list
+    # order; a cross-shard transfer's credit lands after the whole batch's
+    # first phase, so it can't be spent later in the same batch.
+    def run(self, commands):
+        results = [None] * len(commands)
+        batches = {}
+        slots = {}  # shard -> (command index, is the target side) per call, in batch order
+        transfers = {}  # command index -> (transfer id, source shard, target shard)
+        target_ready = {}  # command index -> the target shard's prepare result
+        for index, command in enumerate(commands):
+            operation, account_number = command[0], command[1]
+            if account_number not in self._accounts:
+                results[index] = (False, "Account not found")
+                continue
+            shard = self.shard_of(account_number)
+            args = command[1:]
+            if operation == 'transfer':
+                to_account = command[2]
+                if to_account not in self._accounts:
+                    results[index] = (False, "Account not found")
+                    continue
+                if account_number == to_account:
+                    results[index] = (False, "Cannot transfer to the same account")
+                    continue
+                target = self.shard_of(to_account)
+                if target != shard:
+                    transfer_id = next(self._transfer_ids)
+                    transfers[index] = (transfer_id, shard, target)
+                    operation, args = 'prepare_out', (transfer_id, account_number) + command[3:]
+                    batches.setdefault(target, []).append(('prepare_in', (to_account,)))
+                    slots.setdefault(target, []).append((index, True))
+            batches.setdefault(shard, []).append((operation, args))
+            slots.setdefault(shard, []).append((index, False))
+        if batches:
+            for shard, outcomes in self._call_many(batches).items():
+                for (index, target_side), outcome in zip(slots[shard], outcomes):
+                    if target_side:
+                        target_ready[index] = outcome
+                    else:
+                        results[index] = outcome
+
+        commits = {}
+        decided = []  # [transfer id, source account, target account, amount]
+        for index, (transfer_id, shard, _) in transfers.items():
+            if not results[index][0]:
+                continue
+            if target_ready[index][0]:
+                call = ('commit_out', (transfer_id, commands[index][2]))
+                decided.append([transfer_id] + list(commands[index][1:4]))
+            else:
+                call = ('abort_out', (transfer_id,))
+                results[index] = target_ready[index]
+            commits.setdefault(shard, []).append((index, call))
+        if not commits:
+            return results
+        if decided:
+            self._decide({'commit': decided}, True)
+        credits = {}
+        for shard, outcomes in self._call_many(
+                {shard: [call for _, call in calls] for shard, calls in commits.items()}).items():
+            for (index, call), outcome in zip(commits[shard], outcomes):
+                if call[0] == 'abort_out':
+                    continue
+                results[index] = outcome
+                if outcome[0]:
+                    transfer_id, _, target = transfers[index]
+                    credits.setdefault(target, []).append(
+                        ('credit', (commands[index][2], commands[index][3], transfer_id)))
+        if credits:
+            self._call_many(credits)
+        if decided:
+            self._decide({'done': [transfer_id for transfer_id, *_ in decided]}, False)
+        return results
+
+    # (sum of all balances, cash left in every shard's cassette), in cents
+    def totals(self):
+        results = self._broadcast('totals')
+        return sum(balance for balance, _ in results), sum(cash for _, cash in results)
+
+    def close(self):
+        for shard, connection in enumerate(self._connections):
+            with self._locks[shard]:
+                connection.send(None)
+        for process in self._processes:
+            process.join()
+        for connection in self._connections:
+            connection.close()
+        if self._decisions is not None:
+            self._decisions.close()
+            self._decisions = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,496 @@
+import contextlib
+import json
+import sqlite3
+import threading
+from collections import deque, namedtuple
+from collections.abc import Mapping
+
+from limits import WINDOW_SECONDS, limit_refusal
+from records import TRANSACTION_TYPES, TYPE_CODES, Transaction, TransactionLog
+
+# Accounts and their histories in a SQLite database, so several ATM
+# processes can share one ledger.
+#
+# The database runs in WAL mode: readers never block the writer or each
+# other, and a commit appends to the log instead of rewriting pages. Every
+# ledger operation is one short BEGIN IMMEDIATE transaction, taking the
+# write lock up front so two operations on the same account can't both
+# read a balance and then fail to upgrade. Balance changes are a single
+# UPDATE ... RETURNING that also folds in the account's running volume and
+# transaction count, followed by the INSERT into its history.
+#
+# SQL is kept in module constants so each connection's statement cache
+# hands back the same prepared statement on every call. Connections come
+# from a fixed pool, one per concurrent caller; a connection is only ever
+# used by one thread at a time. Taking one from the pool is a deque pop,
+# atomic under the GIL, so callers only touch a lock when the pool is empty
+# and they have to wait.
+#
+# Withdrawal limits are summed from the history's (account, type, ts) index
+# on each withdrawal rather than cached as in limits.LimitsEngine, since
+# other processes may have withdrawn from the account since.
+POOL_SIZE = 4
+BUSY_TIMEOUT = 10.0  # seconds to wait for another writer
+STATEMENT_CACHE = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    number INTEGER PRIMARY KEY,
+    card TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    pin_hash TEXT NOT NULL,
+    balance INTEGER NOT NULL DEFAULT 0,
+    daily_limit INTEGER NOT NULL,
+    volume INTEGER NOT NULL DEFAULT 0,
+    transaction_count INTEGER NOT NULL DEFAULT 0,
+    failed_attempts INTEGER NOT NULL DEFAULT 0,
+    locked_until INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    account INTEGER NOT NULL,
+    type INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    balance_after INTEGER NOT NULL,
+    ts INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_by_type ON transactions (account, type, ts);
+CREATE INDEX IF NOT EXISTS transactions_by_account ON transactions (account, id);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+INSERT_ACCOUNT = ("INSERT INTO accounts (number, card, name, pin_hash, daily_limit) "
+                  "VALUES (?, ?, ?, ?, ?)")
+SET_SETTING = "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)"
+GET_SETTING = "SELECT value FROM settings WHERE key = ?"
+ACCOUNT_EXISTS = "SELECT 1 FROM accounts WHERE number = ?"
+ACCOUNT_BY_CARD = "SELECT number FROM accounts WHERE card = ?"
+ACCOUNT_NUMBERS = "SELECT number FROM accounts ORDER BY number"
+ACCOUNT_COUNT = "SELECT count(*) FROM accounts"
+BALANCES_HELD = "SELECT coalesce(sum(balance), 0) FROM accounts"
+CREDIT = ("UPDATE accounts SET balance = balance + ?1, volume = volume + ?1, "
+          "transaction_count = transaction_count + 1 WHERE number = ?2 RETURNING balance, volume")
+# Only debits an account whose balance, less `held`, covers the amount
+DEBIT = ("UPDATE accounts SET balance = balance - ?1, volume = volume + ?1, "
+         "transaction_count = transaction_count + 1 WHERE number = ?2 AND balance - ?3 >= ?1 "
+         "RETURNING balance, volume")
+COUNT_TRANSACTION = ("UPDATE accounts SET volume = volume + ?1, transaction_count = transaction_count + 1 "
+                     "WHERE number = ?2 RETURNING volume")
+INSERT_TRANSACTION = "INSERT INTO transactions (account, type, amount, balance_after, ts) VALUES (?, ?, ?, ?, ?)"
+HISTORY = "SELECT type, amount, balance_after, ts FROM transactions WHERE account = ? ORDER BY id"
+# One page of an account's history; the filters are added to WHERE (see
+# query_transactions)
+HISTORY_PAGE = "SELECT id, type, amount, balance_after, ts FROM transactions WHERE account = ?{} ORDER BY id{} LIMIT ?"
+FUNDS = "SELECT balance, daily_limit FROM accounts WHERE number = ?"
+# A PIN attempt is taken from those left, unless the card is locked
+RESERVE_PIN_ATTEMPT = ("UPDATE accounts SET failed_attempts = failed_attempts + 1 "
+                       "WHERE number = ?1 AND failed_attempts < ?2 AND locked_until <= ?3 RETURNING 1")
+PIN_STATE = "SELECT failed_attempts, locked_until FROM accounts WHERE number = ?"
+SET_PIN_STATE = "UPDATE accounts SET failed_attempts = ?, locked_until = ? WHERE number = ?"
+# Withdrawn in the last 24 hours and how many withdrawals since the
+# velocity cutoff: ?1 account, ?2 window start, ?3 velocity start
+RECENT_WITHDRAWALS = ("SELECT coalesce(sum(amount), 0), coalesce(sum(ts > ?3), 0) FROM transactions "
+                      "WHERE account = ?1 AND type = ?4 AND ts > ?2")
+# End-of-day postings, each written as one statement over every account:
+# ?1 rate, ?2 divisor, ?3 timestamp, ?4 type code for interest; ?1 fee,
+# ?2 waiver, ?3 timestamp, ?4 type code for fees. SET expressions see the
+# row as it was, so each UPDATE matches the rows its INSERT recorded.
+LAST_TRANSACTION_ID = "SELECT coalesce(max(id), 0) FROM transactions"
+RECORD_INTEREST = ("INSERT INTO transactions (account, type, amount, balance_after, ts) "
+                   "SELECT number, ?4, balance * ?1 / ?2, balance + balance * ?1 / ?2, ?3 FROM accounts "
+                   "WHERE balance * ?1 / ?2 > 0")
+PAY_INTEREST = ("UPDATE accounts SET balance = balance + balance * ?1 / ?2, volume = volume + balance * ?1 / ?2, "
+                "transaction_count = transaction_count + 1 WHERE balance * ?1 / ?2 > 0")
+RECORD_FEE = ("INSERT INTO transactions (account, type, amount, balance_after, ts) "
+              "SELECT number, ?4, min(?1, balance), balance - min(?1, balance), ?3 FROM accounts "
+              "WHERE balance > 0 AND balance < ?2")
+CHARGE_FEE = ("UPDATE accounts SET balance = balance - min(?1, balance), volume = volume + min(?1, balance), "
+              "transaction_count = transaction_count + 1 WHERE balance > 0 AND balance < ?2")
+POSTED_TOTALS = "SELECT type, count(*), sum(amount) FROM transactions WHERE id > ? GROUP BY type"
+TRANSACTIONS_AFTER = "SELECT account, type, amount, balance_after FROM transactions WHERE id > ? ORDER BY id"
+
+WITHDRAWAL = TYPE_CODES["Withdrawal"]
+
+# A withdrawal that went through: the new balance and volume, the account's
+# 24-hour total including it, and the notes planned for it
+Withdrawal = namedtuple('Withdrawal', ['balance', 'volume', 'withdrawn', 'notes'])
+
+
+# Account numbers are stored as integers; anything that isn't one is never
+# an account
+def _key(account_number):
+    if not account_number.isdigit() or account_number[0] == "0":
+        return None
+    return int(account_number)
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self._idle = deque(self._connect(path) for _ in range(size))
+        self._returned = threading.Condition()
+        self._waiting = 0
+
+    @staticmethod
+    def _connect(path):
+        # Autocommit mode: transactions are begun explicitly (see write())
+        db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                             check_same_thread=False, cached_statements=STATEMENT_CACHE)
+        db.execute("PRAGMA journal_mode = WAL")
+        # In WAL mode a crash can't corrupt the database at NORMAL, only
+        # lose the last commits if the machine itself goes down
+        db.execute("PRAGMA synchronous = NORMAL")
+        return db
+
+    # Take a connection, waiting for one to be returned if none are idle
+    def take(self):
+        try:
+            return self._idle.pop()
+        except IndexError:
+            pass
+        with self._returned:
+            self._waiting += 1
+            try:
+                while not self._idle:
+                    self._returned.wait()
+                return self._idle.pop()
+            finally:
+                self._waiting -= 1
+
+    def give_back(self, db):
+        self._idle.append(db)
+        if self._waiting:
+            with self._returned:
+                self._returned.notify()
+
+    # A connection for this thread's use until the block ends
+    @contextlib.contextmanager
+    def connection(self):
+        db = self.take()
+        try:
+            yield db
+        finally:
+            self.give_back(db)
+
+    # A connection inside a write transaction, committed when the block
+    # ends and rolled back if it raises
+    @contextlib.contextmanager
+    def write(self):
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+# The ledger in a SQLite database at `path`. Like store.AccountStore it
+# behaves as a read-only mapping of account number to account view, so it
+# can stand in for Atm.accounts, with `cards` standing in for
+# Atm.card_index. Balances only change through the operations below, each
+# one transaction.
+class SQLiteLedger(Mapping):
+    def __init__(self, path, pool_size=POOL_SIZE):
+        if path == ":memory:" or not path:
+            raise ValueError("The SQLite ledger needs a file: each pooled connection would get its own :memory:")
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as db:
+            db.executescript(SCHEMA)
+        self.cards = CardLookup(self)
+
+    # One row of a query. Reads are the hot path, so this takes a
+    # connection without the context manager.
+    def _read(self, sql, parameters):
+        pool = self.pool
+        db = pool.take()
+        try:
+            return db.execute(sql, parameters).fetchone()
+        finally:
+            pool.give_back(db)
+
+    @property
+    def next_seq(self):
+        row = self._read(GET_SETTING, ("next_seq",))
+        return int(row[0]) if row else 0
+
+    def __len__(self):
+        return self._read(ACCOUNT_COUNT, ())[0]
+
+    def __getitem__(self, account_number):
+        key = _key(account_number)
+        if key is None or self._read(ACCOUNT_EXISTS, (key,)) is None:
+            raise KeyError(account_number)
+        return SQLAccount(self, key)
+
+    def __contains__(self, account_number):
+        key = _key(account_number)
+        return key is not None and self._read(ACCOUNT_EXISTS, (key,)) is not None
+
+    def __iter__(self):
+        with self.pool.connection() as db:
+            numbers = db.execute(ACCOUNT_NUMBERS).fetchall()
+        for (number,) in numbers:
+            yield str(number)
+
+    # Sum of all balances, for the dashboard
+    def balances_held(self):
+        return self._read(BALANCES_HELD, ())[0]
+
+    # Add an account, with its opening deposit when `balance` is positive
+    def create(self, account_number, card_number, name, pin_hash, daily_limit, next_seq,
+               balance=0, timestamp=0):
+        key = int(account_number)
+        with self.pool.write() as db:
+            db.execute(INSERT_ACCOUNT, (key, card_number, name, pin_hash, daily_limit))
+            db.execute(SET_SETTING, ("next_seq", str(next_seq)))
+            if balance > 0:
+                db.execute(CREDIT, (balance, key)).fetchone()
+                db.execute(INSERT_TRANSACTION, (key, TYPE_CODES["Deposit"], balance, balance, timestamp))
+
+    # Add `amount` to an account as a transaction of `transaction_type`,
+    # returning the new balance and volume. KeyError if there's no such
+    # account.
+    def credit(self, account_number, transaction_type, amount, timestamp):
+        key = int(account_number)
+        with self.pool.write() as db:
+            row = db.execute(CREDIT, (amount, key)).fetchone()
+            if row is None:
+                raise KeyError(account_number)
+            db.execute(INSERT_TRANSACTION, (key, TYPE_CODES[transaction_type], amount, row[0], timestamp))
+        return row
+
+    # Take `amount` from an account, returning the new balance and volume,
+    # or None if the balance less `held` doesn't cover it
+    def debit(self, account_number, transaction_type, amount, timestamp, held=0):
+        key = int(account_number)
+        with self.pool.write() as db:
+            row = db.execute(DEBIT, (amount, key, held)).fetchone()
+            if row is not None:
+                db.execute(INSERT_TRANSACTION, (key, TYPE_CODES[transaction_type], amount, row[0], timestamp))
+        return row
+
+    # Withdraw `amount` under `policy` (see limits.py), returning (refusal,
+    # None) or (None, Withdrawal). `plan_cash(amount)` is called last, with
+    # the transaction still open, and returns (refusal, notes); it mustn't
+    # dispense anything, as the withdrawal can still fail to commit.
+    def withdraw(self, account_number, amount, timestamp, held, policy, plan_cash):
+        key = int(account_number)
+        with self.pool.write() as db:
+            funds = db.execute(FUNDS, (key,)).fetchone()
+            if funds is None:
+                return "Account not found", None
+            balance, daily_limit = funds
+            if amount > balance - held:
+                return "Insufficient funds", None
+            withdrawn, recent = db.execute(RECENT_WITHDRAWALS, (key, timestamp - WINDOW_SECONDS,
+                                                                timestamp - policy.velocity_seconds,
+                                                                WITHDRAWAL)).fetchone()
+            refusal = limit_refusal(policy, amount, daily_limit, withdrawn, recent)
+            if refusal is None:
+                refusal, notes = plan_cash(amount)
+            if refusal is not None:
+                return refusal, None
+            balance, volume = db.execute(DEBIT, (amount, key, held)).fetchone()
+            db.execute(INSERT_TRANSACTION, (key, WITHDRAWAL, amount, balance, timestamp))
+        return None, Withdrawal(balance, volume, withdrawn + amount, notes)
+
+    # Move `amount` between two accounts in one transaction, returning the
+    # source's and target's new (balance, volume), or None if the source's
+    # balance less `held` doesn't cover it. KeyError if the target doesn't
+    # exist.
+    def transfer(self, from_account, to_account, amount, timestamp, held=0):
+        source, target = int(from_account), int(to_account)
+        with self.pool.write() as db:
+            debited = db.execute(DEBIT, (amount, source, held)).fetchone()
+            if debited is None:
+                return None
+            credited = db.execute(CREDIT, (amount, target)).fetchone()
+            if credited is None:
+                raise KeyError(to_account)
+            db.execute(INSERT_TRANSACTION, (source, TYPE_CODES["Transfer Out"], amount, debited[0], timestamp))
+            db.execute(INSERT_TRANSACTION, (target, TYPE_CODES["Transfer In"], amount, credited[0], timestamp))
+        return debited, credited
+
+    # Record a transaction whose balance change is already applied,
+    # returning the account's new volume
+    def add_transaction(self, account_number, transaction_type, amount, balance_after, timestamp):
+        key = int(account_number)
+        with self.pool.write() as db:
+            (volume,) = db.execute(COUNT_TRANSACTION, (amount, key)).fetchone()
+            db.execute(INSERT_TRANSACTION, (key, TYPE_CODES[transaction_type], amount, balance_after, timestamp))
+        return volume
+
+    # The last day closed as an ISO date, or None
+    @property
+    def closed_day(self):
+        row = self._read(GET_SETTING, ("closed_day",))
+        return row[0] if row else None
+
+    # Post a day's interest and fees to every account in one transaction
+    # (see endofday.py): interest of balance * rate // divisor on positive
+    # balances, then `fee`, capped at the balance, on positive balances below
+    # `waiver`. A rate or fee of 0 posts none. `day`, an ISO date, is
+    # recorded as closed in the same transaction; ValueError if it isn't
+    # after the last day closed. Returns the id of the last transaction
+    # before the postings and {type: (count, cents)} of what was posted.
+    def post_day(self, rate, divisor, fee, waiver, timestamp, day):
+        with self.pool.write() as db:
+            closed = db.execute(GET_SETTING, ("closed_day",)).fetchone()
+            if closed is not None and day <= closed[0]:
+                raise ValueError(f"{day} is not after the last day closed, {closed[0]}")
+            db.execute(SET_SETTING, ("closed_day", day))
+            (last_id,) = db.execute(LAST_TRANSACTION_ID).fetchone()
+            if rate:
+                db.execute(RECORD_INTEREST, (rate, divisor, timestamp, TYPE_CODES["Interest"]))
+                db.execute(PAY_INTEREST, (rate, divisor))
+            if fee:
+                db.execute(RECORD_FEE, (fee, waiver, timestamp, TYPE_CODES["Fee"]))
+                db.execute(CHARGE_FEE, (fee, waiver))
+            totals = db.execute(POSTED_TOTALS, (last_id,)).fetchall()
+        return last_id, {TRANSACTION_TYPES[code]: (count, amount) for code, count, amount in totals}
+
+    # (account number, type, amount, balance after) of every transaction
+    # after the one with id `last_id`, in order
+    def transactions_after(self, last_id):
+        with self.pool.connection() as db:
+            for account, code, amount, balance_after in db.execute(TRANSACTIONS_AFTER, (last_id,)):
+                yield str(account), TRANSACTION_TYPES[code], amount, balance_after
+
+    # Reserve a PIN attempt before the PIN is checked: False if the card is
+    # locked at `now` or no attempts are left. The count is raised in the
+    # database, so attempts reserved by other processes are never lost.
+    def reserve_pin_attempt(self, account_number, max_attempts, now):
+        key = int(account_number)
+        with self.pool.write() as db:
+            return db.execute(RESERVE_PIN_ATTEMPT, (key, max_attempts, now)).fetchone() is not None
+
+    # Settle a reserved attempt, `others` being the attempts this process
+    # still has reserved. A right PIN clears the settled failures; a wrong
+    # one locks the card until `lock_until` once they reach `max_attempts`.
+    # Returns the settled failures and lock time, and whether they changed.
+    def settle_pin_attempt(self, account_number, correct, others, max_attempts, lock_until):
+        key = int(account_number)
+        with self.pool.write() as db:
+            failed, locked_until = db.execute(PIN_STATE, (key,)).fetchone()
+            # This check's own reservation counts as a failure until now
+            failed -= others
+            if correct:
+                changed = failed > 1
+                failed = 0
+            elif failed >= max_attempts:
+                failed, locked_until, changed = 0, lock_until, True
+            else:
+                return failed, locked_until, True
+            db.execute(SET_PIN_STATE, (failed + others, locked_until, key))
+        return failed, locked_until, changed
+
+    # One page of an account's history, as for history.page(): at most
+    # `limit` Transactions and a cursor for the next page (None when there
+    # are no more), read with LIMIT rather than loading the whole history.
+    # The cursor is a transaction id.
+    def query_transactions(self, account_number, limit, cursor=None, start=None, end=None, types=None,
+                           min_amount=None, max_amount=None, newest_first=False):
+        conditions = []
+        parameters = [int(account_number)]
+        for condition, value in ((" AND ts >= ?", start), (" AND ts <= ?", end),
+                                 (" AND amount >= ?", min_amount), (" AND amount <= ?", max_amount),
+                                 (" AND id < ?" if newest_first else " AND id > ?", cursor)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        if types is not None:
+            conditions.append(" AND type IN ({})".format(", ".join("?" * len(types))))
+            parameters.extend(TYPE_CODES[transaction_type] for transaction_type in types)
+        parameters.append(limit + 1)
+        sql = HISTORY_PAGE.format("".join(conditions), " DESC" if newest_first else "")
+        with self.pool.connection() as db:
+            rows = db.execute(sql, parameters).fetchall()
+        page = [Transaction(TRANSACTION_TYPES[code], amount, balance_after, timestamp)
+                for _, code, amount, balance_after, timestamp in rows[:limit]]
+        return page, rows[limit - 1][0] if len(rows) > limit else None
+
+    # The whole history; pages of it are cheaper with query_transactions
+    def transactions_of(self, account_number):
+        with self.pool.connection() as db:
+            rows = db.execute(HISTORY, (int(account_number),)).fetchall()
+        log = TransactionLog()
+        for code, amount, balance_after, timestamp in rows:
+            log.append(TRANSACTION_TYPES[code], amount, balance_after, timestamp)
+        return log
+
+    # Side data kept in the settings table as JSON, e.g. the dashboard
+    # totals, as AccountStore keeps it next to its file
+    def load_metadata(self):
+        row = self._read(GET_SETTING, ("metadata",))
+        return json.loads(row[0]) if row else None
+
+    def close(self, metadata=None):
+        if metadata is not None:
+            with self.pool.write() as db:
+                db.execute(SET_SETTING, ("metadata", json.dumps(metadata)))
+        self.pool.close()
+
+
+# Maps card numbers to account numbers, standing in for Atm.card_index
+class CardLookup:
+    def __init__(self, ledger):
+        self.ledger = ledger
+
+    def get(self, card_number, default=None):
+        row = self.ledger._read(ACCOUNT_BY_CARD, (card_number,))
+        return default if row is None else str(row[0])
+
+    def __contains__(self, card_number):
+        return self.ledger._read(ACCOUNT_BY_CARD, (card_number,)) is not None
+
+
+def _column(name, writable=False):
+    select = f"SELECT {name} FROM accounts WHERE number = ?"
+    update = f"UPDATE accounts SET {name} = ? WHERE number = ?"
+
+    def get(self):
+        return self._ledger._read(select, (self._key,))[0]
+
+    def set(self, value):
+        with self._ledger.pool.connection() as db:
+            db.execute(update, (value, self._key))
+
+    return property(get, set if writable else None)
+
+
+# A view of one account row with the attributes of records.Account that
+# the terminal, PIN checks and statements read. Like store.MappedAccount it
+# holds no state of its own, so every read is current. The balance, running
+# totals and PIN attempts are read-only: they only change through
+# SQLiteLedger's operations. The PIN and the name are written straight
+# through.
+class SQLAccount:
+    __slots__ = ('_ledger', '_key')
+
+    def __init__(self, ledger, key):
+        self._ledger = ledger
+        self._key = key
+
+    card_number = _column("card")
+    balance = _column("balance")
+    daily_limit = _column("daily_limit")
+    volume = _column("volume")
+    transaction_count = _column("transaction_count")
+    name = _column("name", writable=True)
+    pin_hash = _column("pin_hash", writable=True)
+    failed_attempts = _column("failed_attempts")
+    locked_until = _column("locked_until")
+
+    # A copy of the history as of this read
+    @property
+    def transactions(self):
+        return self._ledger.transactions_of(self._key)
@@ -0,0 +1,258 @@
+import argparse
+import datetime
+import html
+import sys
+import time
+from bisect import bisect_left, bisect_right
+
+import history
+from money import format_money
+from records import format_timestamp
+
+# Receipts and account statements rendered from the transaction log.
+#
+# Every renderer is a generator of text chunks, so the caller decides where
+# the text goes: the terminal writes a receipt in one call, and
+# write_statements() streams statements for every account through one
+# buffered file. Only one account's rows are in flight at a time and rows
+# are read lazily from the log (history.query), so a batch run over a
+# million accounts needs no more memory than a run over ten, beyond the
+# list of account numbers to visit.
+#
+# Statements come in three formats:
+#   text  fixed-width pages, one per account, separated by form feeds
+#   csv   one row per transaction plus opening and closing balance rows,
+#         with the account number on every row
+#   html  one document with a section per account
+ATM_ID = "ATM001"
+CREDIT_TYPES = frozenset(("Deposit", "Transfer In", "Interest"))
+WRITE_CHUNKS = 4096  # chunks joined into each write
+
+
+def _dollars(cents):
+    sign = "-" if cents < 0 else ""
+    return sign + "%d.%02d" % divmod(abs(cents), 100)
+
+
+def _masked_card(card_number):
+    return f"**** **** **** {card_number[-4:]}"
+
+
+def _banner(title, indent=20):
+    return "=" * 60 + "\n" + " " * indent + title + "\n" + "=" * 60 + "\n"
+
+
+def receipt_lines(account_number, account, transaction_type, amount, additional_info="", timestamp=None,
+                  atm_id=ATM_ID):
+    yield _banner("ATM TRANSACTION RECEIPT", indent=15)
+    yield f"\nDate: {format_timestamp(int(time.time()) if timestamp is None else timestamp)}\n"
+    yield f"ATM ID: {atm_id}\n"
+    yield f"Card: {_masked_card(account.card_number)}\n"
+    yield f"Account: {account_number}\n"
+    yield f"\nTransaction: {transaction_type}\n"
+    if additional_info:
+        yield additional_info + "\n"
+    yield f"Amount: {format_money(amount)}\n"
+    yield f"Balance: {format_money(account.balance)}\n"
+    yield "\nThank you for using our ATM!\n"
+
+
+def _text_row(transaction):
+    return (f"{transaction.type:<12} {format_money(transaction.amount):<10} "
+            f"{format_money(transaction.balance_after):<15} {format_timestamp(transaction.timestamp)}\n")
+
+
+# The recent-transactions table shown at the ATM, oldest first
+def history_lines(transactions):
+    yield "-" * 60 + "\n"
+    yield f"{'Type':<12} {'Amount':<10} {'Balance':<15} {'Date & Time'}\n"
+    yield "-" * 60 + "\n"
+    for transaction in transactions:
+        yield _text_row(transaction)
+
+
+# First day of the month and the last second of it, as inclusive epoch
+# seconds in local time, for "YYYY-MM"
+def month_bounds(month):
+    first = datetime.datetime.strptime(month, "%Y-%m")
+    following = (first + datetime.timedelta(days=32)).replace(day=1)
+    return int(first.timestamp()), int(following.timestamp()) - 1
+
+
+# Opening and closing balances of an account over [start, end], from the
+# balance recorded with the rows around the period. An account with no
+# history at all (such as one reopened from the account store, which keeps
+# no history) has held its current balance throughout.
+def _period_balances(account, start, end):
+    log = account.transactions
+    if not len(log):
+        return account.balance, account.balance
+    first = bisect_left(log.timestamps, start)
+    last = bisect_right(log.timestamps, end)
+    if first < len(log):
+        transaction = log[first]
+        signed = transaction.amount if transaction.type in CREDIT_TYPES else -transaction.amount
+        opening = transaction.balance_after - signed
+    else:
+        opening = log.balances[-1]
+    closing = log.balances[last - 1] if last > first else opening
+    return opening, closing
+
+
+# One account's rows for the period, oldest first, with running totals of
+# money in and out kept in `totals` for the statement footer
+def _period_rows(account, start, end, totals):
+    for _, transaction in history.query(account.transactions, start=start, end=end):
+        totals[transaction.type in CREDIT_TYPES] += transaction.amount
+        yield transaction
+
+
+def _text_statement(account_number, account, start, end):
+    opening, closing = _period_balances(account, start, end)
+    totals = [0, 0]  # [money out, money in]
+    yield _banner("ACCOUNT STATEMENT")
+    yield f"\nAccount: {account_number}\n"
+    yield f"Name: {account.name}\n"
+    yield f"Card: {_masked_card(account.card_number)}\n"
+    yield f"Period: {format_timestamp(start)} to {format_timestamp(end)}\n"
+    yield f"\nOpening balance: {format_money(opening)}\n"
+    yield from history_lines(_period_rows(account, start, end, totals))
+    yield "-" * 60 + "\n"
+    yield f"Money in: {format_money(totals[1])}\n"
+    yield f"Money out: {format_money(totals[0])}\n"
+    yield f"Closing balance: {format_money(closing)}\n"
+    yield "\f"
+
+
+CSV_HEADER = "account_number,date,type,amount,balance\n"
+
+
+def _csv_statement(account_number, account, start, end):
+    opening, closing = _period_balances(account, start, end)
+    yield f"{account_number},{format_timestamp(start)},Opening Balance,,{_dollars(opening)}\n"
+    for transaction in _period_rows(account, start, end, [0, 0]):
+        yield (f"{account_number},{format_timestamp(transaction.timestamp)},{transaction.type},"
+               f"{_dollars(transaction.amount)},{_dollars(transaction.balance_after)}\n")
+    yield f"{account_number},{format_timestamp(end)},Closing Balance,,{_dollars(closing)}\n"
+
+
+HTML_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Account statements</title>
+<style>
+section { page-break-after: always; }
+table { border-collapse: collapse; }
+th, td { padding: 2px 12px; text-align: left; }
+td.amount { text-align: right; }
+</style>
+</head>
+<body>
+"""
+HTML_TAIL = "</body>\n</html>\n"
+
+
+def _html_statement(account_number, account, start, end):
+    opening, closing = _period_balances(account, start, end)
+    totals = [0, 0]
+    yield f'<section id="account-{account_number}">\n<h2>Account {account_number}</h2>\n'
+    yield (f"<p>{html.escape(account.name)}<br>Card {_masked_card(account.card_number)}<br>"
+           f"{format_timestamp(start)} to {format_timestamp(end)}</p>\n")
+    yield f"<p>Opening balance: {format_money(opening)}</p>\n"
+    yield "<table>\n<tr><th>Date &amp; Time</th><th>Type</th><th>Amount</th><th>Balance</th></tr>\n"
+    for transaction in _period_rows(account, start, end, totals):
+        yield (f"<tr><td>{format_timestamp(transaction.timestamp)}</td><td>{transaction.type}</td>"
+               f'<td class="amount">{format_money(transaction.amount)}</td>'
+               f'<td class="amount">{format_money(transaction.balance_after)}</td></tr>\n')
+    yield "</table>\n"
+    yield (f"<p>Money in: {format_money(totals[1])}<br>Money out: {format_money(totals[0])}<br>"
+           f"Closing balance: {format_money(closing)}</p>\n</section>\n")
+
+
+# format -> (text before the first statement, statement renderer, text
+# after the last)
+STATEMENT_FORMATS = {
+    'text': ("", _text_statement, ""),
+    'csv': (CSV_HEADER, _csv_statement, ""),
+    'html': (HTML_HEAD, _html_statement, HTML_TAIL),
+}
+
+
+def statement_chunks(accounts, account_numbers, start, end, fmt='text'):
+    head, render, tail = STATEMENT_FORMATS[fmt]
+    yield head
+    for account_number in account_numbers:
+        yield from render(account_number, accounts[account_number], start, end)
+    yield tail
+
+
+# Write chunks to a text stream, joining them into large writes instead of
+# one write per line
+def write_chunks(stream, chunks):
+    buffer = []
+    for chunk in chunks:
+        buffer.append(chunk)
+        if len(buffer) == WRITE_CHUNKS:
+            stream.write("".join(buffer))
+            buffer.clear()
+    stream.write("".join(buffer))
+
+
+# Stream statements for the period [start, end] for every account in
+# `accounts` (or just `account_numbers`), returning how many were written
+def write_statements(stream, accounts, start, end, fmt='text', account_numbers=None):
+    if account_numbers is None:
+        account_numbers = list(accounts)
+    write_chunks(stream, statement_chunks(accounts, account_numbers, start, end, fmt))
+    return len(account_numbers)
+
+
+def write_statements_file(path, accounts, start, end, fmt='text', account_numbers=None):
+    with open(path, "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+        return write_statements(f, accounts, start, end, fmt, account_numbers)
+
+
+def _last_month():
+    first_of_this_month = datetime.date.today().replace(day=1)
+    return (first_of_this_month - datetime.timedelta(days=1)).strftime("%Y-%m")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render monthly account statements")
+    parser.add_argument("--month", default=_last_month(), help="statement month as YYYY-MM (default: last month)")
+    parser.add_argument("--format", choices=sorted(STATEMENT_FORMATS), default='text')
+    parser.add_argument("--output", help="write statements here instead of to standard output")
+    parser.add_argument("--account", action="append", dest="account_numbers", metavar="NUMBER",
+                        help="only this account (may be repeated)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--journal", metavar="DIR", help="journal directory holding the accounts")
+    source.add_argument("--store", metavar="FILE",
+                        help="memory-mapped account file holding the accounts (balances only: it keeps no history)")
+    args = parser.parse_args()
+
+    import Atm
+    start, end = month_bounds(args.month)
+    if args.journal:
+        Atm.open_journal(args.journal)
+    else:
+        Atm.open_store(args.store)
+        print("warning: the account store keeps no transaction history, so statements show each account's "
+              "current balance as its opening and closing balance and list no transactions", file=sys.stderr)
+    try:
+        unknown = [number for number in args.account_numbers or () if number not in Atm.accounts]
+        if unknown:
+            parser.error(f"unknown account {unknown[0]}")
+        if args.output:
+            count = write_statements_file(args.output, Atm.accounts, start, end, args.format,
+                                          args.account_numbers)
+            print(f"Wrote {count} statements to {args.output}")
+        else:
+            write_statements(sys.stdout, Atm.accounts, start, end, args.format, args.account_numbers)
+    finally:
+        Atm.close_journal()
+        Atm.close_store()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import datetime
+import threading
+
+HOURS_TRACKED = 24
+MINUTES_TRACKED = 60
+
+
+# Running totals for the admin dashboard, updated in O(1) per transaction
+# so reading them never rescans accounts or histories.
+#
+# Per-hour withdrawals and per-minute throughput live in ring buffers whose
+# slots are stamped with the hour/minute they hold; a slot is reset lazily
+# when a later hour/minute lands on it. Top accounts by volume are a
+# bounded set: volumes only grow, so an account only has to be compared
+# with the smallest volume in the set, which is kept up to date as members
+# grow too.
+class AtmStats:
+    def __init__(self, top_k=10):
+        self.lock = threading.Lock()
+        self.top_k = top_k
+        self.account_count = 0
+        self.deposits_held = 0  # sum of all balances, cents
+        self.transaction_count = 0
+        self.dispensed_total = 0
+        self.dispensed_today = 0
+        self._day_start = 0
+        self._day_end = 0
+        self.hourly = [[None, 0, 0] for _ in range(HOURS_TRACKED)]  # [hour, withdrawals, cents]
+        self.minutes = [[None, 0] for _ in range(MINUTES_TRACKED)]  # [minute, transactions]
+        self.top = {}  # account number -> volume
+        self._top_floor = 0
+
+    def record_account(self):
+        with self.lock:
+            self.account_count += 1
+
+    def record(self, account_number, transaction_type, amount, timestamp, volume):
+        with self.lock:
+            self.transaction_count += 1
+            if transaction_type == "Deposit" or transaction_type == "Interest":
+                self.deposits_held += amount
+            elif transaction_type == "Withdrawal":
+                self.deposits_held -= amount
+                self._record_withdrawal(amount, timestamp)
+            elif transaction_type == "Fee":
+                self.deposits_held -= amount
+
+            minute = timestamp // 60
+            slot = self.minutes[minute % MINUTES_TRACKED]
+            if slot[0] != minute:
+                slot[0], slot[1] = minute, 0
+            slot[1] += 1
+
+            previous = self.top.get(account_number)
+            if previous is not None:
+                self.top[account_number] = volume
+                # Only the member at the floor can move it
+                if previous == self._top_floor:
+                    self._top_floor = min(self.top.values())
+            elif len(self.top) < self.top_k:
+                self.top[account_number] = volume
+                self._top_floor = min(self.top.values())
+            elif volume > self._top_floor:
+                del self.top[min(self.top, key=self.top.get)]
+                self.top[account_number] = volume
+                self._top_floor = min(self.top.values())
+
+    # Fold in `count` transactions posted in bulk rather than through
+    # record(), such as end-of-day interest and fees, that moved the
+    # deposits held by `net` cents. They don't count towards throughput or
+    # the top accounts.
+    def record_batch(self, count, net):
+        with self.lock:
+            self.transaction_count += count
+            self.deposits_held += net
+
+    def _record_withdrawal(self, amount, timestamp):
+        self.dispensed_total += amount
+        # Older days (e.g. while replaying a journal) don't touch the day counter
+        if timestamp >= self._day_end:
+            day = datetime.date.fromtimestamp(timestamp)
+            self._day_start = int(datetime.datetime.combine(day, datetime.time()).timestamp())
+            self._day_end = int(datetime.datetime.combine(day + datetime.timedelta(days=1),
+                                                          datetime.time()).timestamp())
+            self.dispensed_today = 0
+        if timestamp >= self._day_start:
+            self.dispensed_today += amount
+
+        hour = timestamp // 3600
+        slot = self.hourly[hour % HOURS_TRACKED]
+        if slot[0] != hour:
+            slot[0], slot[1], slot[2] = hour, 0, 0
+        slot[1] += 1
+        slot[2] += amount
+
+    # Cash dispensed so far today, 0 once the day has rolled over
+    def dispensed_on(self, now):
+        return self.dispensed_today if self._day_start <= now < self._day_end else 0
+
+    # (hour start, withdrawals, cents) for the last HOURS_TRACKED hours, oldest first
+    def withdrawals_per_hour(self, now):
+        current = now // 3600
+        rows = []
+        for hour in range(current - HOURS_TRACKED + 1, current + 1):
+            slot = self.hourly[hour % HOURS_TRACKED]
+            count, amount = (slot[1], slot[2]) if slot[0] == hour else (0, 0)
+            rows.append((hour * 3600, count, amount))
+        return rows
+
+    # (minute start, transactions) for the last `minutes` minutes, oldest first
+    def throughput(self, now, minutes=MINUTES_TRACKED):
+        current = now // 60
+        rows = []
+        for minute in range(current - min(minutes, MINUTES_TRACKED) + 1, current + 1):
+            slot = self.minutes[minute % MINUTES_TRACKED]
+            rows.append((minute * 60, slot[1] if slot[0] == minute else 0))
+        return rows
+
+    def top_accounts(self):
+        return sorted(self.top.items(), key=lambda item: item[1], reverse=True)
+
+    def to_dict(self):
+        with self.lock:
+            return {key: value for key, value in self.__dict__.items() if key != 'lock'}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data['top_k'])
+        stats.__dict__.update(data)
+        return stats
@@ -0,0 +1,383 @@
+import datetime
+import functools
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+
+import pins
+from records import TransactionLog
+
+STORE_MAGIC = b"ATMSTOR2"
+HEADER = struct.Struct("<8sQQQ")  # magic, record size, record count, next account sequence
+HEADER_WORDS = 8  # the header is padded to 64 bytes
+CLOSED_DAY = 4  # header word: ordinal of the last day closed (see endofday.py), 0 for none
+
+# Record layout, in 8-byte words: the numeric fields first, then the salt,
+# PIN hash and name as raw bytes
+(ACCOUNT_NUMBER, CARD_NUMBER, BALANCE, DAILY_LIMIT, DAILY_WITHDRAWALS, WITHDRAW_DAY, VOLUME,
+ TRANSACTION_COUNT, FAILED_ATTEMPTS, LOCKED_UNTIL, PIN_ITERATIONS) = range(11)
+SALT_OFFSET = 88
+PIN_HASH_OFFSET = 104
+NAME_OFFSET = 136
+NAME_SIZE = 48
+RECORD_WORDS = 23
+RECORD_SIZE = RECORD_WORDS * 8
+
+MASK64 = (1 << 64) - 1
+
+
+# Fixed-record account file, memory-mapped and read and written in place.
+#
+# Each account is one 184-byte record: account number, card number,
+# balance, daily limit and daily withdrawals (cents), the day of the last
+# withdrawal, the running volume and transaction count, failed PIN
+# attempts and lockout time, the PIN hash (see pins.py) and the name.
+# Opening the file reads only the header, so startup costs the same for ten
+# accounts or ten million, and the OS pages records in as they're touched.
+# Writes land in the shared mapping straight away, so they survive the
+# process dying; close() or flush() pushes them to disk.
+#
+# Account and card numbers are found through two on-disk hash indexes (see
+# HashIndex). Records are never deleted. The store behaves as a read-only
+# mapping of account number to MappedAccount, so it can stand in for the
+# `accounts` dict; new accounts go through create().
+#
+# Transaction histories are kept in memory per process, as they are for
+# in-memory accounts.
+class AccountStore(Mapping):
+    def __init__(self, path, capacity=1024):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(HEADER.pack(STORE_MAGIC, RECORD_SIZE, 0, 0).ljust(HEADER_WORDS * 8, b"\0"))
+                f.truncate(HEADER_WORDS * 8 + capacity * RECORD_SIZE)
+        self._file = open(path, "r+b")
+        self._retired = []
+        self._map()
+        magic, record_size, _, _ = HEADER.unpack_from(self._mmap)
+        if magic != STORE_MAGIC or record_size != RECORD_SIZE:
+            self.close()
+            raise ValueError(f"{path} is not an account store")
+        self.by_number = HashIndex(path + ".accounts", len(self))
+        self.by_card = HashIndex(path + ".cards", len(self))
+        self.cards = CardIndex(self)
+        self._logs = {}  # record index -> TransactionLog
+
+    def _map(self):
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._words = memoryview(self._mmap).cast('q')
+        self.capacity = (len(self._mmap) - HEADER_WORDS * 8) // RECORD_SIZE
+
+    # Extend the file and map it again. Old mappings share the same pages,
+    # so a reader still holding one sees every write; they are only closed
+    # with the store.
+    def _grow(self):
+        self._retired.append((self._words, self._mmap))
+        self._file.truncate(HEADER_WORDS * 8 + 2 * self.capacity * RECORD_SIZE)
+        self._map()
+
+    @property
+    def next_seq(self):
+        return self._words[3]
+
+    # The last day closed as an ISO date, or None
+    @property
+    def closed_day(self):
+        ordinal = self._words[CLOSED_DAY]
+        return datetime.date.fromordinal(ordinal).isoformat() if ordinal else None
+
+    @closed_day.setter
+    def closed_day(self, day):
+        self._words[CLOSED_DAY] = datetime.date.fromisoformat(day).toordinal()
+
+    def __len__(self):
+        return self._words[2]
+
+    def _index_of(self, account_number):
+        if not account_number.isdigit() or account_number[0] == "0":
+            return None
+        number = int(account_number)
+        index = self.by_number.get(number)
+        # An index entry past the count, or for a reused record, is left over
+        # from a create that didn't finish
+        if index is None or index >= self._words[2] or self._words[HEADER_WORDS + index * RECORD_WORDS] != number:
+            return None
+        return index
+
+    def __getitem__(self, account_number):
+        index = self._index_of(account_number)
+        if index is None:
+            raise KeyError(account_number)
+        return MappedAccount(self, index)
+
+    def get(self, account_number, default=None):
+        index = self._index_of(account_number)
+        return default if index is None else MappedAccount(self, index)
+
+    def __contains__(self, account_number):
+        return self._index_of(account_number) is not None
+
+    def __iter__(self):
+        words = self._words
+        for index in range(words[2]):
+            yield str(words[HEADER_WORDS + index * RECORD_WORDS])
+
+    # Add an account with a zero balance. Callers serialise creates (Atm
+    # holds registry_lock). The record and indexes are written before the
+    # count is bumped, so a crash mid-create leaves no half-made account.
+    def create(self, account_number, card_number, name, pin_hash, daily_limit, next_seq):
+        index = self._words[2]
+        if index == self.capacity:
+            self._grow()
+        words = self._words
+        base = HEADER_WORDS + index * RECORD_WORDS
+        words[base:base + RECORD_WORDS] = memoryview(bytes(RECORD_SIZE)).cast('q')
+        words[base + ACCOUNT_NUMBER] = int(account_number)
+        words[base + CARD_NUMBER] = int(card_number)
+        words[base + DAILY_LIMIT] = daily_limit
+        account = MappedAccount(self, index)
+        account.name = name
+        account.pin_hash = pin_hash
+        self.by_number.put(int(account_number), index)
+        self.by_card.put(int(card_number), index)
+        words[3] = next_seq
+        words[2] = index + 1
+        return account
+
+    # The records in use as one memoryview of 8-byte words, RECORD_WORDS per
+    # account in record order, for batch jobs that work a field at a time
+    # across every account (see endofday.py). Release it before the store
+    # grows or is closed.
+    def record_words(self):
+        return self._words[HEADER_WORDS:HEADER_WORDS + len(self) * RECORD_WORDS]
+
+    # (record index, TransactionLog) for each history this process has loaded
+    def histories(self):
+        return self._logs.items()
+
+    def flush(self):
+        self._mmap.flush()
+        self.by_number.flush()
+        self.by_card.flush()
+
+    # Side data kept next to the store as JSON, e.g. the dashboard totals
+    def load_metadata(self):
+        try:
+            with open(self.path + ".meta", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def close(self, metadata=None):
+        if metadata is not None:
+            tmp_path = self.path + ".meta.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, self.path + ".meta")
+        if hasattr(self, 'by_number'):
+            self.by_number.close()
+            self.by_card.close()
+        for words, mapping in self._retired + [(self._words, self._mmap)]:
+            words.release()
+            mapping.flush()
+            mapping.close()
+        self._retired = []
+        self._file.close()
+
+
+# Maps card numbers to account numbers through the store's card index, so
+# it can stand in for Atm.card_index
+class CardIndex:
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, card_number, default=None):
+        if not card_number.isdigit():
+            return default
+        store = self.store
+        number = int(card_number)
+        index = store.by_card.get(number)
+        if index is None or index >= store._words[2]:
+            return default
+        base = HEADER_WORDS + index * RECORD_WORDS
+        if store._words[base + CARD_NUMBER] != number:
+            return default
+        return str(store._words[base + ACCOUNT_NUMBER])
+
+    def __contains__(self, card_number):
+        return self.get(card_number) is not None
+
+
+@functools.lru_cache(maxsize=16)
+def _iso_date(ordinal):
+    return datetime.date.fromordinal(ordinal).isoformat() if ordinal else ""
+
+
+@functools.lru_cache(maxsize=16)
+def _ordinal(iso_date):
+    return datetime.date.fromisoformat(iso_date).toordinal() if iso_date else 0
+
+
+def _word_field(field):
+    def get(self):
+        return self._store._words[self._base + field]
+
+    def set(self, value):
+        self._store._words[self._base + field] = value
+
+    return property(get, set)
+
+
+# A view of one record with the same attributes as records.Account. Views
+# are cheap and made on every lookup; they hold no state of their own.
+class MappedAccount:
+    __slots__ = ('_store', '_index', '_base')
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+        self._base = HEADER_WORDS + index * RECORD_WORDS
+
+    balance = _word_field(BALANCE)
+    daily_limit = _word_field(DAILY_LIMIT)
+    daily_withdrawals = _word_field(DAILY_WITHDRAWALS)
+    volume = _word_field(VOLUME)
+    transaction_count = _word_field(TRANSACTION_COUNT)
+    failed_attempts = _word_field(FAILED_ATTEMPTS)
+    locked_until = _word_field(LOCKED_UNTIL)
+
+    @property
+    def card_number(self):
+        return "%016d" % self._store._words[self._base + CARD_NUMBER]
+
+    @property
+    def last_withdraw_date(self):
+        return _iso_date(self._store._words[self._base + WITHDRAW_DAY])
+
+    @last_withdraw_date.setter
+    def last_withdraw_date(self, value):
+        self._store._words[self._base + WITHDRAW_DAY] = _ordinal(value)
+
+    @property
+    def name(self):
+        start = self._base * 8 + NAME_OFFSET
+        return self._store._mmap[start:start + NAME_SIZE].rstrip(b"\0").decode("utf-8", "ignore")
+
+    @name.setter
+    def name(self, value):
+        start = self._base * 8 + NAME_OFFSET
+        self._store._mmap[start:start + NAME_SIZE] = value.encode("utf-8")[:NAME_SIZE].ljust(NAME_SIZE, b"\0")
+
+    # The iteration count, salt and hash are stored as raw fields and read
+    # and written in pins.py's string form
+    @property
+    def pin_hash(self):
+        start = self._base * 8
+        record = self._store._mmap
+        return pins.join_hash(self._store._words[self._base + PIN_ITERATIONS],
+                              record[start + SALT_OFFSET:start + PIN_HASH_OFFSET],
+                              record[start + PIN_HASH_OFFSET:start + NAME_OFFSET])
+
+    @pin_hash.setter
+    def pin_hash(self, value):
+        iterations, salt, digest = pins.split_hash(value)
+        start = self._base * 8
+        self._store._mmap[start + SALT_OFFSET:start + NAME_OFFSET] = salt + digest
+        self._store._words[self._base + PIN_ITERATIONS] = iterations
+
+    @property
+    def transactions(self):
+        log = self._store._logs.get(self._index)
+        if log is None:
+            log = self._store._logs.setdefault(self._index, TransactionLog())
+        return log
+
+
+# Open-addressing hash table from 64-bit keys to record indexes, in a
+# memory-mapped file of (key + 1, value) word pairs; a zero key marks an
+# empty slot. Linear probing on a multiplicative hash. The table doubles,
+# rebuilt into a new file swapped in with os.replace, once it is half full.
+# The store passes in how many keys the table holds, so opening it doesn't
+# have to scan it.
+class HashIndex:
+    def __init__(self, path, count, capacity=2048):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.truncate(capacity * 16)
+        self._open()
+        self.count = count
+
+    def _open(self):
+        with open(self.path, "r+b") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0)
+        self._words = memoryview(self._mmap).cast('Q')
+        self.capacity = len(self._words) // 2
+        self._mask = self.capacity - 1
+        self._shift = 64 - self.capacity.bit_length() + 1
+
+    def _slot(self, key):
+        return (key * 0x9E3779B97F4A7C15 & MASK64) >> self._shift
+
+    def get(self, key):
+        words = self._words
+        mask = self._mask
+        slot = (key * 0x9E3779B97F4A7C15 & MASK64) >> self._shift
+        key += 1
+        while True:
+            stored = words[2 * slot]
+            if stored == key:
+                return words[2 * slot + 1]
+            if stored == 0:
+                return None
+            slot = (slot + 1) & mask
+
+    # Insert or overwrite. Callers serialise writes.
+    def put(self, key, value):
+        if 2 * (self.count + 1) > self.capacity:
+            self._rebuild(2 * self.capacity)
+        words = self._words
+        slot = self._slot(key)
+        key += 1
+        while words[2 * slot] not in (0, key):
+            slot = (slot + 1) & self._mask
+        if words[2 * slot] == 0:
+            self.count += 1
+        # Value before key, so a concurrent reader never sees a key without it
+        words[2 * slot + 1] = value
+        words[2 * slot] = key
+
+    def _rebuild(self, capacity):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.truncate(capacity * 16)
+        with open(tmp_path, "r+b") as f:
+            mapping = mmap.mmap(f.fileno(), 0)
+        new_words = memoryview(mapping).cast('Q')
+        mask = capacity - 1
+        shift = 64 - capacity.bit_length() + 1
+        old_words = self._words
+        for slot in range(self.capacity):
+            key = old_words[2 * slot]
+            if key:
+                new_slot = ((key - 1) * 0x9E3779B97F4A7C15 & MASK64) >> shift
+                while new_words[2 * new_slot]:
+                    new_slot = (new_slot + 1) & mask
+                new_words[2 * new_slot + 1] = old_words[2 * slot + 1]
+                new_words[2 * new_slot] = key
+        new_words.release()
+        mapping.flush()
+        mapping.close()
+        os.replace(tmp_path, self.path)
+        # Readers may still hold the old mapping, which stays valid; it is
+        # dropped with its last reference
+        self._open()
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        self._words.release()
+        self._mmap.close()